@@ -36,7 +36,9 @@ class MainWindow(QWidget):
         ('Push selections down', 'PushSelectionDownOptimizator'),
         ('Cartesian product to Join', 'CartesianProductToThetaJoinOptimizator'),
         ('Enumeration-based optimization', 'EnumerationBasedOptimizator'),
-        ('Greedy-based optimization', 'GreedyOptimizator')
+        ('Greedy-based optimization', 'GreedyOptimizator'),
+        ('Dynamic programming join order', 'DPccpJoinOrderOptimizator'),
+        ('Push projections down', 'ProjectionPushDownOptimizator')
     ]
 
     def __init__(self, schema):
@@ -169,16 +171,19 @@ class ResultWindow(QWidget):
         def aux(root):
             item = QStandardItem(str(root))
             table_size = QStandardItem(str(root.table_size))
+            estimated_size = QStandardItem(
+                '' if root.estimated_size is None else "%.0f" % root.estimated_size)
             time_duration = QStandardItem("%.2f ms" % (root.time_duration * 1000.0))
 
             if isinstance(root, megadb.tree.TreeNode):
                 for c in root.children:
                     item.appendRow(aux(c))
 
-            return [item, table_size, time_duration]
+            return [item, table_size, estimated_size, time_duration]
 
         self.tree_model = QStandardItemModel(self)
-        self.tree_model.setHorizontalHeaderLabels(['Node', 'Table size', 'Time consumed'])
+        self.tree_model.setHorizontalHeaderLabels(['Node', 'Table size', 'Estimated size',
+                                                   'Time consumed'])
         self.tree_model.appendRow(aux(tree))
 
     def build_tuples(self, tuples):
@@ -0,0 +1,139 @@
+"""Immutable logical plans with structural sharing.
+
+A FrozenNode is the value of a logical plan node: its type, its
+arguments (the relation name, projected fields or conditions) and its
+children, all immutable. Deriving a plan from another only builds the
+nodes on the path to the change (see FrozenNode.replace), every other
+subtree is shared between the two. Nodes compare by value and their
+hash is computed once, so plans found along different ways can be
+deduplicated with a set and estimates of a subtree memoized per node.
+
+freeze() turns a tree of megadb.algebra.plan nodes into a FrozenNode,
+thaw() builds a new mutable tree from one.
+"""
+import megadb.algebra.plan as logical
+
+# the attribute holding the arguments of each type of node
+ARGUMENTS = {
+    logical.Relation: 'name',
+    logical.Projection: 'fields',
+    logical.Selection: 'conds',
+    logical.ThetaJoin: 'conds'
+}
+
+def value_key(value):
+    """Hashable key of a field, literal or condition"""
+    if isinstance(value, logical.Field):
+        return (value.namespace, value.name)
+    elif isinstance(value, logical.Comparison):
+        return (value_key(value.x), value.comp, value_key(value.y))
+    elif isinstance(value, tuple):
+        return tuple(value_key(v) for v in value)
+    elif value is None or isinstance(value, (basestring, int, long, float)):
+        return value
+    # e.g. the sqlparse identifier naming a relation
+    return str(value)
+
+class FrozenNode(object):
+    __slots__ = ('type', 'args', 'children', 'key', 'hash')
+
+    def __init__(self, type, args=None, children=()):
+        children = tuple(children)
+        key = (type, value_key(args), children)
+
+        object.__setattr__(self, 'type', type)
+        object.__setattr__(self, 'args', args)
+        object.__setattr__(self, 'children', children)
+        object.__setattr__(self, 'key', key)
+        object.__setattr__(self, 'hash', hash(key))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FrozenNode is immutable")
+
+    def __hash__(self):
+        return self.hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, FrozenNode) or self.hash != other.hash:
+            return False
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        if self.args is None:
+            return self.type.__name__
+        return "%s: %s" % (self.type.__name__, list(self.args) if isinstance(self.args, tuple)
+                           else self.args)
+
+    def is_a(self, cls):
+        return issubclass(self.type, cls)
+
+    def with_children(self, children):
+        """The same node over children"""
+        return FrozenNode(self.type, self.args, children)
+
+    def find(self, cls):
+        """Path (child indexes) to the first node of type cls, in pre-order,
+        or None"""
+        if self.is_a(cls):
+            return ()
+
+        for inx, c in enumerate(self.children):
+            path = c.find(cls)
+            if path is not None:
+                return (inx,) + path
+        return None
+
+    def get(self, path):
+        node = self
+        for inx in path:
+            node = node.children[inx]
+        return node
+
+    def replace(self, path, node):
+        """This plan with the node at path replaced by node, sharing the
+        subtrees off the path"""
+        if not path:
+            return node
+
+        children = list(self.children)
+        children[path[0]] = children[path[0]].replace(path[1:], node)
+        return self.with_children(children)
+
+def freeze(node):
+    """FrozenNode of the tree rooted at node"""
+    children = [freeze(c) for c in getattr(node, 'children', [])]
+
+    args = None
+    if type(node) in ARGUMENTS:
+        args = getattr(node, ARGUMENTS[type(node)])
+        if isinstance(args, list):
+            args = tuple(args)
+
+    return FrozenNode(type(node), args, children)
+
+def thaw(plan, parent=None):
+    """New mutable tree of a FrozenNode, below parent"""
+    args = plan.args
+    if plan.type in ARGUMENTS:
+        node = plan.type(parent, list(args) if isinstance(args, tuple) else args)
+    else:
+        node = plan.type(parent)
+
+    for c in plan.children:
+        thaw(c, node)
+    return node
+
+def distinct_plans(plans):
+    """plans without the duplicates, in order"""
+    seen = set()
+    result = []
+    for plan in plans:
+        if plan not in seen:
+            seen.add(plan)
+            result.append(plan)
+    return result
@@ -0,0 +1,128 @@
+"""Synthetic data for the schema of relations/Schema at any scale.
+
+Scale 1 gives about as many rows as the sample relations (900 Students,
+1812 Grades, ...); every relation grows linearly with the scale, except
+Colleges which keeps at least its six sample names. Foreign keys always
+point at existing rows, and the values the test queries of main.py look
+for (the College of Computing, the Computer Science program, the
+student Sydell Hamill, the year 2013) are always there. The same scale
+and seed give the same files.
+
+    $ python -m megadb.benchmark.generator directory [--scale S] [--seed N]
+"""
+import os
+import random
+import argparse
+
+SCHEMA = """Colleges(CollegeId:INT,CollegeName:STR)
+Courses(CourseId:INT,CourseName:STR,CollegeId:INT)
+Grades(StudentId:INT,SessionId:INT,grade:STR)
+Professors(ProfessorId:INT,ProfessorName:STR,CollegeID:INT)
+Programs(ProgramId:STR,ProgramName:STR,CollegeId:INT)
+Sessions(SessionId:INT,year:INT,place:STR,ProfessorId:INT,CourseId:INT)
+Students(StudentId:INT,StudentName:STR,StudentGender:STR,StudentDegree:STR,ProgramId:STR)
+"""
+
+# rows of each relation at scale 1
+BASE_SIZES = {
+    'Colleges': 6,
+    'Programs': 34,
+    'Students': 900,
+    'Grades': 1812,
+    'Sessions': 250,
+    'Courses': 100,
+    'Professors': 250
+}
+
+COLLEGE_NAMES = ['College of Architecture', 'College of Computing', 'College of Engineering',
+                 'Ivan Allen College of Liberal Arts', 'Scheller College of Business',
+                 'College of Sciences']
+PROGRAMS = [('CS', 'Computer Science'), ('AE', 'Aerospace Engineering'),
+            ('AM', 'Applied Mathematics'), ('ECE', 'Electrical and Computer Engineering'),
+            ('IA', 'International Affairs'), ('PP', 'Public Policy')]
+FIRST_NAMES = ['Lindy', 'Basil', 'Lucie', 'Brandie', 'Omarion', 'Nathalie', 'Sydell', 'Rosa',
+               'Hugo', 'Maia', 'Tobias', 'Ines', 'Camden', 'Freya', 'Ezra', 'Leona']
+LAST_NAMES = ['Kihn', 'Jacobi', 'Weimann', 'Hoppe', 'Stokes', 'Schinner', 'Hamill', 'Marks',
+              'Okuneva', 'Bauch', 'Ritchie', 'Larkin', 'Feeney', 'Pouros', 'Kozey', 'Lind']
+PLACES = ['Atlanta', 'Korea', 'Lorrain', 'Savannah', 'Shanghai', 'Shenzhen', 'Singapore']
+YEARS = [2010, 2011, 2012, 2013, 2014]
+GRADES = ['A', 'B', 'C', 'F', 'X']
+DEGREES = ['BS', 'MS', 'PhD']
+GENDERS = ['M', 'F']
+
+FIRST_STUDENT_ID = 903062100
+FIRST_PROFESSOR_ID = 96901100
+
+def relation_sizes(scale):
+    sizes = dict((name, max(1, int(round(size * scale)))) for name, size in BASE_SIZES.items())
+    sizes['Colleges'] = max(sizes['Colleges'], len(COLLEGE_NAMES))
+    sizes['Programs'] = max(sizes['Programs'], len(PROGRAMS))
+    return sizes
+
+def write_relation(directory, name, rows):
+    with open(os.path.join(directory, name), 'w') as f:
+        for row in rows:
+            f.write('#'.join([str(v) for v in row]) + '\n')
+
+def generate(directory, scale=1, seed=0):
+    """Write the Schema file and every relation into directory.
+
+    Returns {relation name: number of rows}.
+    """
+    rng = random.Random(seed)
+    sizes = relation_sizes(scale)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(os.path.join(directory, 'Schema'), 'w') as f:
+        f.write(SCHEMA)
+
+    def name():
+        return '%s %s' % (rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES))
+
+    def college():
+        return rng.randint(1, sizes['Colleges'])
+
+    colleges = COLLEGE_NAMES + ['College %d' % i
+                                for i in range(len(COLLEGE_NAMES) + 1, sizes['Colleges'] + 1)]
+    write_relation(directory, 'Colleges', ((i + 1, n) for i, n in enumerate(colleges)))
+
+    programs = PROGRAMS + [('P%d' % i, 'Program %d' % i)
+                           for i in range(len(PROGRAMS), sizes['Programs'])]
+    write_relation(directory, 'Programs', ((code, n, college()) for code, n in programs))
+
+    def students():
+        yield (FIRST_STUDENT_ID, 'Sydell Hamill', 'M', 'BS', 'CS')
+        for i in xrange(1, sizes['Students']):
+            yield (FIRST_STUDENT_ID + i, name(), rng.choice(GENDERS), rng.choice(DEGREES),
+                   rng.choice(programs)[0])
+    write_relation(directory, 'Students', students())
+
+    write_relation(directory, 'Courses', ((i, 'Course %d' % i, college())
+                                          for i in xrange(1, sizes['Courses'] + 1)))
+
+    write_relation(directory, 'Professors', ((FIRST_PROFESSOR_ID + i, name(), college())
+                                             for i in xrange(sizes['Professors'])))
+
+    write_relation(directory, 'Sessions',
+                   ((i, rng.choice(YEARS), rng.choice(PLACES),
+                     FIRST_PROFESSOR_ID + rng.randrange(sizes['Professors']),
+                     rng.randint(1, sizes['Courses']))
+                    for i in xrange(1, sizes['Sessions'] + 1)))
+
+    write_relation(directory, 'Grades',
+                   ((FIRST_STUDENT_ID + rng.randrange(sizes['Students']),
+                     rng.randint(1, sizes['Sessions']), rng.choice(GRADES))
+                    for _ in xrange(sizes['Grades'])))
+
+    return sizes
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate benchmark relations.')
+    parser.add_argument('directory')
+    parser.add_argument('--scale', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for name, rows in sorted(generate(args.directory, args.scale, args.seed).items()):
+        print "%s: %d rows" % (name, rows)
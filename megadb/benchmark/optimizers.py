@@ -0,0 +1,176 @@
+"""Optimization time of the join ordering optimizators on synthetic queries.
+
+For every join graph shape (chain, star, cycle, clique) and number of
+relations, a query joining relations R0..Rn-1 (with a selection on each)
+is put through PushSelectionDownOptimizator and
+CartesianProductToThetaJoinOptimizator, then through each join ordering
+optimizator. Relations only share the attributes of the edges between
+them, so every join is a natural join. Each run reports the seconds
+spent optimizing, the growth of peak resident memory, the number of
+plans considered and the estimated cost (see optimizator.plan_cost) of
+the plan found, relative to the cheapest one any optimizator found.
+
+Runs happen in a child process, so they are measured apart and can be
+stopped; once an optimizator runs out of time on a shape it isn't tried
+on more relations.
+
+    $ python -m megadb.benchmark.optimizers [--shapes chain star ...]
+          [--min N] [--max N] [--seed N] [--timeout SECONDS] [--output FILE]
+"""
+import sys
+import json
+import random
+import timeit
+import resource
+import argparse
+import itertools
+import multiprocessing
+
+import megadb.optimization.optimizator as optimizator
+from megadb.algebra.parser import parse_sql
+
+SHAPES = ['chain', 'star', 'cycle', 'clique']
+
+OPTIMIZATORS = [
+    'GreedyJoinOrderOptimizator',
+    'GreedyOptimizator',
+    'EnumerationBasedOptimizator',
+    'DPccpJoinOrderOptimizator'
+]
+
+def join_graph(shape, n):
+    """Edges (i, j), i < j, between the relations of a join graph"""
+    if shape == 'chain':
+        return [(i, i + 1) for i in range(n - 1)]
+    elif shape == 'star':
+        return [(0, i) for i in range(1, n)]
+    elif shape == 'cycle':
+        return join_graph('chain', n) + ([(0, n - 1)] if n > 2 else [])
+    elif shape == 'clique':
+        return list(itertools.combinations(range(n), 2))
+    else:
+        raise ValueError("Unknown join graph %s" % shape)
+
+def key_name(edge):
+    return 'k%d_%d' % edge
+
+def synthetic_stats(n, edges, rng):
+    """[T, {attr: V}] of relations R0..Rn-1, sharing a key per edge"""
+    stats = {}
+    for i in range(n):
+        total = rng.randint(100, 100000)
+        distinct = {'a%d' % i: rng.randint(1, min(total, 100))}
+        stats['R%d' % i] = [total, distinct]
+
+    for i, j in edges:
+        for r in (i, j):
+            total, distinct = stats['R%d' % r]
+            distinct[key_name((i, j))] = rng.randint(1, total)
+
+    return stats
+
+def synthetic_query(n, edges):
+    relations = ['R%d' % i for i in range(n)]
+    conds = ['R%d.%s = R%d.%s' % (i, key_name((i, j)), j, key_name((i, j))) for i, j in edges]
+    conds += ['R%d.a%d = 1' % (i, i) for i in range(n)]
+    return 'SELECT R0.a0 FROM %s WHERE %s' % (', '.join(relations), ' AND '.join(conds))
+
+def prepare_tree(stats, sql):
+    tree = parse_sql(sql)
+    tree = optimizator.PushSelectionDownOptimizator().run(tree)
+    return optimizator.CartesianProductToThetaJoinOptimizator(stats).run(tree)
+
+def optimize(stats, tree, opt_name, queue):
+    try:
+        opt = getattr(optimizator, opt_name)(stats)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        start_at = timeit.default_timer()
+        optimized = opt.run(tree)
+        elapsed = timeit.default_timer() - start_at
+
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        queue.put({
+            'optimize_time': elapsed,
+            'memory_kb': rss_after - rss_before,
+            'plans_considered': opt.plans_considered,
+            'cost': optimizator.plan_cost(stats, optimized)
+        })
+    except Exception as e:
+        queue.put({'error': '%s: %s' % (type(e).__name__, e)})
+
+def run_optimizator(stats, tree, opt_name, timeout=None):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=optimize, args=(stats, tree, opt_name, queue))
+    process.start()
+    process.join(timeout)
+
+    if process.is_alive():
+        process.terminate()
+        process.join()
+        return {'error': 'timed out after %s seconds' % timeout, 'timed_out': True}
+
+    if queue.empty():
+        return {'error': 'exited with code %s' % process.exitcode}
+    return queue.get()
+
+def run_benchmark(shapes=None, sizes=None, optimizators=None, seed=0, timeout=None):
+    """Run every optimizator on every (shape, number of relations)"""
+    results = []
+    for shape in shapes or SHAPES:
+        timed_out = set()
+
+        for n in sizes or range(2, 16):
+            edges = join_graph(shape, n)
+            stats = synthetic_stats(n, edges, random.Random(seed))
+            tree = prepare_tree(stats, synthetic_query(n, edges))
+
+            runs = []
+            for opt_name in optimizators or OPTIMIZATORS:
+                if opt_name in timed_out:
+                    result = {'error': 'skipped after timing out on fewer relations'}
+                else:
+                    result = run_optimizator(stats, tree, opt_name, timeout)
+                    if result.pop('timed_out', False):
+                        timed_out.add(opt_name)
+
+                result.update({'shape': shape, 'relations': n, 'optimization': opt_name})
+                runs.append(result)
+
+            costs = [r['cost'] for r in runs if 'cost' in r]
+            for r in runs:
+                if 'cost' in r:
+                    r['relative_cost'] = r['cost'] / min(costs) if min(costs) else 1.0
+
+            results.extend(runs)
+
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the join ordering optimizators.')
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=SHAPES)
+    parser.add_argument('--optimizations', nargs='+', default=OPTIMIZATORS)
+    parser.add_argument('--min', type=int, default=2)
+    parser.add_argument('--max', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output')
+    args = parser.parse_args(argv)
+
+    report = {
+        'seed': args.seed,
+        'timeout': args.timeout,
+        'results': run_benchmark(args.shapes, range(args.min, args.max + 1),
+                                 args.optimizations, args.seed, args.timeout)
+    }
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        json.dump(report, output, indent=2, sort_keys=True)
+        output.write('\n')
+    finally:
+        if args.output:
+            output.close()
+
+if __name__ == '__main__':
+    main()
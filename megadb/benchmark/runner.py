@@ -0,0 +1,159 @@
+"""Runs a query workload under optimizator combinations and reports JSON.
+
+Every (query, optimizations) run records the seconds spent parsing,
+optimizing, translating and executing, the peak bytes of tuples its
+operators held (see megadb.execution.workload), how much the run raised
+the peak resident size of the process and the number of result rows. The
+peak never goes down, so a run staying under the peak of an earlier one
+reports no growth; peak_memory is the per-run figure to compare. A run
+taking longer than the timeout is cancelled and reported with an error,
+like one that fails.
+
+    $ python -m megadb.benchmark.runner [--scale S] [--seed N] [--data DIR]
+          [--repeat N] [--timeout SECONDS] [--output FILE]
+
+generates relations at the given scale (into a temporary directory unless
+--data is given) and writes the report to FILE (stdout by default).
+"""
+import sys
+import json
+import shutil
+import timeit
+import resource
+import argparse
+import tempfile
+import threading
+
+import megadb.settings as settings
+from megadb.algebra.parser import parse_sql
+from megadb.execution.executor import Schema, Executor
+from megadb.execution.workload import QueryContext, QueryCancelled
+from megadb.server import instantiate_optimizator
+from megadb.benchmark.generator import generate
+
+# the test cases in the docstring of main.py, then a broader workload
+QUERIES = [
+    ('professors_2013', "SELECT Professors.ProfessorName FROM Professors, Sessions, Colleges WHERE Colleges.CollegeId = Professors.CollegeId AND Sessions.ProfessorId = Professors.ProfessorId AND Sessions.year = 2013 AND Colleges.CollegeName = 'College of Computing'"),
+    ('student_lookup', "SELECT * FROM Students WHERE Students.StudentName = 'Sydell Hamill' AND Students.StudentDegree = 'BS' AND Students.StudentGender = 'M'"),
+    ('cs_students_2013', "SELECT Students.StudentName, Students.StudentId FROM Students, Grades, Sessions, Programs WHERE Grades.StudentId = Students.StudentId AND Grades.SessionId = Sessions.SessionId AND Sessions.year = 2013 AND Grades.grade = 'A' AND Programs.ProgramId = Students.ProgramId AND Programs.ProgramName = 'Computer Science'"),
+    ('grades_students', "SELECT Grades.grade FROM Grades, Students WHERE Grades.StudentId = Students.StudentId"),
+    ('session_range', "SELECT Sessions.SessionId, Sessions.place FROM Sessions WHERE Sessions.year >= 2012 AND Sessions.year < 2014"),
+    ('grade_scan', "SELECT Grades.StudentId FROM Grades WHERE Grades.grade = 'F'"),
+    ('courses_by_college', "SELECT Courses.CourseName, Colleges.CollegeName FROM Courses, Colleges WHERE Courses.CollegeId = Colleges.CollegeId"),
+    ('sessions_per_course', "SELECT Sessions.year, Courses.CourseName, Professors.ProfessorName FROM Sessions, Courses, Professors WHERE Sessions.CourseId = Courses.CourseId AND Sessions.ProfessorId = Professors.ProfessorId AND Sessions.place = 'Atlanta'"),
+    ('program_grades', "SELECT Programs.ProgramName, Grades.grade FROM Programs, Students, Grades WHERE Programs.ProgramId = Students.ProgramId AND Students.StudentId = Grades.StudentId AND Students.StudentDegree = 'PhD'")
+]
+
+PUSH = ['PushSelectionDownOptimizator', 'CartesianProductToThetaJoinOptimizator']
+
+OPTIMIZATIONS = [
+    [],
+    PUSH,
+    PUSH + ['ProjectionPushDownOptimizator'],
+    PUSH + ['EnumerationBasedOptimizator'],
+    PUSH + ['GreedyOptimizator'],
+    PUSH + ['DPccpJoinOrderOptimizator'],
+    PUSH + ['EnumerationBasedOptimizator', 'ProjectionPushDownOptimizator']
+]
+
+def run_query(schema, sql, optimizations, backend='row', timeout=None):
+    """Time the stages of one query, returning a dict of measurements"""
+    result = {'optimizations': optimizations, 'backend': backend}
+    executor = Executor(schema, backend)
+    context = QueryContext()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, context.cancel)
+        timer.start()
+
+    try:
+        start_at = timeit.default_timer()
+        tree = parse_sql(sql)
+        result['parse_time'] = timeit.default_timer() - start_at
+
+        start_at = timeit.default_timer()
+        for opt_name in optimizations:
+            tree = instantiate_optimizator(schema, opt_name).run(tree)
+        result['optimize_time'] = timeit.default_timer() - start_at
+
+        start_at = timeit.default_timer()
+        translated = executor.translate_tree(tree)
+        result['translate_time'] = timeit.default_timer() - start_at
+
+        start_at = timeit.default_timer()
+        translated.set_context(context)
+        with translated:
+            rows = len(translated.run())
+        result['execute_time'] = timeit.default_timer() - start_at
+        result['rows'] = rows
+    except QueryCancelled:
+        result['error'] = 'cancelled after %s seconds' % timeout
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    finally:
+        if timer is not None:
+            timer.cancel()
+
+    result['peak_memory'] = context.peak_memory
+    result['max_rss_growth_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    return result
+
+def run_benchmark(schema, queries=None, optimizations=None, repeat=1, backend='row', timeout=None):
+    """Run every query under every optimizator combination repeat times"""
+    results = []
+    for name, sql in queries or QUERIES:
+        for opts in optimizations or OPTIMIZATIONS:
+            for run in range(repeat):
+                result = run_query(schema, sql, opts, backend, timeout)
+                result.update({'query': name, 'run': run})
+                results.append(result)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the query processor.')
+    parser.add_argument('--scale', type=float, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data', help='directory for the generated relations')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--backend', default='row')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output')
+    args = parser.parse_args(argv)
+
+    directory = args.data or tempfile.mkdtemp()
+    relations_path = settings.RELATIONS_PATH
+    try:
+        sizes = generate(directory, args.scale, args.seed)
+        settings.RELATIONS_PATH = directory
+
+        schema = Schema()
+        schema.load()
+        schema.load_statistics()
+
+        report = {
+            'scale': args.scale,
+            'seed': args.seed,
+            'relations': sizes,
+            'settings': dict((k, getattr(settings, k)) for k in dir(settings)
+                             if k.isupper() and k != 'RELATIONS_PATH'),
+            'results': run_benchmark(schema, repeat=args.repeat, backend=args.backend,
+                                     timeout=args.timeout)
+        }
+    finally:
+        settings.RELATIONS_PATH = relations_path
+        if not args.data:
+            shutil.rmtree(directory)
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        json.dump(report, output, indent=2, sort_keys=True)
+        output.write('\n')
+    finally:
+        if args.output:
+            output.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+"""Columnar execution engine backed by NumPy.
+
+Operators follow the same open()/next()/close() protocol as
+megadb.execution.plan, but a batch is a ColumnBatch holding one NumPy
+array per field of the operator's schema. Selections become boolean
+masks, projections pick columns and joins compute index arrays, so the
+per-row work happens inside NumPy. Iterating a ColumnBatch yields plain
+tuples, which lets Executor.execute_plan return the usual result rows.
+"""
+import os
+import itertools
+
+import numpy as np
+
+import megadb.settings as settings
+import megadb.algebra.plan as logical
+import megadb.execution.plan as plan
+import megadb.storage.binary as binary
+from megadb.tree import TreeNode
+from megadb.algebra.plan import Field
+from megadb.execution.executor import orient_equi_conds
+
+DTYPES = {
+    int: np.int64,
+    str: np.str_
+}
+
+def to_array(values, field_type):
+    """Convert a list of raw values into a NumPy array of field_type."""
+    if not values:
+        return np.array([], dtype=DTYPES[field_type])
+    return np.array(values).astype(DTYPES[field_type])
+
+class ColumnBatch(object):
+    def __init__(self, columns, size):
+        self.columns = columns
+        self.size = size
+
+    def take(self, indexes):
+        """Rows at integer positions (or where a boolean mask is set)."""
+        columns = [c[indexes] for c in self.columns]
+        if indexes.dtype == np.bool_:
+            size = int(np.count_nonzero(indexes))
+        else:
+            size = len(indexes)
+        return ColumnBatch(columns, size)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        if not self.columns:
+            return iter([()] * self.size)
+        return itertools.izip(*[c.tolist() for c in self.columns])
+
+def concat_batches(batches, schema):
+    batches = list(batches)
+    if not batches:
+        return ColumnBatch([to_array([], t) for (_, t) in schema], 0)
+
+    columns = [np.concatenate([b.columns[inx] for b in batches])
+               for inx in range(len(schema))]
+    return ColumnBatch(columns, sum(len(b) for b in batches))
+
+def compile_mask(conds, schema):
+    """Compile conds into a function computing the boolean mask of a batch.
+
+    Field operands are resolved to column positions and literals are cast
+    to the type of the field they are compared with, once.
+    """
+    def operand(value):
+        if isinstance(value, Field):
+            inx = plan.resolve_field(schema, value)
+            return inx, schema[inx][1]
+        return None, value
+
+    compiled = []
+    for cond in conds:
+        if cond.comp not in plan.COMPARISON_OPERATORS:
+            raise NotImplementedError("Unsupported operator %s" % cond.comp)
+        optr = plan.COMPARISON_OPERATORS[cond.comp]
+
+        (x, x_type), (y, y_type) = operand(cond.x), operand(cond.y)
+        if x is None and y is None:
+            const = optr(x_type, type(x_type)(y_type))
+            compiled.append(lambda batch, const=const: const)
+        elif y is None:
+            value = x_type(y_type)
+            compiled.append(lambda batch, x=x, value=value, optr=optr:
+                            optr(batch.columns[x], value))
+        elif x is None:
+            value = y_type(x_type)
+            compiled.append(lambda batch, y=y, value=value, optr=optr:
+                            optr(value, batch.columns[y]))
+        else:
+            compiled.append(lambda batch, x=x, y=y, optr=optr:
+                            optr(batch.columns[x], batch.columns[y]))
+
+    def mask(batch):
+        result = np.ones(len(batch), dtype=np.bool_)
+        for m in compiled:
+            result &= m(batch)
+        return result
+
+    return mask
+
+class Relation(plan.Relation):
+    """Columnar table scan, reading only the columns it is asked for."""
+    def __init__(self, parent, name, fields, columns=None):
+        super(Relation, self).__init__(parent, name, fields, None, columns)
+
+    def binary_batches(self, store, indexes):
+        def column(inx, start, stop):
+            if self.fields[inx][1] is int:
+                _, offset = store.columns[inx]
+                return np.frombuffer(store.buffer, dtype='<i8', count=stop - start,
+                                     offset=offset + 8 * start)
+            else:
+                return to_array(store.read_column(inx, start, stop), str)
+
+        for start in xrange(0, store.row_count, settings.COLUMNAR_BATCH_SIZE):
+            stop = min(start + settings.COLUMNAR_BATCH_SIZE, store.row_count)
+            yield ColumnBatch([column(inx, start, stop) for inx in indexes], stop - start)
+
+    def batches(self):
+        indexes = self.indexes
+
+        store = binary.open_fresh(self.path)
+        if store is not None:
+            # int columns are views on the mapped file, so the mapping is
+            # left to be released with the last array using it
+            for batch in self.binary_batches(store, indexes):
+                yield batch
+            return
+
+        with open(self.path, 'r') as relation_file:
+            for lines in plan.chunked(relation_file, settings.COLUMNAR_BATCH_SIZE):
+                rows = [line.rstrip().split('#') for line in lines]
+                values = zip(*rows) if rows else [()] * len(self.fields)
+                yield ColumnBatch([to_array(list(values[inx]), self.fields[inx][1])
+                                   for inx in indexes], len(rows))
+
+    def __str__(self):
+        return "Columnar " + super(Relation, self).__str__()
+
+class Projection(TreeNode, plan.Plan):
+    def __init__(self, parent, fields):
+        super(Projection, self).__init__(parent)
+        self.fields = fields
+
+    def open(self):
+        assert len(self.children) == 1
+        super(Projection, self).open()
+
+    def output_schema(self):
+        child_schema = self.children[0].schema
+        if len(self.fields) == 0:
+            self.indexes = range(len(child_schema))
+        else:
+            self.indexes = [inx for inx, (f, _) in enumerate(child_schema) if f in self.fields]
+
+        return [child_schema[inx] for inx in self.indexes]
+
+    def batches(self):
+        for batch in iter(self.children[0].next, None):
+            yield ColumnBatch([batch.columns[inx] for inx in self.indexes], len(batch))
+
+    def __str__(self):
+        if self.fields:
+            return "Columnar Projection: %s" % (','.join([str(f) for f in self.fields]))
+        else:
+            return "Columnar Projection: *"
+
+class Selection(TreeNode, plan.Plan):
+    def __init__(self, parent, conds):
+        super(Selection, self).__init__(parent)
+        self.conds = conds
+
+    def open(self):
+        assert len(self.children) == 1
+        super(Selection, self).open()
+        self.mask = compile_mask(self.conds, self.schema)
+
+    def output_schema(self):
+        return self.children[0].schema
+
+    def batches(self):
+        for batch in iter(self.children[0].next, None):
+            selected = batch.take(self.mask(batch))
+            if len(selected):
+                yield selected
+
+    def __str__(self):
+        return "Columnar Selection: %s" % ('\nAND '.join([str(c) for c in self.conds]))
+
+def join_batches(left, right, left_idx, right_idx):
+    columns = ([c[left_idx] for c in left.columns] +
+               [c[right_idx] for c in right.columns])
+    return ColumnBatch(columns, len(left_idx))
+
+class NLJoin(TreeNode, plan.Plan):
+    """Joins every left row with every right row, then filters on conds.
+
+    With no conds this is a CartesianProduct. The left input is processed
+    in slices so that a joined batch stays around COLUMNAR_BATCH_SIZE rows.
+    """
+    def __init__(self, parent, conds):
+        super(NLJoin, self).__init__(parent)
+        self.conds = conds
+
+    def open(self):
+        assert len(self.children) == 2
+        super(NLJoin, self).open()
+        self.mask = compile_mask(self.conds, self.schema)
+
+    def output_schema(self):
+        return plan.join_schema(self)
+
+    def batches(self):
+        left, right = self.children
+        inner = concat_batches(iter(right.next, None), right.schema)
+        if len(inner) == 0:
+            return
+
+        step = max(1, settings.COLUMNAR_BATCH_SIZE // len(inner))
+        for batch in iter(left.next, None):
+            for start in range(0, len(batch), step):
+                outer = batch.take(np.arange(start, min(start + step, len(batch))))
+
+                left_idx = np.repeat(np.arange(len(outer)), len(inner))
+                right_idx = np.tile(np.arange(len(inner)), len(outer))
+                joined = join_batches(outer, inner, left_idx, right_idx)
+
+                if self.conds:
+                    joined = joined.take(self.mask(joined))
+                if len(joined):
+                    yield joined
+
+    def __str__(self):
+        if self.conds:
+            return 'Columnar Nested Loop Join: %s' % (' AND '.join([str(c) for c in self.conds]))
+        else:
+            return 'Columnar CartesianProduct'
+
+class KeyEncoder(object):
+    """Encodes multi-column join keys as one int64 code per row.
+
+    Codes come from the distinct values of the build side columns; a probe
+    row holding a value the build side doesn't have gets code -1.
+    """
+    def __init__(self, build_keys):
+        self.uniques = []
+        self.codes = np.zeros(len(build_keys[0]), dtype=np.int64)
+
+        for build_col in build_keys:
+            uniques, codes = np.unique(build_col, return_inverse=True)
+            self.uniques.append(uniques)
+            self.codes = self.codes * len(uniques) + codes
+
+    def encode(self, probe_keys):
+        codes = np.zeros(len(probe_keys[0]), dtype=np.int64)
+        missing = np.zeros(len(probe_keys[0]), dtype=np.bool_)
+
+        for uniques, probe_col in zip(self.uniques, probe_keys):
+            positions = np.searchsorted(uniques, probe_col)
+            positions[positions == len(uniques)] = 0
+            missing |= uniques[positions] != probe_col
+
+            codes = codes * len(uniques) + positions
+
+        codes[missing] = -1
+        return codes
+
+class EquiJoin(TreeNode, plan.Plan):
+    """Equi-join through sorting and binary search.
+
+    conds are Field = Field comparisons whose x belongs to the left input
+    and y to the right one. The right input is collected and sorted on its
+    key codes once; each left batch then finds its matching range with
+    np.searchsorted and expands it into index arrays.
+    """
+    def __init__(self, parent, conds):
+        super(EquiJoin, self).__init__(parent)
+        self.conds = conds
+
+    def open(self):
+        assert len(self.children) == 2
+        super(EquiJoin, self).open()
+
+    def output_schema(self):
+        return plan.join_schema(self)
+
+    def batches(self):
+        left, right = self.children
+        left_keys = [plan.resolve_field(left.schema, c.x) for c in self.conds]
+        right_keys = [plan.resolve_field(right.schema, c.y) for c in self.conds]
+
+        inner = concat_batches(iter(right.next, None), right.schema)
+        if len(inner) == 0:
+            return
+
+        encoder = KeyEncoder([inner.columns[inx] for inx in right_keys])
+        order = np.argsort(encoder.codes, kind='mergesort')
+        sorted_codes = encoder.codes[order]
+
+        for batch in iter(left.next, None):
+            probe_codes = encoder.encode([batch.columns[inx] for inx in left_keys])
+
+            lo = np.searchsorted(sorted_codes, probe_codes, 'left')
+            hi = np.searchsorted(sorted_codes, probe_codes, 'right')
+            counts = hi - lo
+            total = int(counts.sum())
+            if total == 0:
+                continue
+
+            left_idx = np.repeat(np.arange(len(batch)), counts)
+            starts = np.cumsum(counts) - counts
+            right_pos = np.arange(total) - np.repeat(starts, counts) + np.repeat(lo, counts)
+
+            yield join_batches(batch, inner, left_idx, order[right_pos])
+
+    def __str__(self):
+        return 'Columnar Equi Join: %s' % (' AND '.join([str(c) for c in self.conds]))
+
+def translate_tree(executor, root):
+    """Translate a logical plan tree into a columnar execution tree"""
+    schema = executor.schema
+
+    def make_join(parent, node, conds):
+        fs_left, fs_right = map(executor.extract_fields, node.children)
+        equi_conds = orient_equi_conds(conds, fs_left, fs_right)
+
+        if equi_conds:
+            join = EquiJoin(parent, equi_conds)
+        else:
+            join = NLJoin(parent, conds)
+
+        for c in node.children:
+            aux(join, c)
+        return join
+
+    def aux(parent, node, columns=None):
+        translated = translate(parent, node, columns)
+        translated.estimated_size = executor.estimated_size(node)
+        return translated
+
+    def translate(parent, node, columns):
+        if isinstance(node, logical.Relation):
+            return Relation(parent, str(node.name), schema.relations[str(node.name)], columns)
+        elif isinstance(node, logical.Projection):
+            projection = Projection(parent, node.fields)
+            for c in node.children:
+                aux(projection, c, executor.scan_columns(node))
+            return projection
+        elif isinstance(node, logical.Selection):
+            selection = Selection(parent, node.conds)
+            for c in node.children:
+                aux(selection, c, columns)
+            return selection
+        elif isinstance(node, logical.CartesianProduct):
+            return make_join(parent, node, [])
+        elif isinstance(node, logical.ThetaJoin):
+            return make_join(parent, node, node.conds)
+        elif isinstance(node, logical.NaturalJoin):
+            return make_join(parent, node, executor.natural_join_conds(node))
+        else:
+            raise NotImplementedError()
+
+    return aux(None, root)
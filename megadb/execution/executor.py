@@ -4,12 +4,31 @@ import megadb.settings as settings
 
 import megadb.algebra.plan as logical
 import megadb.execution.plan as plan
+import megadb.storage.index as index
+from megadb.tree import insert_above
+from megadb.storage.btree import BTreeIndex
+from megadb.storage.cache import RelationCache
+from megadb.storage.statistics import (StatisticsCatalog, Statistics, catalog_path,
+                                       compute_statistics, selectivity)
 
 class Schema(object):
-    def __init__(self):
+    # an ordered index answers range conditions too, so it is preferred
+    # when an attribute has both kinds
+    INDEX_TYPES = (index.HashIndex, BTreeIndex)
+
+    def __init__(self, cache_size=None):
         super(Schema, self).__init__()
         self.relations = {}
-        self.stats = {}
+        # rname -> [T, {attr: V}]
+        self.stats = Statistics()
+        # rname -> {attr: {'distinct', 'min', 'max', 'mcv', 'histogram'}}
+        self.column_stats = self.stats.columns
+        self.indexes = {}
+        self.catalog = None
+
+        if cache_size is None:
+            cache_size = settings.RELATION_CACHE_SIZE
+        self.cache = RelationCache(cache_size)
 
     def load(self):
         pattern = re.compile(r'^(\w+)\((.*)\)$')
@@ -37,62 +56,415 @@ class Schema(object):
                 if rname:
                     self.relations[rname] = fields
 
-    def load_statistics(self):
-        def extract_stat(relation):
-            tuples = relation.get_tuples()
+        self.load_indexes()
 
-            total = len(tuples)
-            distinct = {}
+    def relation_path(self, rname):
+        return os.path.join(settings.RELATIONS_PATH, rname)
 
-            for fname, _ in relation.fields:
-                values = set()
-                field = logical.Field.from_components(fname, relation.name)
+    def load_indexes(self):
+        """Open the index files found next to the relation files"""
+        for (rname, fields) in self.relations.iteritems():
+            for (fname, _) in fields:
+                for index_type in self.INDEX_TYPES:
+                    idx = index.open_index(self.relation_path(rname), fields, fname, index_type)
+                    if idx is not None:
+                        self.indexes[(rname, fname)] = idx
 
-                for t in tuples:
-                    value = t[field]
-                    values.add(value)
+    def create_index(self, rname, attr, index_type=index.HashIndex):
+        """Build (or rebuild) an index of index_type on attr of relation rname"""
+        idx = index.create_index(self.relation_path(rname), self.relations[rname], attr, index_type)
+        self.indexes[(rname, attr)] = idx
+        return idx
 
-                distinct[fname] = len(values)
+    def get_index(self, rname, attr):
+        """Index on attr of relation rname, or None if there is none. An
+        index older than its relation file is rebuilt first."""
+        idx = self.indexes.get((rname, attr))
+        if idx is not None and not idx.is_fresh(self.relation_path(rname)):
+            idx = self.create_index(rname, attr, type(idx))
+        return idx
 
-            return [total, distinct]
+    def load_statistics(self):
+        """Statistics of every relation, read from the catalog when they are
+        still fresh. Relations that are new or changed are analyzed."""
+        self.catalog = StatisticsCatalog(catalog_path(settings.RELATIONS_PATH))
+        self.catalog.load()
 
+        stale = []
         for (rname, fields) in self.relations.iteritems():
+            stats = self.catalog.get(rname, self.relation_path(rname), fields)
+            if stats is None or stats.get('mode') != settings.STATISTICS_MODE:
+                stale.append(rname)
+            else:
+                self.set_statistics(rname, stats)
+
+        if stale:
+            self.analyze(stale)
+
+    def analyze(self, rnames=None):
+        """Compute the statistics of rnames (every relation by default) with
+        a pass over their tuples and save them to the catalog.
+        settings.STATISTICS_MODE chooses between exact and approximate
+        statistics (see megadb.storage.statistics)."""
+        if self.catalog is None:
+            self.catalog = StatisticsCatalog(catalog_path(settings.RELATIONS_PATH))
+            self.catalog.load()
+
+        for rname in rnames or self.relations.keys():
+            fields = self.relations[rname]
+            # uncached, the tuples stream through compute_statistics and
+            # analyzing doesn't evict the working set
             relation = plan.Relation(None, rname, fields)
+            with relation:
+                stats = compute_statistics(fields, relation, settings.STATISTICS_MODE,
+                                           settings.STATISTICS_SAMPLE_SIZE,
+                                           settings.HLL_PRECISION, settings.MCV_SIZE,
+                                           settings.HISTOGRAM_BUCKETS)
+
+            self.catalog.put(rname, self.relation_path(rname), fields, stats)
+            self.set_statistics(rname, stats)
 
-            self.stats[rname] = extract_stat(relation)
+        # without a writable catalog the statistics only last for this process
+        self.catalog.save()
+
+    def set_statistics(self, rname, stats):
+        columns = stats['columns']
+        self.stats[rname] = [stats['total'],
+                             dict((fname, c['distinct']) for fname, c in columns.items())]
+        self.column_stats[rname] = columns
 
     # TODO: a factory method for relation
 
+def orient_equi_conds(conds, fs_left, fs_right):
+    """Orient Field = Field conditions so that x belongs to the left input.
+
+    Returns None if any condition is not an equality between a field of
+    each input, i.e. when the join can't be evaluated by hashing.
+    """
+    def belongs(field, fields):
+        return any(f == field for f in fields)
+
+    oriented = []
+    for cond in conds:
+        if cond.comp != '=':
+            return None
+        if not isinstance(cond.x, logical.Field) or not isinstance(cond.y, logical.Field):
+            return None
+
+        x_sides = (belongs(cond.x, fs_left), belongs(cond.x, fs_right))
+        y_sides = (belongs(cond.y, fs_left), belongs(cond.y, fs_right))
+
+        if x_sides == (True, False) and y_sides == (False, True):
+            oriented.append(cond)
+        elif x_sides == (False, True) and y_sides == (True, False):
+            oriented.append(logical.Comparison(cond.y, cond.x, cond.comp))
+        else:
+            return None
+
+    return oriented
+
 class Executor(object):
-    def __init__(self, schema):
+    """Translates logical trees into physical plans and runs them.
+
+    backend selects the physical operators: 'row' for the tuple-at-a-time
+    operators of megadb.execution.plan, 'columnar' for the NumPy engine of
+    megadb.execution.columnar.
+    """
+    BACKENDS = ('row', 'columnar')
+
+    def __init__(self, schema, backend='row'):
+        if backend not in self.BACKENDS:
+            raise ValueError("Unknown backend %s" % backend)
+
         self.schema = schema
+        self.backend = backend
+
+    def extract_fields(self, node):
+        if isinstance(node, logical.Relation):
+            fnames = self.schema.stats[str(node.name)][1].keys()
+            fields = map(lambda x: logical.Field.from_components(x, str(node.name)), fnames)
+            return set(fields)
+        elif isinstance(node, logical.Projection) and node.fields:
+            return set(f for f in self.extract_fields(node.children[0]) if f in node.fields)
+        elif isinstance(node, logical.Selection) or isinstance(node, logical.Projection):
+            return self.extract_fields(node.children[0])
+        elif (isinstance(node, logical.CartesianProduct) or isinstance(node, logical.NaturalJoin)
+                or isinstance(node, logical.ThetaJoin)):
+            return self.extract_fields(node.children[0]) | self.extract_fields(node.children[1])
+        else:
+            raise NotImplementedError()
+
+    def estimate_stat(self, node):
+        """Estimate [T, {attr: V}] of a logical node from schema.stats"""
+        if isinstance(node, logical.Relation):
+            total, distinct = self.schema.stats[str(node.name)]
+            return [total, dict(distinct)]
+        elif isinstance(node, logical.Projection):
+            return self.estimate_stat(node.children[0])
+        elif isinstance(node, logical.Selection): # T(S) = T(R) * sel(R, cond)
+            total, distinct = self.estimate_stat(node.children[0])
+            for cond in node.conds:
+                fields = [f for f in (cond.x, cond.y) if isinstance(f, logical.Field)]
+                if not fields:
+                    continue
+
+                if len(fields) == 1 and fields[0].namespace in self.schema.stats:
+                    total = float(total) * selectivity(self.schema.stats, fields[0].namespace, cond)
+                else: # T(S) = T(R) / V(R, a)
+                    total = float(total) / max([distinct.get(f.name, 1) for f in fields])
+
+                for f in fields:
+                    if cond.comp == '=':
+                        distinct[f.name] = 1
+                    else: # a range can't keep more values than tuples
+                        distinct[f.name] = min(distinct.get(f.name, 1), max(total, 1))
+
+            return [total, distinct]
+        else: # T(R) * T(S) / max(V(R, a), V(S, a))
+            (t_left, v_left), (t_right, v_right) = map(self.estimate_stat, node.children)
+
+            total = float(t_left * t_right)
+            distinct = dict(v_left.items() + v_right.items())
+
+            join_attrs = []
+            if isinstance(node, logical.NaturalJoin):
+                join_attrs = [(a, a) for a in set(v_left) & set(v_right)]
+            elif isinstance(node, logical.ThetaJoin):
+                join_attrs = [(c.x.name, c.y.name) for c in node.conds
+                              if isinstance(c.x, logical.Field) and isinstance(c.y, logical.Field)]
+
+            for a, b in join_attrs:
+                total /= max(v_left.get(a, v_right.get(a, 1)), v_right.get(b, v_left.get(b, 1)))
+
+            return [total, distinct]
+
+    def estimated_size(self, node):
+        """Estimated number of tuples of a logical node: the estimate a cost
+        based optimizator left in its estimated_size, else estimate_stat's.
+        None without statistics."""
+        if getattr(node, 'estimated_size', None) is not None:
+            return node.estimated_size
+
+        try:
+            return self.estimate_stat(node)[0]
+        except KeyError:
+            return None
+
+    def natural_join_conds(self, node):
+        """Equality conditions on the common attributes of a NaturalJoin"""
+        fs_left, fs_right = map(self.extract_fields, node.children)
+
+        conds = []
+        for f_left in fs_left:
+            for f_right in fs_right:
+                if f_left.name == f_right.name:
+                    conds.append(logical.Comparison(f_left, f_right, '='))
+                    break
+
+        return conds
+
+    def make_join(self, parent, node, conds, children):
+        """Pick a physical join for a logical join node.
+
+        children are the already translated inputs, so that a join whose
+        input comes sorted on the join keys can merge it without sorting.
+        """
+        fs_left, fs_right = map(self.extract_fields, node.children)
+        equi_conds = orient_equi_conds(conds, fs_left, fs_right)
+
+        if not equi_conds:
+            join = plan.NLJoin(parent, conds)
+        else:
+            left_keys = [c.x for c in equi_conds]
+            right_keys = [c.y for c in equi_conds]
+            t_left, t_right = [self.estimate_stat(c)[0] for c in node.children]
+
+            inner = self.indexed_inner(children, left_keys, right_keys, t_left, t_right)
+
+            if inner is not None:
+                # probing the index once per outer tuple beats reading the inner relation
+                side, relation, idx = inner
+                join = plan.IndexNestedLoopJoin(parent, equi_conds, idx, side)
+                children = list(children)
+                children[side] = relation
+            elif children[0].sorted_on(left_keys) or children[1].sorted_on(right_keys):
+                join = plan.SortMergeJoin(parent, equi_conds)
+            else:
+                # build the hash table on the smaller input
+                build_side = 0 if t_left < t_right else 1
+                if min(t_left, t_right) > settings.WORK_MEMORY:
+                    # the hash table would not fit, partition both inputs to disk
+                    join = plan.GraceHashJoin(parent, equi_conds, build_side)
+                else:
+                    join = plan.HashJoin(parent, equi_conds, build_side)
+
+        for c in children:
+            c.parent = join
+        return join
+
+    def indexed_inner(self, children, left_keys, right_keys, t_left, t_right):
+        """(side, relation, index) when the translated child at side scans a
+        relation with an index on one of its join keys and is larger than
+        the other input, None otherwise"""
+        for side, keys, t_inner, t_outer in [(1, right_keys, t_right, t_left),
+                                             (0, left_keys, t_left, t_right)]:
+            child = children[side]
+            if isinstance(child, plan.Projection) and type(child.children[0]) is plan.Relation:
+                # the projection above a scan only keeps the scanned columns
+                child = child.children[0]
+            if type(child) is not plan.Relation or t_outer >= t_inner:
+                continue
+
+            for key in keys:
+                if key.namespace not in (None, child.name):
+                    continue
+                idx = self.schema.get_index(child.name, key.name)
+                if idx is not None:
+                    return side, child, idx
+
+        return None
+
+    def scan_columns(self, projection):
+        """Names of the columns a scan under projection (and the selections
+        right below it) has to produce, or None when it needs all of them"""
+        conds, relation = self.flatten_selections(projection.children[0])
+        if not projection.fields or not isinstance(relation, logical.Relation):
+            return None
+
+        needed = projection.fields + [f for c in conds for f in (c.x, c.y)
+                                      if isinstance(f, logical.Field)]
+        return [fname for (fname, _) in self.schema.relations[str(relation.name)]
+                if logical.Field.from_components(fname, str(relation.name)) in needed]
+
+    def flatten_selections(self, selection):
+        """(conds, node below) of a cascade of selections"""
+        conds = []
+        node = selection
+        while isinstance(node, logical.Selection):
+            conds.extend(node.conds)
+            node = node.children[0]
+
+        return conds, node
+
+    def scanned_relation(self, node):
+        """(relation, columns) when node scans a relation, either directly
+        or through a projection right above it, (None, None) otherwise"""
+        if isinstance(node, logical.Projection) and isinstance(node.children[0], logical.Relation):
+            return node.children[0], self.scan_columns(node)
+        elif isinstance(node, logical.Relation):
+            return node, None
+        return None, None
+
+    def parallel_scan(self, rname):
+        """Whether relation rname is worth scanning with a process pool"""
+        if settings.SCAN_PARALLELISM <= 1 or rname in self.schema.cache:
+            return False
+        return os.path.getsize(self.schema.relation_path(rname)) >= settings.PARALLEL_SCAN_MIN_SIZE
+
+    def index_lookup(self, selection):
+        """(relation name, index, index conds, other conds, columns) when an
+        index answers conditions of a selection (or a cascade of selections)
+        right above a relation, None otherwise. columns are those of a
+        projection between the selections and the relation.
+
+        Index conds compare the indexed attribute with a literal, the field
+        being their x. A hash index answers one Attr = literal condition, an
+        ordered one every range condition on its attribute.
+        """
+        all_conds, below = self.flatten_selections(selection)
+        relation, columns = self.scanned_relation(below)
+        if relation is None:
+            return None
+
+        rname = str(relation.name)
+
+        def oriented(cond):
+            if cond.comp not in plan.FLIPPED_OPERATORS:
+                return None
+            for field, value, comp in [(cond.x, cond.y, cond.comp),
+                                       (cond.y, cond.x, plan.FLIPPED_OPERATORS[cond.comp])]:
+                if (isinstance(field, logical.Field) and not isinstance(value, logical.Field)
+                        and field.namespace in (None, rname)):
+                    return logical.Comparison(field, value, comp)
+            return None
+
+        candidates = [(cond, oriented(cond)) for cond in all_conds]
+        candidates = [(cond, o) for cond, o in candidates if o is not None]
+
+        for _, o in candidates:
+            idx = self.schema.get_index(rname, o.x.name)
+            if idx is None or not (o.comp == '=' or idx.ordered):
+                continue
+
+            if idx.ordered:
+                used = [(c, p) for c, p in candidates if p.x.name == o.x.name]
+            else:
+                used = [(c, p) for c, p in candidates if p is o]
+
+            others = [c for c in all_conds if not any(c is u for u, _ in used)]
+            return rname, idx, [p for _, p in used], others, columns
+
+        return None
 
     def translate_tree(self, root):
         """Translate a logical plan tree into execution tree"""
-        def extract_fields(node):
-            if isinstance(node, logical.Relation):
-                fnames = self.schema.stats[str(node.name)][1].keys()
-                fields = map(lambda x: logical.Field.from_components(x, str(node.name)), fnames)
-                return set(fields)
-            elif isinstance(node, logical.Selection):
-                return extract_fields(node.children[0])
-            elif isinstance(node, logical.CartesianProduct) or isinstance(node, logical.NaturalJoin):
-                return extract_fields(node.children[0]) | extract_fields(node.children[1])
-            else:
-                raise NotImplementedError()
+        if self.backend == 'columnar':
+            # imported here so that only the columnar backend requires NumPy
+            import megadb.execution.columnar as columnar
+            return columnar.translate_tree(self, root)
+
+        def aux(parent, node, columns=None):
+            translated = translate(parent, node, columns)
+            # kept for comparison with the actual table_size (see megadb.execution.profile)
+            translated.estimated_size = self.estimated_size(node)
+            return translated
 
-        def aux(parent, node):
+        def translate(parent, node, columns):
             if isinstance(node, logical.Relation):
-                return plan.Relation(parent, str(node.name), self.schema.relations[str(node.name)])
+                rname = str(node.name)
+                if self.parallel_scan(rname):
+                    return plan.ParallelScan(parent, rname, self.schema.relations[rname],
+                                             columns=columns)
+                return plan.Relation(parent, rname, self.schema.relations[rname],
+                                     self.schema.cache, columns)
             elif isinstance(node, logical.Projection):
                 projection = plan.Projection(parent, node.fields)
                 for c in node.children:
-                    aux(projection, c)
+                    # a scan right below a projection only reads projected columns
+                    aux(projection, c, self.scan_columns(node))
                 return projection
             elif isinstance(node, logical.Selection):
+                lookup = self.index_lookup(node)
+                if lookup is not None:
+                    rname, idx, index_conds, conds, scanned = lookup
+                    fields = self.schema.relations[rname]
+                    if scanned is not None:
+                        # the scan produces what the projection below kept
+                        columns = scanned
+                    if not conds:
+                        return plan.IndexScan(parent, rname, fields, idx, index_conds, columns)
+
+                    selection = plan.Selection(parent, conds)
+                    scan = plan.IndexScan(selection, rname, fields, idx, index_conds, columns)
+                    # the scan returns what a selection of the indexed conditions would
+                    indexed = logical.Selection(None, index_conds)
+                    logical.Relation(indexed, rname)
+                    scan.estimated_size = self.estimated_size(indexed)
+                    return selection
+
+                conds, below = self.flatten_selections(node)
+                relation, scanned = self.scanned_relation(below)
+                if relation is not None and self.parallel_scan(str(relation.name)):
+                    # the workers filter their ranges themselves
+                    rname = str(relation.name)
+                    if scanned is not None:
+                        columns = scanned
+                    return plan.ParallelScan(parent, rname, self.schema.relations[rname], conds,
+                                             columns)
+
                 selection = plan.Selection(parent, node.conds)
                 for c in node.children:
-                    aux(selection, c)
+                    aux(selection, c, columns)
                 return selection
             elif isinstance(node, logical.CartesianProduct):
                 join = plan.CartesianProduct(parent)
@@ -100,31 +472,56 @@ class Executor(object):
                     aux(join, c)
                 return join
             elif isinstance(node, logical.ThetaJoin):
-                join = plan.NLJoin(parent, node.conds) # default is Nested loop join
-                for c in node.children:
-                    aux(join, c)
-                return join
+                children = [aux(None, c) for c in node.children]
+                return self.make_join(parent, node, node.conds, children)
             elif isinstance(node, logical.NaturalJoin):
-                fs_left, fs_right = map(extract_fields, node.children)
-                # fns_left = {x.name for x in fs_left}
-                # fns_right = {x.name for x in fs_right}
-                # common_attr_names = fns_left & fns_right
-
-                conds = []
-                for f_left in fs_left:
-                    for f_right in fs_right:
-                        if f_left.name == f_right.name:
-                            conds.append(logical.Comparison(f_left, f_right, '='))
-                            break
-
-                join = plan.NLJoin(parent, conds)
-                for c in node.children:
-                    aux(join, c)
+                conds = self.natural_join_conds(node)
+                children = [aux(None, c) for c in node.children]
+                return self.make_join(parent, node, conds, children)
             else:
                 raise NotImplementedError()
 
-        return aux(None, root)
+        translated = aux(None, root)
+        if settings.QUERY_PARALLELISM > 1:
+            translated = self.parallelize(translated, settings.QUERY_PARALLELISM)
+        return translated
+
+    def parallelize(self, root, degree):
+        """Run a translated plan in degree worker processes.
+
+        The scans feeding the first input of every join are split between
+        the workers, the other inputs are read whole by each of them. Joins
+        whose build input doesn't fit in memory hash partition both inputs
+        on the join keys instead, so each worker only holds its share.
+        """
+        def aux(node):
+            for c in list(node.get_children()):
+                aux(c)
+
+            if isinstance(node, plan.GraceHashJoin):
+                left, right = node.children
+                for child, keys in [(left, [c.x for c in node.conds]),
+                                    (right, [c.y for c in node.conds])]:
+                    exchange = plan.Exchange(None, keys)
+                    exchange.estimated_size = child.estimated_size
+                    insert_above(child, exchange)
+
+        aux(root)
+
+        gather = plan.Gather(None, degree)
+        gather.estimated_size = root.estimated_size
+        root.parent = gather
+        return gather
 
     def execute_plan(self, root):
+        """Run a plan, returning every result tuple as [(Field, value)] pairs"""
+        with root:
+            fields = [f for f, _ in root.schema]
+            return [zip(fields, t) for t in root.run()]
+
+    def iterate_plan(self, root):
+        """Yield result tuples as soon as the plan produces them."""
         with root:
-            return root.run()
+            fields = [f for f, _ in root.schema]
+            for t in root:
+                yield zip(fields, t)
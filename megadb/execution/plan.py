@@ -2,30 +2,197 @@ import os
 import collections
 import operator
 import timeit
+import heapq
+import itertools
+import tempfile
+import traceback
+import multiprocessing
+import cPickle as pickle
 
 import megadb.settings as settings
+import megadb.storage.binary as binary
+from megadb.storage.cache import estimate_size
 from megadb.tree import LeafNode, TreeNode
 from megadb.algebra.plan import Field
 
+def chunked(tuples, size=None):
+    """Group an iterable of tuples into lists of at most size tuples."""
+    size = size or settings.BATCH_SIZE
+    batch = []
+    for tuple in tuples:
+        batch.append(tuple)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+def resolve_field(schema, field):
+    """Position of field in an operator schema.
+
+    A field without namespace, or whose namespace is not in the schema,
+    matches on its name alone.
+    """
+    for inx, (f, _) in enumerate(schema):
+        if f.name == field.name and f.namespace == field.namespace:
+            return inx
+
+    for inx, (f, _) in enumerate(schema):
+        if f.name == field.name:
+            return inx
+
+    raise KeyError(str(field))
+
+def tuple_getter(indexes):
+    """Callable extracting the values at indexes of a tuple as a tuple."""
+    if len(indexes) == 0:
+        return lambda t: ()
+    elif len(indexes) == 1:
+        inx = indexes[0]
+        return lambda t: (t[inx],)
+    else:
+        return operator.itemgetter(*indexes)
+
 class Plan(object):
+    """Base of physical operators (iterator model).
+
+    open() prepares an operator and its children, next() returns the next
+    batch of tuples (None once exhausted) and close() releases resources.
+    Subclasses implement batches() as a generator, so a parent only pulls
+    from its children when it needs more tuples.
+
+    Tuples are plain python tuples. After open(), schema holds the
+    [Field, type] pair of every position of the output tuples.
+
+    While running, an operator counts the time spent in its next() (its
+    children included), the tuples it returned, how many times it checked
+    conditions on a tuple or pair of tuples, the iterations of its outer
+    loop (joins) and the most bytes of tuples it held at once. See
+    megadb.execution.profile.
+
+    estimated_size is the number of tuples the optimizer expected the
+    operator to return, set by Executor.translate_tree.
+    """
+    time_duration = 0.0
+    table_size = 0
+    estimated_size = None
+    predicate_evaluations = 0
+    loops = 0
+    memory_used = 0
+
+    # (inx, count) when a Gather worker runs share inx of count of the plan
+    part = None
+
+    # QueryContext of the query the plan runs for (see megadb.execution.workload)
+    context = None
+
+    def get_children(self):
+        return getattr(self, 'children', [])
+
+    def set_context(self, context):
+        """Run the plan on behalf of a QueryContext. next() then stops with
+        QueryCancelled once the query is cancelled or holds more memory
+        than it may."""
+        self.context = context
+        for c in self.get_children():
+            c.set_context(context)
+
+    def account(self, tuples):
+        """Report the tuples this operator keeps in memory to the context"""
+        nbytes = estimate_size(tuples)
+        self.memory_used = max(self.memory_used, nbytes)
+        if self.context is not None:
+            self.context.charge(self, nbytes)
+
+    def partition(self, inx, count):
+        """Restrict the plan to share inx of count of its output.
+
+        Scans on the way down produce a share of their relation. Of the
+        inputs of a join only the first one is split; the others are read
+        whole by every share, unless all of them are Exchanges, which hash
+        partition matching tuples into the same share.
+        """
+        children = self.get_children()
+        if len(children) > 1 and not all(isinstance(c, Exchange) for c in children):
+            children = children[:1]
+
+        for c in children:
+            c.partition(inx, count)
+
     def open(self):
-        raise NotImplementedError()
+        for c in self.get_children():
+            c.open()
+
+        self.schema = self.output_schema()
+        self.time_duration = 0.0
+        self.table_size = 0
+        self.predicate_evaluations = 0
+        self.loops = 0
+        self.memory_used = 0
+        self._batches = self.batches()
+
+    def next(self):
+        if self.context is not None:
+            self.context.check()
 
-    def run(self):
         start_at = timeit.default_timer()
-        tuples = self.get_tuples()
+        batch = next(self._batches, None)
         end_at = timeit.default_timer()
 
-        self.time_duration = end_at - start_at
-        self.table_size = len(tuples)
-        return tuples
+        self.time_duration += end_at - start_at
+        if batch is not None:
+            self.table_size += len(batch)
+        return batch
 
-    def get_tuples(self):
+    def close(self):
+        batches = getattr(self, '_batches', None)
+        if batches is not None:
+            batches.close()
+            self._batches = None
+
+        for c in self.get_children():
+            c.close()
+
+        if self.context is not None:
+            self.context.release(self)
+
+    def output_schema(self):
         raise NotImplementedError()
 
-    def close(self):
+    def batches(self):
         raise NotImplementedError()
 
+    @property
+    def sort_orders(self):
+        """Key lists (of Fields) the output of this operator is sorted on."""
+        return []
+
+    def sorted_on(self, keys):
+        keys = list(keys)
+        return any(list(order[:len(keys)]) == keys for order in self.sort_orders)
+
+    def __iter__(self):
+        batch = self.next()
+        while batch is not None:
+            for tuple in batch:
+                yield tuple
+            batch = self.next()
+
+    def run(self):
+        """Pull all remaining tuples out of an opened plan."""
+        tuples = []
+
+        batch = self.next()
+        while batch is not None:
+            tuples.extend(batch)
+            batch = self.next()
+
+        return tuples
+
+    def get_tuples(self):
+        return self.run()
+
     def __enter__(self):
         self.open()
         return self
@@ -36,38 +203,261 @@ class Plan(object):
     def __str__(self):
         raise NotImplementedError()
 
+def line_parser(fields, indexes):
+    """Function parsing a line of a relation file with fields into the
+    tuple of the values at indexes"""
+    types = [(inx, fields[inx][1]) for inx in indexes]
+
+    def parse_line(line):
+        values = line.rstrip().split('#')
+        return tuple([f(values[inx]) for inx, f in types])
+
+    return parse_line
+
 class Relation(LeafNode, Plan):
-    def __init__(self, parent, name, fields):
+    """Table scan. Reads the binary twin of the relation file when it is
+    up to date (see megadb.storage.binary) and the text file otherwise.
+    With a RelationCache, parsed tuples are shared between scans until the
+    relation file changes.
+
+    columns restricts the output to the named fields; only those are
+    decoded from the relation file.
+    """
+    def __init__(self, parent, name, fields, cache=None, columns=None):
         super(Relation, self).__init__(parent)
 
         self.name = name
         self.fields = fields
+        self.cache = cache
+        self.columns = columns
         self.path = os.path.join(settings.RELATIONS_PATH, name)
 
-    def open(self):
-        pass
+    @property
+    def indexes(self):
+        """Positions of the scanned columns in the relation file"""
+        if self.columns is None:
+            return range(len(self.fields))
+        return [inx for inx, (field_name, _) in enumerate(self.fields)
+                if field_name in self.columns]
 
-    def get_tuples(self):
-        tuples = []
+    def output_schema(self):
+        return [(Field.from_components(self.fields[inx][0], self.name), self.fields[inx][1])
+                for inx in self.indexes]
+
+    def line_parser(self, indexes):
+        return line_parser(self.fields, indexes)
+
+    def read_batches(self, indexes):
+        store = binary.open_fresh(self.path)
+        if store is not None:
+            with store:
+                for batch in store.batches(indexes, settings.BATCH_SIZE):
+                    yield batch
+            return
+
+        parse_line = self.line_parser(indexes)
 
         with open(self.path, 'r') as relation_file:
-            for line in relation_file:
-                tuple = collections.OrderedDict()
+            for lines in chunked(relation_file):
+                yield [parse_line(line) for line in lines]
 
-                values = line.rstrip().split('#')
-                for (field_name, field_type), value in zip(self.fields, values):
-                    field = Field.from_components(field_name, self.name)
-                    tuple[field] = field_type(value)
+    def read_tuples(self):
+        return itertools.chain.from_iterable(self.read_batches(range(len(self.fields))))
 
-                tuples.append(tuple)
+    def partition(self, inx, count):
+        self.part = (inx, count)
 
-        return tuples
+    def read_partition(self, indexes):
+        """Batches of share self.part of the relation: a slice of its rows,
+        or of the lines of the text file"""
+        inx, count = self.part
 
-    def close(self):
-        pass
+        if self.cache is not None and self.name in self.cache:
+            tuples = self.cache.get(self.name, self.path, self.read_tuples)
+            project = tuple_getter(indexes)
+            share = tuples[len(tuples) * inx // count:len(tuples) * (inx + 1) // count]
+            for batch in chunked(share):
+                yield [project(t) for t in batch]
+            return
+
+        store = binary.open_fresh(self.path)
+        if store is not None:
+            with store:
+                start = store.row_count * inx // count
+                stop = store.row_count * (inx + 1) // count
+                for batch in store.batches(indexes, settings.BATCH_SIZE, start, stop):
+                    yield batch
+            return
+
+        ranges = split_ranges(self.path, count)
+        if inx < len(ranges):
+            start, stop = ranges[inx]
+            _, tuples = scan_range((self.path, self.fields, indexes, None, [], start, stop))
+            for batch in chunked(tuples):
+                yield batch
+
+    def batches(self):
+        indexes = self.indexes
+
+        if self.part is not None:
+            for batch in self.read_partition(indexes):
+                yield batch
+        elif self.cache is None:
+            for batch in self.read_batches(indexes):
+                yield batch
+        else:
+            # the cache holds whole tuples
+            all_indexes = range(len(self.fields))
+            project = None if self.columns is None else tuple_getter(indexes)
+
+            for batch in self.cache.batches(self.name, self.path,
+                                            lambda: self.read_batches(all_indexes),
+                                            settings.BATCH_SIZE):
+                if project is None:
+                    yield batch
+                else:
+                    yield [project(t) for t in batch]
+
+    def __str__(self):
+        if self.columns is None:
+            return "Table Scan: %s" % self.name
+        else:
+            return "Table Scan: %s (%s)" % (self.name, ','.join(self.columns))
+
+class IndexScan(Relation):
+    """Fetches the tuples of a relation matching conditions on an indexed
+    attribute.
+
+    conds compare the attribute (their x) with literals. The byte offsets
+    of the matching lines come from the index (see megadb.storage.index),
+    so only those lines are read. An ordered index returns them in key
+    order, which the scan reports as its sort order.
+    """
+    def __init__(self, parent, name, fields, index, conds, columns=None):
+        super(IndexScan, self).__init__(parent, name, fields, None, columns)
+
+        self.index = index
+        self.conds = conds
+
+    def offsets(self):
+        field_type = dict(self.fields)[self.index.attr]
+        low, include_low, high, include_high = key_range(self.conds, field_type)
+
+        if not self.index.ordered:
+            offsets = self.index.lookup(low) if low == high else []
+        else:
+            offsets = itertools.chain.from_iterable(
+                values for _, values in self.index.range(low, high, include_low, include_high))
+
+        if self.part is None:
+            return offsets
+
+        inx, count = self.part
+        offsets = list(offsets)
+        return offsets[len(offsets) * inx // count:len(offsets) * (inx + 1) // count]
+
+    def batches(self):
+        parse_line = self.line_parser(self.indexes)
+
+        with open(self.path, 'rb') as relation_file:
+            for chunk in chunked(self.offsets()):
+                batch = []
+                for offset in chunk:
+                    relation_file.seek(offset)
+                    batch.append(parse_line(relation_file.readline()))
+                yield batch
+
+    @property
+    def sort_orders(self):
+        if self.index.ordered and (self.columns is None or self.index.attr in self.columns):
+            return [[Field.from_components(self.index.attr, self.name)]]
+        return []
 
     def __str__(self):
-        return "Table Scan: %s" % self.name
+        return "Index Scan: %s (%s)" % (self.name, ' AND '.join([str(c) for c in self.conds]))
+
+def split_ranges(path, parts):
+    """Split the file at path into at most parts [start, stop) byte ranges
+    starting at line boundaries"""
+    size = os.path.getsize(path)
+    bounds = [0]
+
+    with open(path, 'rb') as f:
+        for part in range(1, parts):
+            # the line holding the byte before the cut belongs to the previous range
+            f.seek(max(size * part // parts - 1, 0))
+            f.readline()
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+
+    bounds.append(size)
+    return [(start, stop) for start, stop in zip(bounds, bounds[1:]) if start < stop]
+
+def scan_range(task):
+    """Parse and filter the lines in a byte range of a relation file,
+    returning (number of lines, matching tuples). Runs in the worker
+    processes of ParallelScan."""
+    path, fields, indexes, schema, conds, start, stop = task
+
+    with open(path, 'rb') as relation_file:
+        relation_file.seek(start)
+        lines = relation_file.read(stop - start).splitlines()
+
+    parse_line = line_parser(fields, indexes)
+    tuples = [parse_line(line) for line in lines]
+    if conds:
+        tuples = compile_filter(conds, schema)(tuples)
+    return len(lines), tuples
+
+class ParallelScan(Relation):
+    """Table scan parsing byte ranges of the relation file in a process pool.
+
+    conds are the conditions of a selection pushed into the scan; every
+    worker compiles and applies them to its range, so only matching tuples
+    are sent back. Ranges are merged back in file order. parallelism is
+    the number of worker processes (settings.SCAN_PARALLELISM by default).
+    """
+    # ranges per worker, so that a slow range doesn't keep the others idle
+    RANGES_PER_WORKER = 4
+
+    def __init__(self, parent, name, fields, conds=None, columns=None, parallelism=None):
+        super(ParallelScan, self).__init__(parent, name, fields, None, columns)
+
+        self.conds = conds or []
+        self.parallelism = parallelism or settings.SCAN_PARALLELISM
+
+    def batches(self):
+        if self.part is not None:
+            # a Gather worker already scans just its share, and can't start
+            # a pool of its own
+            select = compile_filter(self.conds, self.schema)
+            for batch in self.read_partition(self.indexes):
+                if self.conds:
+                    self.predicate_evaluations += len(batch)
+                selected = select(batch)
+                if selected:
+                    yield selected
+            return
+
+        ranges = split_ranges(self.path, self.parallelism * self.RANGES_PER_WORKER)
+        tasks = [(self.path, self.fields, self.indexes, self.schema, self.conds, start, stop)
+                 for start, stop in ranges]
+
+        pool = multiprocessing.Pool(self.parallelism)
+        try:
+            for scanned, tuples in pool.imap(scan_range, tasks):
+                if self.conds:
+                    self.predicate_evaluations += scanned
+                for batch in chunked(tuples):
+                    yield batch
+        finally:
+            pool.terminate()
+
+    def __str__(self):
+        scan = "Parallel Scan (%d): %s" % (self.parallelism, self.name)
+        if self.conds:
+            scan += " WHERE %s" % (' AND '.join([str(c) for c in self.conds]))
+        return scan
 
 class Projection(TreeNode, Plan):
     def __init__(self, parent, fields):
@@ -76,19 +466,30 @@ class Projection(TreeNode, Plan):
 
     def open(self):
         assert len(self.children) == 1
-        self.children[0].open()
-
-    def get_tuples(self):
-        tuples = self.children[0].run()
+        super(Projection, self).open()
 
+    def output_schema(self):
+        child_schema = self.children[0].schema
         if len(self.fields) == 0:
-            return [list(tuple.iteritems()) for tuple in tuples]
+            self.indexes = range(len(child_schema))
         else:
-            return [[(k, v) for (k, v) in tuple.iteritems() if k in self.fields]
-                    for tuple in tuples]
+            self.indexes = [inx for inx, (f, _) in enumerate(child_schema) if f in self.fields]
 
-    def close(self):
-        self.children[0].close()
+        return [child_schema[inx] for inx in self.indexes]
+
+    def batches(self):
+        if self.indexes == range(len(self.children[0].schema)):
+            for batch in iter(self.children[0].next, None):
+                yield batch
+        else:
+            project = tuple_getter(self.indexes)
+            for batch in iter(self.children[0].next, None):
+                yield [project(t) for t in batch]
+
+    @property
+    def sort_orders(self):
+        return [order for order in self.children[0].sort_orders
+                if not self.fields or all(f in self.fields for f in order)]
 
     def __str__(self):
         if self.fields:
@@ -96,36 +497,102 @@ class Projection(TreeNode, Plan):
         else:
             return "Projection: *"
 
-def eval_conds(tuple, conds):
-    def extract_field(tuple, field):
-        if not isinstance(field, Field):
-            return field
+COMPARISON_OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<>': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge
+}
 
-        field_value = tuple.get(field)
+# the operator of x OP y rewritten as y OP x
+FLIPPED_OPERATORS = {
+    '=': '=',
+    '<': '>',
+    '<=': '>=',
+    '>': '<',
+    '>=': '<='
+}
 
-        if field_value is not None:
-            return field_value
+def key_range(conds, field_type):
+    """(low, include_low, high, include_high) of the keys satisfying conds
+    comparing a key (their x) with literals. An open end is None."""
+    low, include_low, high, include_high = None, True, None, True
 
-        for (k, v) in tuple.iteritems():
-            if k.name == field.name:
-                return v
+    for cond in conds:
+        value = field_type(cond.y)
+        if cond.comp in ('=', '>', '>='):
+            inclusive = cond.comp != '>'
+            if low is None or value > low or (value == low and not inclusive):
+                low, include_low = value, inclusive
+        if cond.comp in ('=', '<', '<='):
+            inclusive = cond.comp != '<'
+            if high is None or value < high or (value == high and not inclusive):
+                high, include_high = value, inclusive
 
+    return low, include_low, high, include_high
 
-    def eval_cond(tuple, cond):
-        lopnd = extract_field(tuple, cond.x)
-        ropnd = extract_field(tuple, cond.y)
+def compile_conds(conds, schemas, names):
+    """Compile conds into the source of a python boolean expression.
 
-        ropnd = type(lopnd)(ropnd)
+    schemas[i] describes the tuples bound to the variable names[i], so
+    fields become direct subscripts of those variables. Literals are cast
+    once to the type of the field they are compared with and, like the
+    comparison operators, bound in the returned namespace.
+    """
+    namespace = {}
+    merged = sum(schemas, [])
 
-        # TODO: support more operators
-        optr = operator.eq
-        return optr(lopnd, ropnd)
+    def bind(value):
+        name = '_c%d' % len(namespace)
+        namespace[name] = value
+        return name
 
+    def operand(value):
+        if not isinstance(value, Field):
+            return None, value
+
+        inx = resolve_field(merged, value)
+        for name, schema in zip(names, schemas):
+            if inx < len(schema):
+                return '%s[%d]' % (name, inx), schema[inx][1]
+            inx -= len(schema)
+
+    exprs = []
     for cond in conds:
-        if eval_cond(tuple, cond) is False:
-            return False
+        if cond.comp not in COMPARISON_OPERATORS:
+            raise NotImplementedError("Unsupported operator %s" % cond.comp)
+        optr = COMPARISON_OPERATORS[cond.comp]
+
+        (x, x_type), (y, y_type) = operand(cond.x), operand(cond.y)
+
+        if x is None and y is None:
+            if not optr(x_type, type(x_type)(y_type)):
+                return 'False', namespace
+            continue
+        elif y is None:
+            y = bind(x_type(y_type))
+        elif x is None:
+            x = bind(y_type(x_type))
+        elif x_type is not y_type:
+            y = '%s(%s)' % (bind(x_type), y)
+
+        exprs.append('%s(%s, %s)' % (bind(optr), x, y))
+
+    return ' and '.join(exprs) or 'True', namespace
+
+def compile_filter(conds, schema):
+    """Compile conds into a function keeping the matching tuples of a batch."""
+    expr, namespace = compile_conds(conds, [schema], ['t'])
+    return eval('lambda batch: [t for t in batch if %s]' % expr, namespace)
 
-    return True
+def compile_join_filter(conds, left_schema, right_schema):
+    """Compile conds into a function joining a left tuple with a list of
+    right tuples."""
+    expr, namespace = compile_conds(conds, [left_schema, right_schema], ['p', 'q'])
+    return eval('lambda p, inner: [p + q for q in inner if %s]' % expr, namespace)
 
 class Selection(TreeNode, Plan):
     def __init__(self, parent, conds):
@@ -134,21 +601,32 @@ class Selection(TreeNode, Plan):
 
     def open(self):
         assert len(self.children) == 1
-        self.children[0].open()
+        super(Selection, self).open()
+        self.filter = compile_filter(self.conds, self.schema)
 
-    def get_tuples(self):
-        tuples = self.children[0].run()
+    def output_schema(self):
+        return self.children[0].schema
 
-        return [tuple for tuple in tuples if eval_conds(tuple, self.conds)]
+    def batches(self):
+        for batch in iter(self.children[0].next, None):
+            self.predicate_evaluations += len(batch)
+            selected = self.filter(batch)
+            if selected:
+                yield selected
 
-    def close(self):
-        self.children[0].close()
+    @property
+    def sort_orders(self):
+        return self.children[0].sort_orders
 
     def __str__(self):
         return "Selection: %s" % ('\nAND '.join([str(c) for c in self.conds]))
 
 def merge_tuples(p, q):
-    return collections.OrderedDict(p.items() + q.items())
+    return p + q
+
+def join_schema(plan):
+    left, right = plan.children
+    return left.schema + right.schema
 
 class CartesianProduct(TreeNode, Plan):
     def __init__(self, parent):
@@ -156,15 +634,29 @@ class CartesianProduct(TreeNode, Plan):
 
     def open(self):
         assert len(self.children) == 2
-        self.children[0].open()
+        super(CartesianProduct, self).open()
 
-    def get_tuples(self):
-        ts1, ts2 = [c.run() for c in self.children]
+    def output_schema(self):
+        return join_schema(self)
 
-        return [merge_tuples(t1, t2) for t1 in ts1 for t2 in ts2]
+    def batches(self):
+        outer, inner = self.children
+        # the inner input is rescanned for every outer tuple, so keep it around
+        inner_tuples = inner.run()
+        self.account(inner_tuples)
 
-    def close(self):
-        self.children[0].close()
+        def product():
+            for t1 in outer:
+                self.loops += 1
+                for t2 in inner_tuples:
+                    yield merge_tuples(t1, t2)
+
+        for batch in chunked(product()):
+            yield batch
+
+    @property
+    def sort_orders(self):
+        return self.children[0].sort_orders
 
     def __str__(self):
         return "CartesianProduct"
@@ -176,23 +668,526 @@ class NLJoin(TreeNode, Plan):
 
     def open(self):
         assert len(self.children) == 2
-        self.children[0].open()
+        super(NLJoin, self).open()
 
-    def get_tuples(self):
-        ts1, ts2 = [c.run() for c in self.children]
+        left, right = self.children
+        self.join_filter = compile_join_filter(self.conds, left.schema, right.schema)
 
-        joined = []
+    def output_schema(self):
+        return join_schema(self)
 
-        for p in ts1:
-            for q in ts2:
-                r = merge_tuples(p, q)
-                if eval_conds(r, self.conds):
-                    joined.append(r)
+    def batches(self):
+        outer, inner = self.children
+        inner_tuples = inner.run()
+        self.account(inner_tuples)
 
-        return joined
+        def join():
+            for p in outer:
+                self.loops += 1
+                self.predicate_evaluations += len(inner_tuples)
+                for r in self.join_filter(p, inner_tuples):
+                    yield r
 
-    def close(self):
-        self.children[0].close()
+        for batch in chunked(join()):
+            yield batch
+
+    @property
+    def sort_orders(self):
+        return self.children[0].sort_orders
 
     def __str__(self):
         return 'Nested Loop Join: %s' % (' AND '.join([str(c) for c in self.conds]))
+
+class HashJoin(TreeNode, Plan):
+    """Equi-join that hashes one input and probes it with the other.
+
+    conds are Field = Field comparisons whose x belongs to the left input
+    and y to the right one. build_side is the index of the child to build
+    the hash table on, normally the smaller one.
+    """
+    def __init__(self, parent, conds, build_side=1):
+        super(HashJoin, self).__init__(parent)
+        self.conds = conds
+        self.build_side = build_side
+
+    def open(self):
+        assert len(self.children) == 2
+        super(HashJoin, self).open()
+
+    def output_schema(self):
+        return join_schema(self)
+
+    def batches(self):
+        left, right = self.children
+        left_key = tuple_getter([resolve_field(left.schema, c.x) for c in self.conds])
+        right_key = tuple_getter([resolve_field(right.schema, c.y) for c in self.conds])
+
+        if self.build_side == 0:
+            build, probe = left, right
+            build_key, probe_key = left_key, right_key
+        else:
+            build, probe = right, left
+            build_key, probe_key = right_key, left_key
+
+        build_tuples = build.run()
+        self.account(build_tuples)
+
+        table = collections.defaultdict(list)
+        for t in build_tuples:
+            table[build_key(t)].append(t)
+
+        def join():
+            for p in probe:
+                self.loops += 1
+                matches = table.get(probe_key(p))
+                if not matches:
+                    continue
+
+                # keep the column order of the logical join
+                if self.build_side == 0:
+                    for q in matches:
+                        yield merge_tuples(q, p)
+                else:
+                    for q in matches:
+                        yield merge_tuples(p, q)
+
+        for batch in chunked(join()):
+            yield batch
+
+    @property
+    def sort_orders(self):
+        # tuples come out in the order of the probe input
+        return self.children[1 - self.build_side].sort_orders
+
+    def __str__(self):
+        return 'Hash Join: %s' % (' AND '.join([str(c) for c in self.conds]))
+
+class IndexNestedLoopJoin(TreeNode, Plan):
+    """Equi-join probing an index of the inner relation with every outer tuple.
+
+    conds are Field = Field comparisons whose x belongs to the left input
+    and y to the right one. The child at inner_side is a Relation with an
+    index on the attribute of one of the conds; it is never scanned, the
+    lines of the matching rows are read from its file instead.
+    """
+    def __init__(self, parent, conds, index, inner_side=1):
+        super(IndexNestedLoopJoin, self).__init__(parent)
+        self.conds = conds
+        self.index = index
+        self.inner_side = inner_side
+
+    def open(self):
+        assert len(self.children) == 2
+        super(IndexNestedLoopJoin, self).open()
+
+    def output_schema(self):
+        return join_schema(self)
+
+    def batches(self):
+        left, right = self.children
+        inner, outer = self.children[self.inner_side], self.children[1 - self.inner_side]
+
+        key_cond = [c for c in self.conds
+                    if (c.y if self.inner_side == 1 else c.x).name == self.index.attr][0]
+        outer_key = resolve_field(outer.schema, key_cond.x if self.inner_side == 1 else key_cond.y)
+        key_type = dict(inner.fields)[self.index.attr]
+
+        # the conds are checked again on the fetched tuples, which also
+        # covers the ones the index doesn't answer
+        expr, namespace = compile_conds(self.conds, [left.schema, right.schema], ['p', 'q'])
+        if self.inner_side == 1:
+            join_filter = eval('lambda p, inner: [p + q for q in inner if %s]' % expr, namespace)
+        else:
+            join_filter = eval('lambda q, inner: [p + q for p in inner if %s]' % expr, namespace)
+
+        parse_line = inner.line_parser(inner.indexes)
+
+        def fetch(offsets):
+            matches = []
+            for offset in offsets:
+                relation_file.seek(offset)
+                matches.append(parse_line(relation_file.readline()))
+            return matches
+
+        with open(inner.path, 'rb') as relation_file:
+            for batch in iter(outer.next, None):
+                joined = []
+                for t in batch:
+                    self.loops += 1
+                    offsets = self.index.lookup(key_type(t[outer_key]))
+                    if offsets:
+                        self.predicate_evaluations += len(offsets)
+                        joined.extend(join_filter(t, fetch(offsets)))
+                if joined:
+                    yield joined
+
+    def partition(self, inx, count):
+        # the inner relation is only probed, split the outer input
+        self.children[1 - self.inner_side].partition(inx, count)
+
+    @property
+    def sort_orders(self):
+        return self.children[1 - self.inner_side].sort_orders
+
+    def __str__(self):
+        return 'Index Nested Loop Join: %s' % (' AND '.join([str(c) for c in self.conds]))
+
+def external_sort(tuples, key, limit=None):
+    """Sort tuples by key holding at most limit tuples in memory.
+
+    Sorted runs of limit tuples are spilled to temporary files and merged
+    back lazily, so the result is an iterator.
+    """
+    limit = limit or settings.WORK_MEMORY
+    tuples = iter(tuples)
+
+    run = list(itertools.islice(tuples, limit))
+    run.sort(key=key)
+    rest = list(itertools.islice(tuples, limit))
+    if not rest:
+        return iter(run)
+
+    def spill(run):
+        run_file = tempfile.TemporaryFile()
+        for batch in chunked(run):
+            pickle.dump(batch, run_file, pickle.HIGHEST_PROTOCOL)
+        run_file.seek(0)
+        return run_file
+
+    def read(run_file, run_inx):
+        # decorate with the run index so that equal keys never compare tuples
+        with run_file:
+            while True:
+                try:
+                    batch = pickle.load(run_file)
+                except EOFError:
+                    return
+                for seq, t in enumerate(batch):
+                    yield (key(t), run_inx, seq, t)
+
+    run_files = [spill(run)]
+    while rest:
+        rest.sort(key=key)
+        run_files.append(spill(rest))
+        rest = list(itertools.islice(tuples, limit))
+
+    merged = heapq.merge(*[read(f, inx) for inx, f in enumerate(run_files)])
+    return (t for (_, _, _, t) in merged)
+
+class SortMergeJoin(TreeNode, Plan):
+    """Equi-join of two inputs sorted on their join keys.
+
+    conds are Field = Field comparisons whose x belongs to the left input
+    and y to the right one. An input that already comes sorted on its keys
+    (e.g. the output of another SortMergeJoin on the same attributes) is
+    merged as it streams; otherwise it goes through external_sort first.
+    """
+    def __init__(self, parent, conds):
+        super(SortMergeJoin, self).__init__(parent)
+        self.conds = conds
+
+    @property
+    def left_keys(self):
+        return [c.x for c in self.conds]
+
+    @property
+    def right_keys(self):
+        return [c.y for c in self.conds]
+
+    def open(self):
+        assert len(self.children) == 2
+        super(SortMergeJoin, self).open()
+
+    def output_schema(self):
+        return join_schema(self)
+
+    def sorted_input(self, child, keys):
+        key = tuple_getter([resolve_field(child.schema, k) for k in keys])
+
+        if child.sorted_on(keys):
+            return iter(child), key
+        else:
+            return external_sort(child, key), key
+
+    def batches(self):
+        left, left_key = self.sorted_input(self.children[0], self.left_keys)
+        right, right_key = self.sorted_input(self.children[1], self.right_keys)
+
+        def join():
+            left_groups = itertools.groupby(left, left_key)
+            right_groups = itertools.groupby(right, right_key)
+
+            l = next(left_groups, None)
+            r = next(right_groups, None)
+            while l is not None and r is not None:
+                self.loops += 1
+                if l[0] < r[0]:
+                    l = next(left_groups, None)
+                elif l[0] > r[0]:
+                    r = next(right_groups, None)
+                else:
+                    matches = list(r[1])
+                    for p in l[1]:
+                        for q in matches:
+                            yield merge_tuples(p, q)
+
+                    l = next(left_groups, None)
+                    r = next(right_groups, None)
+
+        for batch in chunked(join()):
+            yield batch
+
+    @property
+    def sort_orders(self):
+        return [self.left_keys, self.right_keys]
+
+    def __str__(self):
+        return 'Sort Merge Join: %s' % (' AND '.join([str(c) for c in self.conds]))
+
+class SpillFile(object):
+    """Temporary file tuples are appended to, pickled in batches."""
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.buffer = []
+        self.count = 0
+
+    def append(self, t):
+        self.buffer.append(t)
+        self.count += 1
+        if len(self.buffer) >= settings.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            pickle.dump(self.buffer, self.file, pickle.HIGHEST_PROTOCOL)
+            self.buffer = []
+
+    def __iter__(self):
+        self.flush()
+        self.file.seek(0)
+        while True:
+            try:
+                batch = pickle.load(self.file)
+            except EOFError:
+                return
+            for t in batch:
+                yield t
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.file.close()
+
+class GraceHashJoin(TreeNode, Plan):
+    """Hash join of inputs that don't fit in memory.
+
+    conds and build_side are as for HashJoin. When the build input holds
+    more than limit tuples (settings.WORK_MEMORY by default), both inputs
+    are partitioned on their join keys into FANOUT temporary files each and
+    every pair of matching partitions is hash joined in memory. A build
+    partition still over limit (skewed keys) is partitioned again with
+    another hash seed, up to MAX_DEPTH levels; past that it is joined a
+    block of limit tuples at a time.
+    """
+    FANOUT = 16
+    MAX_DEPTH = 4
+
+    def __init__(self, parent, conds, build_side=1, limit=None):
+        super(GraceHashJoin, self).__init__(parent)
+        self.conds = conds
+        self.build_side = build_side
+        self.limit = limit
+        self.spilled_partitions = 0
+
+    def open(self):
+        assert len(self.children) == 2
+        super(GraceHashJoin, self).open()
+
+    def output_schema(self):
+        return join_schema(self)
+
+    def hash_join(self, build, probe):
+        table = collections.defaultdict(list)
+        for t in build:
+            table[self.build_key(t)].append(t)
+
+        for p in probe:
+            self.loops += 1
+            for q in table.get(self.probe_key(p), ()):
+                # keep the column order of the logical join
+                if self.build_side == 0:
+                    yield merge_tuples(q, p)
+                else:
+                    yield merge_tuples(p, q)
+
+    def spill_partitions(self, tuples, key, depth):
+        files = [SpillFile() for _ in range(self.FANOUT)]
+        for t in tuples:
+            files[hash((depth, key(t))) % self.FANOUT].append(t)
+
+        self.spilled_partitions += self.FANOUT
+        return files
+
+    def join_partitioned(self, build, probe, depth):
+        """Partition both inputs with the hash seed depth and join the
+        matching partitions"""
+        build_files = self.spill_partitions(build, self.build_key, depth)
+        probe_files = self.spill_partitions(probe, self.probe_key, depth)
+
+        try:
+            for b, p in zip(build_files, probe_files):
+                if len(b) and len(p):
+                    for t in self.join_partition(b, p, depth + 1):
+                        yield t
+                b.close()
+                p.close()
+        finally:
+            for f in build_files + probe_files:
+                f.close()
+
+    def join_partition(self, build, probe, depth):
+        limit = self.limit or settings.WORK_MEMORY
+
+        if len(build) <= limit:
+            joined = self.hash_join(build, probe)
+        elif depth < self.MAX_DEPTH:
+            joined = self.join_partitioned(build, probe, depth)
+        else:
+            # (nearly) all tuples share a key, hashing again won't split them
+            joined = itertools.chain.from_iterable(
+                self.hash_join(block, probe) for block in chunked(build, limit))
+
+        for t in joined:
+            yield t
+
+    def batches(self):
+        left, right = self.children
+        left_key = tuple_getter([resolve_field(left.schema, c.x) for c in self.conds])
+        right_key = tuple_getter([resolve_field(right.schema, c.y) for c in self.conds])
+
+        if self.build_side == 0:
+            build, probe = left, right
+            self.build_key, self.probe_key = left_key, right_key
+        else:
+            build, probe = right, left
+            self.build_key, self.probe_key = right_key, left_key
+
+        limit = self.limit or settings.WORK_MEMORY
+        self.spilled_partitions = 0
+
+        build_tuples = iter(build)
+        head = list(itertools.islice(build_tuples, limit + 1))
+
+        if len(head) <= limit:
+            # the build input fits, no need to touch the disk
+            self.account(head)
+            joined = self.hash_join(head, probe)
+        else:
+            joined = self.join_partitioned(itertools.chain(head, build_tuples), probe, 0)
+
+        for batch in chunked(joined):
+            yield batch
+
+    def __str__(self):
+        return 'Grace Hash Join: %s' % (' AND '.join([str(c) for c in self.conds]))
+
+class Exchange(TreeNode, Plan):
+    """Hash partitions its input on keys between the shares of a Gather.
+
+    Every share reads the whole input and keeps the tuples whose keys hash
+    to it, so joining two Exchanges on their join keys pairs up matching
+    tuples in the same share. Outside of a Gather tuples pass through.
+    """
+    def __init__(self, parent, keys):
+        super(Exchange, self).__init__(parent)
+        self.keys = keys
+
+    def open(self):
+        assert len(self.children) == 1
+        super(Exchange, self).open()
+
+    def partition(self, inx, count):
+        # the input below is read whole
+        self.part = (inx, count)
+
+    def output_schema(self):
+        return self.children[0].schema
+
+    def batches(self):
+        if self.part is None:
+            for batch in iter(self.children[0].next, None):
+                yield batch
+            return
+
+        inx, count = self.part
+        key = tuple_getter([resolve_field(self.schema, k) for k in self.keys])
+        for batch in iter(self.children[0].next, None):
+            selected = [t for t in batch if hash(key(t)) % count == inx]
+            if selected:
+                yield selected
+
+    @property
+    def sort_orders(self):
+        return self.children[0].sort_orders
+
+    def __str__(self):
+        return 'Exchange: hash(%s)' % (','.join([str(k) for k in self.keys]))
+
+def run_partition(plan, inx, count, queue):
+    """Run share inx of count of plan, putting its batches on queue. Runs
+    in the worker processes of Gather."""
+    try:
+        plan.partition(inx, count)
+        with plan:
+            for batch in iter(plan.next, None):
+                queue.put(('batch', batch))
+        queue.put(('done', None))
+    except Exception:
+        queue.put(('error', traceback.format_exc()))
+
+class Gather(TreeNode, Plan):
+    """Runs degree shares of its input (see Plan.partition) in worker
+    processes and merges their output as it arrives."""
+    def __init__(self, parent, degree):
+        super(Gather, self).__init__(parent)
+        self.degree = degree
+
+    def open(self):
+        assert len(self.children) == 1
+        super(Gather, self).open()
+
+    def output_schema(self):
+        return self.children[0].schema
+
+    def batches(self):
+        child = self.children[0]
+        # the input was only opened here to learn its schema, the workers
+        # (forked with a copy of it) do the work
+        child.close()
+
+        # bound the batches waiting to be merged
+        queue = multiprocessing.Queue(4 * self.degree)
+        workers = [multiprocessing.Process(target=run_partition, args=(child, inx, self.degree, queue))
+                   for inx in range(self.degree)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            running = len(workers)
+            while running:
+                kind, value = queue.get()
+                if kind == 'batch':
+                    yield value
+                elif kind == 'done':
+                    running -= 1
+                else:
+                    raise RuntimeError("Gather worker failed:\n%s" % value)
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+    def __str__(self):
+        return 'Gather (%d workers)' % self.degree
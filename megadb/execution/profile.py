@@ -0,0 +1,110 @@
+"""Per-operator runtime profile of a physical plan (EXPLAIN ANALYZE).
+
+After a plan ran, profile_plan() collects the counters of every operator
+(see Plan) into a tree of dicts, ready for json.dumps:
+
+    {"operator": "Hash Join: ...", "type": "HashJoin",
+     "rows_in": 1812, "rows_out": 1812,
+     "estimated_rows": 1812.0, "q_error": 1.0,
+     "time": 0.004, "exclusive_time": 0.002,
+     "predicate_evaluations": 0, "loops": 1812, "memory": 83232,
+     "children": [...]}
+
+time includes the children of the operator, exclusive_time doesn't.
+rows_in is the number of tuples the children returned (0 for scans).
+memory is the most bytes of tuples the operator held at once.
+estimated_rows is the cardinality the optimizer expected (see
+Plan.estimated_size) and q_error how far off it was, the factor between
+estimate and actual rows, so 1.0 is exact (both are None without an
+estimate). estimation_errors() lists the operators by q_error, worst
+first. format_profile() renders the same tree as indented text.
+
+Operators below a Gather run in its worker processes, so their counters
+stay at 0.
+"""
+
+# operator specific counters added to the profile when present
+EXTRA_COUNTERS = ['spilled_partitions']
+
+def q_error(estimated, actual):
+    """max(estimated / actual, actual / estimated), counting both as at
+    least one tuple"""
+    if estimated is None:
+        return None
+
+    estimated, actual = max(float(estimated), 1.0), max(float(actual), 1.0)
+    return max(estimated / actual, actual / estimated)
+
+def profile_plan(plan):
+    """Counters of plan and its children, after it ran"""
+    children = [profile_plan(c) for c in plan.get_children()]
+    children_time = sum(c['time'] for c in children)
+
+    profile = {
+        'operator': ' '.join(str(plan).split()),
+        'type': type(plan).__name__,
+        'rows_in': sum(c['rows_out'] for c in children),
+        'rows_out': plan.table_size,
+        'estimated_rows': plan.estimated_size,
+        'q_error': q_error(plan.estimated_size, plan.table_size),
+        'time': plan.time_duration,
+        'exclusive_time': max(plan.time_duration - children_time, 0.0),
+        'predicate_evaluations': plan.predicate_evaluations,
+        'loops': plan.loops,
+        'memory': plan.memory_used,
+        'children': children
+    }
+
+    for counter in EXTRA_COUNTERS:
+        if hasattr(plan, counter):
+            profile[counter] = getattr(plan, counter)
+
+    return profile
+
+def estimation_errors(profile):
+    """[(operator, estimated rows, actual rows, q-error)] of every operator
+    with an estimate, the worst estimate first"""
+    errors = []
+
+    def aux(p):
+        if p['q_error'] is not None:
+            errors.append((p['operator'], p['estimated_rows'], p['rows_out'], p['q_error']))
+        for c in p['children']:
+            aux(c)
+
+    aux(profile)
+    errors.sort(key=lambda e: e[3], reverse=True)
+    return errors
+
+def format_profile(profile, indent=0):
+    """Text tree of a profile, one operator per line"""
+    line = "%s (rows in=%d out=%d, time=%.2f ms self=%.2f ms" % (
+        profile['operator'], profile['rows_in'], profile['rows_out'],
+        profile['time'] * 1000.0, profile['exclusive_time'] * 1000.0)
+
+    if profile['q_error'] is not None:
+        line += ", estimated=%.0f q-error=%.2f" % (profile['estimated_rows'], profile['q_error'])
+    if profile['loops']:
+        line += ", loops=%d" % profile['loops']
+    if profile['predicate_evaluations']:
+        line += ", predicates=%d" % profile['predicate_evaluations']
+    if profile['memory']:
+        line += ", memory=%d B" % profile['memory']
+    for counter in EXTRA_COUNTERS:
+        if profile.get(counter):
+            line += ", %s=%d" % (counter.replace('_', ' '), profile[counter])
+    line += ")"
+
+    if indent:
+        line = '  ' * (indent - 1) + '->  ' + line
+
+    lines = [line]
+    for c in profile['children']:
+        lines.append(format_profile(c, indent + 1))
+    return '\n'.join(lines)
+
+def explain_analyze(root):
+    """Run the physical plan root, returning (tuples, profile)"""
+    with root:
+        tuples = root.run()
+    return tuples, profile_plan(root)
@@ -0,0 +1,193 @@
+"""Admission control and cancellation of concurrent queries.
+
+A Scheduler runs queries on behalf of many threads. Before a query
+starts, the memory its joins would hold is estimated from Schema.stats.
+Queries are admitted while fewer than max_concurrent run and the
+estimates of the running ones fit in the memory budget; the others wait
+for their turn, or are rejected after a timeout. A query whose estimate
+alone exceeds the budget is rejected right away.
+
+Running plans report the tuples they materialize to their QueryContext
+(Plan.account) and check it between batches (Plan.next), so a query
+stops at the next operator boundary once it is cancelled or holds more
+than its memory limit.
+"""
+import sys
+import timeit
+import itertools
+import threading
+
+import megadb.settings as settings
+import megadb.algebra.plan as logical
+from megadb.execution.executor import Executor
+
+class QueryCancelled(Exception):
+    pass
+
+class MemoryLimitExceeded(QueryCancelled):
+    pass
+
+class AdmissionRejected(Exception):
+    pass
+
+class QueryContext(object):
+    """Cancellation token and memory accounting of one query"""
+    _ids = itertools.count(1)
+
+    def __init__(self, memory_limit=None):
+        self.query_id = next(QueryContext._ids)
+        self.memory_limit = memory_limit
+        self.estimated_memory = 0
+        self.peak_memory = 0
+        # the physical plan, once Scheduler.execute translated it
+        self.plan = None
+
+        # id(operator) -> bytes it holds
+        self._held = {}
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def memory(self):
+        """Bytes held by the operators of the query right now"""
+        return sum(self._held.values())
+
+    def charge(self, operator, nbytes):
+        with self._lock:
+            self._held[id(operator)] = nbytes
+            self.peak_memory = max(self.peak_memory, self.memory)
+        self.check()
+
+    def release(self, operator):
+        with self._lock:
+            self._held.pop(id(operator), None)
+
+    def check(self):
+        if self.cancelled:
+            raise QueryCancelled("Query %d was cancelled" % self.query_id)
+        if self.memory_limit is not None and self.memory > self.memory_limit:
+            raise MemoryLimitExceeded("Query %d holds %d bytes, over its limit of %d" %
+                                      (self.query_id, self.memory, self.memory_limit))
+
+# rough size of a boxed int or short string
+VALUE_SIZE = 40
+
+def tuple_size(width):
+    return sys.getsizeof(()) + width * (8 + VALUE_SIZE)
+
+def estimate_memory(executor, node):
+    """Estimated bytes the joins of a logical plan keep in memory"""
+    children = getattr(node, 'children', [])
+    total = sum(estimate_memory(executor, c) for c in children)
+
+    if isinstance(node, logical.CartesianProduct):
+        # the inner input is kept around
+        held = [children[1]]
+    elif isinstance(node, (logical.ThetaJoin, logical.NaturalJoin)):
+        # hash tables go on the smaller input, larger ones spill
+        held = [min(children, key=lambda c: executor.estimate_stat(c)[0])]
+    else:
+        held = []
+
+    for c in held:
+        tuples = executor.estimate_stat(c)[0]
+        if not isinstance(node, logical.CartesianProduct):
+            tuples = min(tuples, settings.WORK_MEMORY)
+        total += int(tuples) * tuple_size(len(executor.extract_fields(c)))
+
+    return total
+
+class Scheduler(object):
+    """Runs queries of a Schema for concurrent callers under admission control.
+
+    At most max_concurrent queries run at once and the memory estimates of
+    the running queries stay within memory_budget. Every query may hold
+    memory_limit bytes of materialized tuples. Defaults come from settings.
+    """
+    def __init__(self, schema, max_concurrent=None, memory_budget=None, memory_limit=None):
+        self.schema = schema
+        self.max_concurrent = max_concurrent or settings.MAX_CONCURRENT_QUERIES
+        self.memory_budget = memory_budget or settings.QUERY_MEMORY_BUDGET
+        self.memory_limit = memory_limit or settings.QUERY_MEMORY_LIMIT
+
+        # query_id -> QueryContext of the waiting and running queries
+        self.queries = {}
+        self.running = 0
+        self.reserved = 0
+        self._condition = threading.Condition()
+
+    def admit(self, context, timeout=None):
+        if context.estimated_memory > self.memory_budget:
+            raise AdmissionRejected("Query %d needs an estimated %d bytes, over the budget of %d" %
+                                    (context.query_id, context.estimated_memory, self.memory_budget))
+
+        deadline = None if timeout is None else timeit.default_timer() + timeout
+        with self._condition:
+            while (self.running >= self.max_concurrent or
+                   self.reserved + context.estimated_memory > self.memory_budget):
+                context.check()
+
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - timeit.default_timer()
+                    if remaining <= 0:
+                        raise AdmissionRejected("Query %d waited too long to run" % context.query_id)
+
+                # wake up once in a while to notice cancellation
+                self._condition.wait(0.1 if remaining is None else min(remaining, 0.1))
+
+            context.check()
+            self.running += 1
+            self.reserved += context.estimated_memory
+
+    def finish(self, context):
+        with self._condition:
+            self.running -= 1
+            self.reserved -= context.estimated_memory
+            self._condition.notify_all()
+
+    def execute(self, tree, backend='row', context=None, timeout=None):
+        """Run the logical plan tree once admitted.
+
+        Returns (fields, tuples) of the result. Raises AdmissionRejected if
+        the query can't be admitted and QueryCancelled if it is cancelled
+        (or goes over its memory limit) while waiting or running.
+        """
+        if context is None:
+            context = QueryContext(self.memory_limit)
+
+        executor = Executor(self.schema, backend)
+        context.estimated_memory = estimate_memory(executor, tree)
+        translated = executor.translate_tree(tree)
+        context.plan = translated
+
+        with self._condition:
+            self.queries[context.query_id] = context
+        try:
+            self.admit(context, timeout)
+            try:
+                translated.set_context(context)
+                with translated:
+                    return [f for f, _ in translated.schema], translated.run()
+            finally:
+                self.finish(context)
+        finally:
+            with self._condition:
+                del self.queries[context.query_id]
+
+    def cancel(self, query_id):
+        """Cancel a waiting or running query; False if there is no such query"""
+        with self._condition:
+            context = self.queries.get(query_id)
+        if context is None:
+            return False
+
+        context.cancel()
+        return True
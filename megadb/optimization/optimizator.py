@@ -5,6 +5,8 @@ import megadb.tree as tree
 import megadb.algebra as algebra
 
 from megadb.algebra.parser import print_parse_tree
+from megadb.algebra.frozen import FrozenNode, freeze, thaw, distinct_plans
+from megadb.storage.statistics import selectivity
 
 class BaseOptimizator(object):
     def run(self, tree):
@@ -99,147 +101,217 @@ def extract_join_order(node):
 
     return [lc, rc]
 
-def enumerate_join_orders(root):
-    def enumerate_join_order_left_deep(node):
-        def combine(x, y):
-            join = algebra.NaturalJoin(None)
-            new_y = clone_tree(y)
-            new_y.parent = join
-            x.parent = join
-            return join
-
-        enums = []
-        participants = set(extract_join_order(node))
-        combs = itertools.combinations(participants, 2)
-        for p1, p2 in combs:
-            for perm in itertools.permutations(participants - set((p1, p2))):
-                init_join = algebra.NaturalJoin(None)
-                new_p1 = clone_tree(p1)
-                new_p2 = clone_tree(p2)
-
-                new_p1.parent = init_join
-                new_p2.parent = init_join
-
-                join_tree = reduce(combine, perm, init_join)
-                partial_tree = clone_partial_tree(node)
-                join_tree.parent = partial_tree
-
-                enums.append(find_root(partial_tree))
-
-        return enums
-
-    def enumerate_join_order_bushy(node):
-        def combine(pair):
-            if len(pair) == 1:
-                return pair[0]
-            else:
-                join = algebra.NaturalJoin(None)
-                new_x = clone_tree(pair[0])
-                new_y = clone_tree(pair[1])
-                new_x.parent = join
-                new_y.parent = join
-                return join
-
-        def build_two_pair(parts):
-            if len(parts) == 0:
-                return []
-            elif len(parts) == 1:
-                return [[(parts.pop(),)]]
-
-            results = []
-            part_sets = set(parts)
-            for p1, p2 in itertools.combinations(part_sets, 2):
-                rest = build_two_pair(part_sets - set((p1, p2)))
-                if rest:
-                    for r in rest:
-                        r.append((p1, p2))
-
-                    results.append(rest)
-                else:
-                    results.append([[(p1, p2)]])
+def join_participants(plan):
+    """extract_join_order of a FrozenNode"""
+    if not plan.is_a(algebra.NaturalJoin):
+        return []
 
-            return list(itertools.chain.from_iterable(results))
+    lc, rc = plan.children
+    if rc.is_a(algebra.NaturalJoin):
+        rc, lc = lc, rc
 
-        def enumerate_pairs(parts):
-            results = []
-            pairs = build_two_pair(parts)
-            for p in pairs:
-                folded = map(combine, p)
+    if lc.is_a(algebra.NaturalJoin):
+        return [rc] + join_participants(lc)
 
-                if len(folded) == 1:
-                    new_tree = clone_partial_tree(node)
-                    folded[0].parent = new_tree
-                    results.append(find_root(new_tree))
-                else:
-                    results.extend(enumerate_pairs(folded))
-            return results
+    return [lc, rc]
 
-        participants = set(extract_join_order(node))
-        # return build_two_pair([1,2])
-        return enumerate_pairs(participants)
-    left_deep_trees = tree_traverse_first(root, algebra.NaturalJoin, enumerate_join_order_left_deep) or []
-    bushy_trees = tree_traverse_first(root, algebra.NaturalJoin, enumerate_join_order_bushy) or []
+def join_orders(plan):
+    """Plans (FrozenNodes) joining the participants of the first
+    NaturalJoin of plan in every left-deep order and every bushy pairing,
+    without duplicates. Only the joins and the nodes above them are
+    built anew, the participants and the rest of plan are shared."""
+    path = plan.find(algebra.NaturalJoin)
+    if path is None:
+        return [plan]
+
+    def join(x, y):
+        return FrozenNode(algebra.NaturalJoin, None, [x, y])
+
+    def left_deep(participants):
+        for p1, p2 in itertools.combinations(participants, 2):
+            rest = [p for p in participants if p is not p1 and p is not p2]
+            for perm in itertools.permutations(rest):
+                yield reduce(lambda x, y: join(y, x), perm, join(p1, p2))
+
+    def pairings(parts):
+        """Every way of grouping parts in pairs, one alone when odd"""
+        if len(parts) % 2:
+            for inx, alone in enumerate(parts):
+                for pairs in pairings(parts[:inx] + parts[inx + 1:]):
+                    yield [(alone,)] + pairs
+        elif not parts:
+            yield []
+        else:
+            for inx in range(1, len(parts)):
+                for pairs in pairings(parts[1:inx] + parts[inx + 1:]):
+                    yield [(parts[0], parts[inx])] + pairs
+
+    def bushy(parts):
+        for pairs in pairings(parts):
+            folded = [join(*pair) if len(pair) == 2 else pair[0] for pair in pairs]
+            if len(folded) == 1:
+                yield folded[0]
+            else:
+                for tree in bushy(folded):
+                    yield tree
 
-    combined = left_deep_trees + bushy_trees
-    return combined or [root]
+    participants = join_participants(plan.get(path))
+    trees = itertools.chain(left_deep(participants), bushy(participants))
+    return distinct_plans(plan.replace(path, t) for t in trees)
+
+def enumerate_join_orders(root):
+    return [thaw(plan) for plan in join_orders(freeze(root))]
+
+def selection_orders(plan):
+    """Plans (FrozenNodes) like plan with its cascades of selections in
+    every order, without duplicates, sharing the unchanged subtrees"""
+    if plan.is_a(algebra.Selection):
+        selections = []
+        bottom = plan
+        while bottom.is_a(algebra.Selection):
+            selections.append(bottom.args)
+            bottom = bottom.children[0]
+
+        # the cascade from the bottom up, as it is first
+        selections.reverse()
+        plans = []
+        for below in selection_orders(bottom):
+            for perm in itertools.permutations(selections):
+                tree = below
+                for conds in perm:
+                    tree = FrozenNode(algebra.Selection, conds, [tree])
+                plans.append(tree)
+        return distinct_plans(plans)
+
+    children = [selection_orders(c) for c in plan.children]
+    if all(len(c) == 1 for c in children):
+        return [plan]
+    return [plan.with_children(cs) for cs in itertools.product(*children)]
 
 def enumerate_selections(root):
+    return [thaw(plan) for plan in selection_orders(freeze(root))]
+
+def selection_stat(stats, child, cond):
+    """Estimate [T, {attr: V}] of a selection on cond over an input
+    estimated as child: T(S) = T(R) * sel(R, cond), from the statistics of
+    the relation of the selected field (T(R) / V(R, a) without them)"""
+    total, distinct = child
+    field = cond.x if isinstance(cond.x, algebra.Field) else cond.y
+
+    if field.namespace in stats:
+        new_t = float(total) * selectivity(stats, field.namespace, cond)
+    else:
+        new_t = float(total) / distinct[field.name]
+
+    distinct = dict(distinct)
+    if cond.comp == '=':
+        distinct[field.name] = 1
+    else:
+        distinct[field.name] = min(distinct[field.name], max(new_t, 1))
+
+    return [new_t, distinct]
+
+def participant_stat(stats, p):
+    """Estimate [T, {attr: V}] of a join participant, a relation or a
+    selection over one"""
+    if isinstance(p, algebra.Relation):
+        # copy V too, the selection estimate overwrites it
+        total, distinct = stats[str(p.name)]
+        return [total, dict(distinct)]
+    elif isinstance(p, algebra.Selection):
+        return selection_stat(stats, participant_stat(stats, p.children[0]), p.conds[0])
+
+    raise NotImplementedError()
+
+def join_size(p_stat, q_stat):
+    """Estimate T of the natural join of inputs estimated as p_stat and
+    q_stat: T(P) * T(Q) / max{V(P, a), V(Q, a)} for every common
+    attribute a (a Cartesian product without any)"""
+    new_table_size = float(p_stat[0] * q_stat[0])
+    for common_attr in p_stat[1].viewkeys() & q_stat[1].viewkeys():
+        new_table_size /= max(p_stat[1][common_attr], q_stat[1][common_attr])
+
+    return new_table_size
+
+def join_stat(p_stat, q_stat):
+    """Estimate [T, {attr: V}] of the natural join of inputs estimated as
+    p_stat and q_stat (see join_size)"""
+    new_value_set = dict(p_stat[1].items() + q_stat[1].items())
+    for common_attr in p_stat[1].viewkeys() & q_stat[1].viewkeys():
+        new_value_set[common_attr] = min(p_stat[1][common_attr], q_stat[1][common_attr])
+
+    return [join_size(p_stat, q_stat), new_value_set]
+
+def product_stat(child_r, child_s):
+    """Estimate [T, {attr: V}] of a join of two inputs, as plan_cost does:
+    T(R) * T(S) / max(V(R, a), V(S, a))"""
+    new_t = float(child_r[0] * child_s[0])
+    new_v = dict(child_r[1].items() + child_s[1].items())
+
+    common_attrs = set(child_r[1]) & set(child_s[1])
+    for common_attr in common_attrs:
+        new_t /= max(child_r[1][common_attr], child_s[1][common_attr])
+
+    return [new_t, new_v]
+
+def plan_cost(stats, root):
+    """Estimated cost of a logical plan: the sum of the sizes of its
+    intermediate results, as minimized by EnumerationBasedOptimizator.
+
+    The estimated size of every node is left in its estimated_size.
     """
-    1. traverse to leafnode
-    2. climb up to find selections
-    3. if there is consecutive selections: build permutations of selections into new trees
-    """
-    def climb_up(node):
-        if getattr(node, 'traversed', None):
-            return []
-        node.traversed = True
-        enums = []
-        while node:
-            while node and not isinstance(node, algebra.Selection):
-                prev = node
-                node = node.parent
-
-            if node is None:
-                return enums
-
-            start = prev
-            selects = []
-            while isinstance(node, algebra.Selection):
-                selects.append(node)
-                node = node.parent
-
-            if len(selects) > 1:
-                select_perms = itertools.permutations(selects)
-                for perms in select_perms:
-                    new_tree = clone_tree(start)
-
-                    new_end = new_tree
-                    for _ in selects:
-                        new_end = new_end.parent
-
-                    for p in perms:
-                        new_selection = algebra.Selection(None, p.conds[:])
-                        new_tree.parent = new_selection
-                        new_tree = new_selection
-
-                    new_tree.parent = new_end.parent
-                    new_end.parent = None
-                    enums.append(find_root(new_tree))
-
-    enums = tree_traverse_first(root, tree.LeafNode, climb_up)
-    while enums:
-        next_results = []
-        for e in enums:
-            next_enums = tree_traverse_first(e, tree.LeafNode, climb_up)
-            if next_enums:
-                next_results.extend(next_enums)
-
-        if len(next_results) == 0:
-            break
-
-        enums = next_results
-
-    return enums or [root]
+    cost_list = []
+
+    def cost(node):
+        result = estimate(node)
+        node.estimated_size = result[0]
+        return result
+
+    def estimate(node):
+        if isinstance(node, algebra.Relation):
+            return copy.copy(stats[str(node.name)])
+        elif isinstance(node, algebra.Projection):
+            return cost(node.children[0])
+        elif isinstance(node, algebra.Selection):
+            result = selection_stat(stats, cost(node.children[0]), node.conds[0])
+            cost_list.append(result[0])
+            return result
+        else:
+            result = product_stat(cost(node.children[0]), cost(node.children[1]))
+            cost_list.append(result[0])
+            return result
+
+    cost(root)
+    return sum(cost_list)
+
+def frozen_plan_cost(stats, plan, memo=None):
+    """plan_cost of a FrozenNode plan. The estimate and cost of every
+    subtree is kept in memo ({FrozenNode: ([T, {attr: V}], cost)}), so
+    that plans sharing subtrees only estimate them once."""
+    if memo is None:
+        memo = {}
+
+    def estimate(node):
+        if node in memo:
+            return memo[node]
+
+        if node.is_a(algebra.Relation):
+            result = (stats[str(node.args)], 0)
+        elif node.is_a(algebra.Projection):
+            result = estimate(node.children[0])
+        elif node.is_a(algebra.Selection):
+            child, child_cost = estimate(node.children[0])
+            stat = selection_stat(stats, child, node.args[0])
+            result = (stat, child_cost + stat[0])
+        else:
+            (child_r, cost_r), (child_s, cost_s) = map(estimate, node.children)
+            stat = product_stat(child_r, child_s)
+            result = (stat, cost_r + cost_s + stat[0])
+
+        memo[node] = result
+        return result
+
+    return estimate(plan)[1]
 
 class PushSelectionDownOptimizator(BaseOptimizator):
     """
@@ -304,6 +376,8 @@ class PushSelectionDownOptimizator(BaseOptimizator):
 class CostBasedOptimizator(BaseOptimizator):
     def __init__(self, stats):
         self.stats = stats
+        # candidate plans (or join pairs) costed by the last run
+        self.plans_considered = 0
 
 class CartesianProductToThetaJoinOptimizator(CostBasedOptimizator):
     """
@@ -379,46 +453,23 @@ class GreedyJoinOrderOptimizator(CostBasedOptimizator):
     4. using T(P) * T(Q) / (max{V(P, a), V(Q, a)}) to fold
     """
     def run(self, root):
-        def estimate_stat(p):
-            if isinstance(p, algebra.Relation):
-                return copy.copy(self.stats[str(p.name)])
-            elif isinstance(p, algebra.Selection):
-                child_stat = estimate_stat(p.children[0])
-                cond = p.conds[0]
-                attr_name = cond.x.name if isinstance(cond.x, algebra.Field) else cond.y.name
-
-                var = child_stat[1][attr_name]
-                child_stat[1][attr_name] = 1
-
-                return [float(child_stat[0]) / var, child_stat[1]]
-
-            raise NotImplementedError()
+        self.plans_considered = 0
 
         def estimate_cost(p, q):
-            p_stat, q_stat = p[1], q[1]
-            new_table_size = float(p_stat[0] * q_stat[0])
-            new_value_set = dict(p_stat[1].items() + q_stat[1].items())
-
-            common_attrs = (set(p_stat[1]) & set(q_stat[1]))
-            # if not common_attrs:
-                # equal to Cartesian product
-                # return [p_stat[0] * q_stat[0], new_value_set]
-
-            for common_attr in common_attrs:
-                new_table_size /= max(p_stat[1][common_attr], q_stat[1][common_attr])
-                new_value_set[common_attr] = min(p_stat[1][common_attr], q_stat[1][common_attr])
-
-            return [new_table_size, new_value_set]
+            return join_stat(p[1], q[1])
 
         def visit_join(join):
             participants = extract_join_order(join)
-            estimations = map(estimate_stat, participants)
+            estimations = [participant_stat(self.stats, p) for p in participants]
+            for p, estimation in zip(participants, estimations):
+                p.estimated_size = estimation[0]
             participants = zip(participants, estimations)
 
             while len(participants) > 1:
                 min_pair = None
                 min_cost = None
                 for p1, p2 in itertools.combinations(participants, 2):
+                    self.plans_considered += 1
                     cost = estimate_cost(p1, p2)
                     if min_cost is None or min_cost[0] > cost[0]:
                         min_pair = (p1, p2)
@@ -428,6 +479,7 @@ class GreedyJoinOrderOptimizator(CostBasedOptimizator):
                     participants.remove(p)
 
                 new_join = algebra.NaturalJoin(None)
+                new_join.estimated_size = min_cost[0]
                 for p, _ in min_pair:
                     p.parent = new_join
 
@@ -440,57 +492,234 @@ class GreedyJoinOrderOptimizator(CostBasedOptimizator):
         tree_traverse_first(root, algebra.NaturalJoin, visit_join)
         return root
 
+def bits(mask):
+    """Indexes of the members of the bit set mask"""
+    inx = 0
+    while mask:
+        if mask & 1:
+            yield inx
+        mask >>= 1
+        inx += 1
+
+def subsets(mask):
+    """Non-empty subsets of the bit set mask, in increasing order (which
+    csg_cmp_pairs needs to come up with every set before its supersets)"""
+    sub = mask & -mask
+    while sub:
+        yield sub
+        sub = (sub - mask) & mask
+
+def csg_cmp_pairs(neighbours):
+    """Pairs (S1, S2) of disjoint connected subgraphs joined by an edge,
+    as bit sets over a join graph whose vertex i is adjacent to the bit
+    set neighbours[i] (DPccp, Moerkotte and Neumann). Every pair comes
+    once, after the pairs making up S1 and S2."""
+    def neighbourhood(s, excluded):
+        result = 0
+        for inx in bits(s):
+            result |= neighbours[inx]
+        return result & ~(s | excluded)
+
+    def connected_supersets(s, excluded):
+        n = neighbourhood(s, excluded)
+        for sub in subsets(n):
+            yield s | sub
+        for sub in subsets(n):
+            for csg in connected_supersets(s | sub, excluded | n):
+                yield csg
+
+    def complements(s1):
+        lowest = s1 & -s1
+        excluded = s1 | ((lowest << 1) - 1)
+        n = neighbourhood(s1, excluded)
+        for inx in reversed(list(bits(n))):
+            yield 1 << inx
+            for csg in connected_supersets(1 << inx, excluded | (n & ((2 << inx) - 1))):
+                yield csg
+
+    for inx in reversed(range(len(neighbours))):
+        for s1 in itertools.chain([1 << inx], connected_supersets(1 << inx, (2 << inx) - 1)):
+            for s2 in complements(s1):
+                yield s1, s2
+
+class DPccpJoinOrderOptimizator(CostBasedOptimizator):
+    """
+    1. find NaturalJoin and flatten the joins below it into participants
+    2. build the join graph: participants sharing an attribute are adjacent
+    3. DPccp: for every pair of connected subgraphs with an edge between them,
+       keep the cheapest plan per set of participants (the sum of the estimated
+       intermediate sizes, estimated as by GreedyJoinOrderOptimizator)
+    4. join the unconnected parts of the graph by size, smallest first
+    5. build the one tree of the cheapest plan
+    """
+    def run(self, root):
+        self.plans_considered = 0
+        # the new plan takes the place of a join at the root
+        roots = [root]
+
+        def flatten(node):
+            if isinstance(node, algebra.NaturalJoin):
+                return flatten(node.children[0]) + flatten(node.children[1])
+            return [node]
 
-# contributed by Ray Chien
-class EnumerationBasedOptimizator(CostBasedOptimizator):
+        def visit_join(join):
+            participants = flatten(join)
+            estimations = [participant_stat(self.stats, p) for p in participants]
+            for p, estimation in zip(participants, estimations):
+                p.estimated_size = estimation[0]
+
+            neighbours = []
+            for inx, (_, distinct) in enumerate(estimations):
+                adjacent = 0
+                for other, (_, other_distinct) in enumerate(estimations):
+                    if other != inx and set(distinct) & set(other_distinct):
+                        adjacent |= 1 << other
+                neighbours.append(adjacent)
+
+            # set of participants -> (cost, estimation, left set, right set)
+            best = {}
+            for inx, estimation in enumerate(estimations):
+                best[1 << inx] = (0, estimation, None, None)
+
+            for s1, s2 in csg_cmp_pairs(neighbours):
+                self.plans_considered += 1
+                (cost1, stat1, _, _), (cost2, stat2, _, _) = best[s1], best[s2]
+                cost = cost1 + cost2 + join_size(stat1, stat2)
+
+                s = s1 | s2
+                if s not in best or cost < best[s][0]:
+                    # the values of a join only matter for the plans kept
+                    best[s] = (cost, join_stat(stat1, stat2), s1, s2)
+
+            # the largest sets are the connected components, cross them
+            components = []
+            covered = 0
+            for s in sorted(best, key=lambda s: bin(s).count('1'), reverse=True):
+                if not s & covered:
+                    components.append(s)
+                    covered |= s
+            components.sort(key=lambda s: best[s][1][0])
+
+            s1 = components[0]
+            for s2 in components[1:]:
+                estimation = join_stat(best[s1][1], best[s2][1])
+                best[s1 | s2] = (best[s1][0] + best[s2][0] + estimation[0], estimation, s1, s2)
+                s1 |= s2
+
+            def build(s):
+                _, estimation, left, right = best[s]
+                if left is None:
+                    return participants[next(bits(s))]
+
+                new_join = algebra.NaturalJoin(None)
+                new_join.estimated_size = estimation[0]
+                build(left).parent = new_join
+                build(right).parent = new_join
+                return new_join
+
+            new_join = build(s1)
+            tree.replace(join, new_join)
+            if join is roots[0]:
+                roots[0] = new_join
+
+        tree_traverse_first(root, algebra.NaturalJoin, visit_join)
+        return roots[0]
+
+
+class ProjectionPushDownOptimizator(CostBasedOptimizator):
+    """
+    Notice: apply this after the other optimizators, they don't expect
+    projections inside the tree.
+    1. walk down from the root, collecting the fields needed above each node
+       (projected fields, fields in conditions, natural join attributes)
+    2. above every relation and every join input, insert a projection that
+       keeps only those fields (a relation under selections gets it above
+       the last of them)
+    """
     def run(self, root):
-        def cost(node, cost_list):
+        def extract_fields(node):
             if isinstance(node, algebra.Relation):
-                return copy.copy(self.stats[str(node.name)])
-            elif isinstance(node, algebra.Projection):
-                return cost(node.children[0], cost_list)
-            elif isinstance(node, algebra.Selection): # T(S) = T(R) / V(R, a)
-                child = cost(node.children[0], cost_list)
-                cond = node.conds[0]
-                attr_name = cond.x.name if isinstance(cond.x, algebra.Field) else cond.y.name
+                fnames = self.stats[str(node.name)][1].keys()
+                return [algebra.Field.from_components(x, str(node.name)) for x in fnames]
+            elif isinstance(node, algebra.Projection) and node.fields:
+                return [f for f in extract_fields(node.children[0]) if f in node.fields]
+            elif isinstance(node, tree.TreeNode):
+                return sum([extract_fields(c) for c in node.children], [])
+            else:
+                raise NotImplementedError()
+
+        def cond_fields(conds):
+            return [f for c in conds for f in (c.x, c.y) if isinstance(f, algebra.Field)]
 
-                var = child[1][attr_name]
-                new_t = float(child[0]) / var
-                cost_list.append(new_t)
-                return [new_t, child[1]]
-            else: # T(R) * T(S) / max(V(R, a), V(S, a))
-                child_r = cost(node.children[0], cost_list)
-                child_s = cost(node.children[1], cost_list)
+        def restrict(node, needed):
+            if needed is None or isinstance(node, algebra.Projection):
+                return
+            if isinstance(node.parent, algebra.Projection):
+                return
+            if isinstance(node, algebra.Relation) and isinstance(node.parent, algebra.Selection):
+                # the projection goes above the whole cascade of selections,
+                # where the index and parallel scans still see them on the
+                # relation; the executor narrows the scan itself
+                return
 
-                new_t = float(child_r[0] * child_s[0])
-                new_v = dict(child_r[1].items() + child_s[1].items())
+            available = extract_fields(node)
+            kept = [f for f in available if f in needed]
+            if len(kept) < len(available):
+                tree.insert_above(node, algebra.Projection(None, kept))
 
-                common_attrs = set(child_r[1]) & set(child_s[1])
-                for common_attr in common_attrs:
-                    new_t /= max(child_r[1][common_attr], child_s[1][common_attr])
+        def visit(node, needed):
+            if isinstance(node, algebra.Relation):
+                restrict(node, needed)
+            elif isinstance(node, algebra.Projection):
+                visit(node.children[0], node.fields[:] or needed)
+            elif isinstance(node, algebra.Selection):
+                child_needed = None if needed is None else needed + cond_fields(node.conds)
+                visit(node.children[0], child_needed)
+            else:
+                extra = []
+                if isinstance(node, algebra.ThetaJoin):
+                    extra = cond_fields(node.conds)
+                elif isinstance(node, algebra.NaturalJoin):
+                    fs_left, fs_right = map(extract_fields, node.children)
+                    common = set(f.name for f in fs_left) & set(f.name for f in fs_right)
+                    extra = [f for f in fs_left + fs_right if f.name in common]
+
+                child_needed = None if needed is None else needed + extra
+                for c in node.children[:]:
+                    restrict(c, child_needed)
+                    visit(c, child_needed)
+
+        visit(root, None)
+        return root
 
-                cost_list.append(new_t)
-                return [new_t, new_v]
+# contributed by Ray Chien
+class EnumerationBasedOptimizator(CostBasedOptimizator):
+    def run(self, root):
+        self.plans_considered = 0
+        # the candidates share most of their subtrees, estimated once
+        memo = {}
 
-        def find_optimized_tree(root, enumerator):
-            optimized_tree = None
+        def find_optimized_plan(plan, enumerator):
+            optimized_plan = None
             smallest_cost = float('inf')
 
-            possible_trees = enumerator(root)
-            for tree in possible_trees:
-                cost_list = []
-                cost(tree, cost_list)
-                total_cost = sum(cost_list)
+            for candidate in enumerator(plan):
+                self.plans_considered += 1
+                total_cost = frozen_plan_cost(self.stats, candidate, memo)
 
                 if total_cost < smallest_cost:
                     smallest_cost = total_cost
-                    optimized_tree = tree
+                    optimized_plan = candidate
+
+            return optimized_plan
 
-            return optimized_tree
+        best_selection_plan = find_optimized_plan(freeze(root), selection_orders)
+        best_join_order_plan = find_optimized_plan(best_selection_plan, join_orders)
 
-        best_selection_tree = find_optimized_tree(root, enumerate_selections)
-        best_join_order_tree = find_optimized_tree(best_selection_tree, enumerate_join_orders)
-        return best_join_order_tree
+        optimized = thaw(best_join_order_plan)
+        # leave the estimates in the nodes of the plan chosen
+        plan_cost(self.stats, optimized)
+        return optimized
 
 # contributed by Jianqing Zhang and Jian Yuan
 class GreedyOptimizator(CostBasedOptimizator):
@@ -505,6 +734,7 @@ class GreedyOptimizator(CostBasedOptimizator):
         self.cascadeSele = False
 
         self.subTrees = {}
+        self.plans_considered = 0
 
         def Traverse(node):
             # if node type is 'Projection', then record the fields to perform Projection
@@ -535,12 +765,14 @@ class GreedyOptimizator(CostBasedOptimizator):
                 else:
                     self.cascadeSele = True   # used to decide whether to determine Selection Order
                 T = self.stats[rName][0]  # number of tuples in Relation "rName"
-                newT = T / self.stats[rName][1][attrName]
+                # share of the tuples kept, following the distribution of the values
+                sel = selectivity(self.stats, rName, cond)
+                newT = max(T * sel, 1)
                 assert(newT >= 1)
                 # temperary dictionary to store post selection statistics
                 tmp = {}
                 for eachAttr in self.stats[rName][1].keys():
-                    if eachAttr == attrName:
+                    if eachAttr == attrName and cond.comp == '=':
                         newVar = 1
                         tmp[eachAttr] = newVar
                     else:
@@ -559,11 +791,11 @@ class GreedyOptimizator(CostBasedOptimizator):
                     self.statforJ[rName].append(tmp)
                 else:
                     newStat = []
-                    newT = self.statforJ[rName][0] / self.statforJ[rName][1][attrName]  # cascade Selection
+                    newT = max(self.statforJ[rName][0] * sel, 1)  # cascade Selection
                     assert(newT >= 1)
                     tmp = {}
                     for eachAttr in self.statforJ[rName][1].keys():
-                        if eachAttr == attrName:
+                        if eachAttr == attrName and cond.comp == '=':
                             newVar = 1
                             tmp[eachAttr] = newVar
                         else:
@@ -595,6 +827,7 @@ class GreedyOptimizator(CostBasedOptimizator):
             newNode = None
             # if only two relations to be join, then no need to decide the join order
             if len(self.relationTobeJoin) == 2:
+                self.plans_considered += 1
                 # add the last relation into the joinOrder list
                 newNode = algebra.NaturalJoin(newNode)
                 newRName = self.relationTobeJoin[0] + ' ' + self.relationTobeJoin[1]
@@ -670,6 +903,7 @@ class GreedyOptimizator(CostBasedOptimizator):
                             tmp2.append(another)
                             tmp2.append(cost)
                             tmp1.append(tmp2)
+            self.plans_considered += len(tmp1)
             # sort the list tmp1 based on the cost
             # the first pair has the least cost
             tmp1 = sorted(tmp1, key=lambda item: item[2])
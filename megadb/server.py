@@ -0,0 +1,180 @@
+"""Headless query server.
+
+The schema and its statistics are loaded once and shared by every
+request; each request gets its own optimizators, executor and plan, so
+clients are served concurrently, one thread per connection. Queries go
+through a workload Scheduler, which limits how many run at once.
+
+The protocol is line based JSON. A client sends one request per line
+
+    {"sql": "SELECT ...", "optimizations": ["PushSelectionDownOptimizator"],
+     "backend": "row", "analyze": true}
+
+("optimizations", "backend" and "analyze" are optional) and gets one line
+back,
+
+    {"fields": ["Alpha.a1", ...], "rows": [[1, ...], ...], "time": 0.01}
+
+or {"error": "..."} when the query could not be run. With "analyze" the
+response also has the "profile" of every operator of the plan (see
+megadb.execution.profile).
+
+    $ python -m megadb.server [--host HOST] [--port PORT] [--unix PATH]
+"""
+import sys
+import json
+import socket
+import timeit
+import argparse
+import traceback
+import SocketServer
+
+import megadb.optimization.optimizator as optimizator
+from megadb.algebra.parser import parse_sql
+from megadb.execution.executor import Schema, Executor
+from megadb.execution.workload import Scheduler, QueryContext
+from megadb.execution.profile import profile_plan
+
+DEFAULT_OPTIMIZATIONS = [
+    'PushSelectionDownOptimizator',
+    'CartesianProductToThetaJoinOptimizator',
+    'ProjectionPushDownOptimizator'
+]
+
+def instantiate_optimizator(schema, opt_name):
+    cls = getattr(optimizator, opt_name, None)
+    if not isinstance(cls, type) or not issubclass(cls, optimizator.BaseOptimizator):
+        raise ValueError("Unknown optimization %s" % opt_name)
+
+    if issubclass(cls, optimizator.CostBasedOptimizator):
+        return cls(schema.stats)
+    else:
+        return cls()
+
+def run_query(schema, sql, optimizations=None, backend='row', scheduler=None, analyze=False):
+    """Parse, optimize, translate and execute sql, through scheduler if
+    given.
+
+    Returns (field names, rows, seconds taken, profile), the profile of
+    the plan being None unless analyze is set.
+    """
+    if optimizations is None:
+        optimizations = DEFAULT_OPTIMIZATIONS
+
+    start_at = timeit.default_timer()
+
+    tree = parse_sql(sql)
+    for opt_name in optimizations:
+        tree = instantiate_optimizator(schema, opt_name).run(tree)
+
+    if scheduler is not None:
+        context = QueryContext(scheduler.memory_limit)
+        fields, tuples = scheduler.execute(tree, backend, context)
+        translated = context.plan
+    else:
+        translated = Executor(schema, backend).translate_tree(tree)
+        with translated:
+            fields, tuples = [f for f, _ in translated.schema], translated.run()
+
+    seconds = timeit.default_timer() - start_at
+    profile = profile_plan(translated) if analyze else None
+
+    rows = [list(t) for t in tuples]
+    return [str(f) for f in fields], rows, seconds, profile
+
+class QueryHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads(line)
+                fields, rows, seconds, profile = run_query(self.server.schema, request['sql'],
+                                                           request.get('optimizations'),
+                                                           request.get('backend', 'row'),
+                                                           self.server.scheduler,
+                                                           request.get('analyze', False))
+                response = {'fields': fields, 'rows': rows, 'time': seconds}
+                if profile is not None:
+                    response['profile'] = profile
+            except Exception as e:
+                traceback.print_exc()
+                response = {'error': '%s: %s' % (type(e).__name__, e)}
+
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+class QueryServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, schema):
+        SocketServer.TCPServer.__init__(self, address, QueryHandler)
+        self.schema = schema
+        self.scheduler = Scheduler(schema)
+
+class UnixQueryServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, schema):
+        SocketServer.UnixStreamServer.__init__(self, path, QueryHandler)
+        self.schema = schema
+        self.scheduler = Scheduler(schema)
+
+class QueryClient(object):
+    """Connection to a query server at address, a (host, port) pair or
+    the path of a Unix socket."""
+    def __init__(self, address):
+        if isinstance(address, tuple):
+            self.socket = socket.create_connection(address)
+        else:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+        self.file = self.socket.makefile('rb')
+
+    def execute(self, sql, optimizations=None, backend='row', analyze=False):
+        request = {'sql': sql, 'backend': backend}
+        if optimizations is not None:
+            request['optimizations'] = optimizations
+        if analyze:
+            request['analyze'] = True
+
+        self.socket.sendall(json.dumps(request) + '\n')
+        return json.loads(self.file.readline())
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+def load_schema():
+    schema = Schema()
+    schema.load()
+    schema.load_statistics()
+    return schema
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve queries over a socket.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5433)
+    parser.add_argument('--unix', help='listen on this Unix socket instead')
+    args = parser.parse_args()
+
+    schema = load_schema()
+    if args.unix:
+        server = UnixQueryServer(args.unix, schema)
+        print "Serving on %s" % args.unix
+    else:
+        server = QueryServer((args.host, args.port), schema)
+        print "Serving on %s:%d" % (args.host, args.port)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -1,3 +1,53 @@
 import os
 
-RELATIONS_PATH = 'relations'
\ No newline at end of file
+RELATIONS_PATH = 'relations'
+
+# Number of tuples an operator hands to its parent per next() call
+BATCH_SIZE = 1024
+
+# Number of tuples a join or sort may keep in memory before it switches
+# to an algorithm that spills to temporary files
+WORK_MEMORY = 100000
+
+# Number of worker processes a parallel table scan parses the relation
+# file with; 1 disables parallel scans
+SCAN_PARALLELISM = 1
+
+# Relation files smaller than this many bytes are always scanned serially
+PARALLEL_SCAN_MIN_SIZE = 4 * 1024 * 1024
+
+# Number of worker processes a query runs in (see plan.Gather); 1 runs
+# queries in the calling process
+QUERY_PARALLELISM = 1
+
+# Number of queries a workload Scheduler runs at once
+MAX_CONCURRENT_QUERIES = 4
+
+# Estimated bytes the queries a Scheduler runs at once may keep in memory
+QUERY_MEMORY_BUDGET = 512 * 1024 * 1024
+
+# Bytes of materialized tuples one query may hold before it is cancelled
+QUERY_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# Number of rows per column batch in the NumPy columnar engine
+COLUMNAR_BATCH_SIZE = 65536
+
+# Estimated bytes of parsed tuples the relation cache of a Schema may hold
+RELATION_CACHE_SIZE = 64 * 1024 * 1024
+
+# How Schema statistics are computed: 'exact' keeps every distinct value
+# of every column in memory, 'approximate' makes one pass with bounded
+# memory (HyperLogLog distinct counts and a reservoir sample of rows)
+STATISTICS_MODE = 'exact'
+
+# Rows the reservoir sample of a relation keeps in 'approximate' mode
+STATISTICS_SAMPLE_SIZE = 10000
+
+# log2 of the number of HyperLogLog registers per column (about
+# 1.04 / sqrt(2 ** precision) relative error)
+HLL_PRECISION = 12
+
+# Most common values kept per column, and buckets of the equi-depth
+# histogram of the other values, for selectivity estimates
+MCV_SIZE = 10
+HISTOGRAM_BUCKETS = 20
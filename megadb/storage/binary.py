@@ -0,0 +1,167 @@
+"""Binary columnar storage for relations.
+
+A relation file R gets a binary twin R.col holding the same tuples column
+by column:
+
+    header      magic, row count, column count, (mtime, size) of R
+    directory   (type code, offset) of every column
+    INT column  row count little-endian int64 values
+    STR column  row count + 1 int64 offsets into the bytes that follow
+
+Readers memory-map the file and only decode the rows and columns they are
+asked for, so a scan touches just the pages it needs. A binary file whose
+recorded fingerprint doesn't match R any more is stale and ignored.
+
+    $ python -m megadb.storage.binary [relation ...]
+
+converts the given relations (all relations of the schema by default).
+"""
+import os
+import sys
+import mmap
+import struct
+
+from megadb.storage.cache import file_fingerprint, replace_file
+
+MAGIC = 'MEGACOL1'
+HEADER = struct.Struct('<8sQIIdQ')
+COLUMN = struct.Struct('<B7xQ')
+
+TYPE_CODES = {int: 0, str: 1}
+
+def binary_path(path):
+    return path + '.col'
+
+def int64_bytes(values):
+    return struct.pack('<%dq' % len(values), *values)
+
+def write_relation(path, fields, tuples, fingerprint):
+    """Write tuples of a relation with fields ([name, type]) to path."""
+    columns = zip(*tuples) if tuples else [()] * len(fields)
+    row_count = len(tuples)
+
+    offset = HEADER.size + COLUMN.size * len(fields)
+    directory = []
+    chunks = []
+
+    for (_, field_type), values in zip(fields, columns):
+        directory.append(COLUMN.pack(TYPE_CODES[field_type], offset))
+
+        if field_type is int:
+            data = int64_bytes(values)
+        else:
+            offsets = [0]
+            for v in values:
+                offsets.append(offsets[-1] + len(v))
+            data = int64_bytes(offsets) + ''.join(values)
+
+        # keep every column 8-byte aligned
+        data += '\0' * (-len(data) % 8)
+        chunks.append(data)
+        offset += len(data)
+
+    mtime, size = fingerprint
+
+    def write(f):
+        f.write(HEADER.pack(MAGIC, row_count, len(fields), 0, mtime, size))
+        f.write(''.join(directory))
+        for data in chunks:
+            f.write(data)
+
+    # a half written file could already have a header matching the relation
+    replace_file(path, write)
+
+def convert_relation(path, fields):
+    """Convert the text relation at path into its binary twin."""
+    types = [field_type for (_, field_type) in fields]
+    fingerprint = file_fingerprint(path)
+
+    with open(path, 'r') as relation_file:
+        tuples = [tuple([f(v) for f, v in zip(types, line.rstrip().split('#'))])
+                  for line in relation_file]
+
+    write_relation(binary_path(path), fields, tuples, fingerprint)
+
+class ColumnarFile(object):
+    """Memory-mapped reader of a binary relation file."""
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.row_count, column_count, _, mtime, size = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            self.close()
+            raise IOError("%s is not a binary relation file" % path)
+
+        self.source_fingerprint = (mtime, size)
+        self.columns = [COLUMN.unpack_from(self.buffer, HEADER.size + COLUMN.size * inx)
+                        for inx in range(column_count)]
+
+    def is_fresh(self, source_path):
+        return file_fingerprint(source_path) == self.source_fingerprint
+
+    def read_int64(self, offset, count):
+        return list(struct.unpack_from('<%dq' % count, self.buffer, offset))
+
+    def read_column(self, inx, start, stop):
+        """Values of column inx for rows [start, stop)."""
+        type_code, offset = self.columns[inx]
+        count = stop - start
+
+        if type_code == TYPE_CODES[int]:
+            return self.read_int64(offset + 8 * start, count)
+        else:
+            offsets = self.read_int64(offset + 8 * start, count + 1)
+            base = offset + 8 * (self.row_count + 1)
+            data = self.buffer[base + offsets[0]:base + offsets[-1]]
+
+            first = offsets[0]
+            return [data[offsets[i] - first:offsets[i + 1] - first] for i in range(count)]
+
+    def batches(self, columns, batch_size, first=0, last=None):
+        """Yield lists of tuples made of the given column positions, for
+        rows [first, last) (every row by default)."""
+        last = self.row_count if last is None else last
+        for start in xrange(first, last, batch_size):
+            stop = min(start + batch_size, last)
+            values = [self.read_column(inx, start, stop) for inx in columns]
+            if values:
+                yield zip(*values)
+            else:
+                yield [()] * (stop - start)
+
+    def close(self):
+        self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+def open_fresh(path):
+    """ColumnarFile of the text relation at path, or None if there is no
+    binary twin or it is older than the text file."""
+    if not os.path.exists(binary_path(path)):
+        return None
+
+    store = ColumnarFile(binary_path(path))
+    if not store.is_fresh(path):
+        store.close()
+        return None
+
+    return store
+
+if __name__ == '__main__':
+    import megadb.settings as settings
+    from megadb.execution.executor import Schema
+
+    schema = Schema()
+    schema.load()
+
+    for rname in sys.argv[1:] or sorted(schema.relations):
+        path = os.path.join(settings.RELATIONS_PATH, rname)
+        convert_relation(path, schema.relations[rname])
+        print "Converted %s" % rname
@@ -0,0 +1,135 @@
+"""Ordered (B+tree) indexes on relation columns.
+
+Keys of the indexed attribute are kept sorted in leaves of at most order
+keys, each key with the byte offsets of the rows holding it (see
+megadb.storage.index). Leaves are chained so range scans and sorted
+iteration walk them in key order. Only the leaves are written to disk;
+the internal nodes are bulk built above them whenever an index is built
+or loaded.
+"""
+import bisect
+import cPickle as pickle
+
+from megadb.storage.cache import file_fingerprint
+from megadb.storage.index import read_offsets
+
+ORDER = 64
+
+class Leaf(object):
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.values = values
+        self.next = None
+
+class Internal(object):
+    """keys[i] is the smallest key below children[i + 1]"""
+    def __init__(self, keys, children):
+        self.keys = keys
+        self.children = children
+
+def smallest_key(node):
+    while isinstance(node, Internal):
+        node = node.children[0]
+    return node.keys[0]
+
+def build_levels(leaves, order):
+    """Chain leaves and build internal nodes above them, returning the root"""
+    if not leaves:
+        return Leaf([], [])
+
+    for leaf, next_leaf in zip(leaves, leaves[1:]):
+        leaf.next = next_leaf
+
+    level = leaves
+    while len(level) > 1:
+        level = [Internal([smallest_key(c) for c in level[start + 1:start + order]],
+                          level[start:start + order])
+                 for start in range(0, len(level), order)]
+
+    return level[0]
+
+class BTreeIndex(object):
+    """B+tree mapping values of an attribute to byte offsets of rows"""
+    extension = 'btree'
+    ordered = True
+
+    def __init__(self, attr, fingerprint, leaves, order=ORDER):
+        self.attr = attr
+        self.fingerprint = fingerprint
+        self.leaves = leaves
+        self.order = order
+        self.root = build_levels(leaves, order)
+
+    @classmethod
+    def build(cls, path, fields, attr, order=ORDER):
+        """Bulk build the index of attr for the text relation at path"""
+        fingerprint = file_fingerprint(path)
+        entries = read_offsets(path, fields, attr)
+
+        keys = sorted(entries)
+        leaves = [Leaf(keys[start:start + order], [entries[k] for k in keys[start:start + order]])
+                  for start in range(0, len(keys), order)]
+
+        return cls(attr, fingerprint, leaves, order)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            attr, fingerprint, order, leaves = pickle.load(f)
+        return cls(attr, fingerprint, [Leaf(keys, values) for keys, values in leaves], order)
+
+    def save(self, path):
+        leaves = [(leaf.keys, leaf.values) for leaf in self.leaves]
+        with open(path, 'wb') as f:
+            pickle.dump((self.attr, self.fingerprint, self.order, leaves), f,
+                        pickle.HIGHEST_PROTOCOL)
+
+    def is_fresh(self, source_path):
+        return file_fingerprint(source_path) == self.fingerprint
+
+    @property
+    def height(self):
+        height, node = 1, self.root
+        while isinstance(node, Internal):
+            height, node = height + 1, node.children[0]
+        return height
+
+    def find_leaf(self, key):
+        node = self.root
+        while isinstance(node, Internal):
+            node = node.children[bisect.bisect_right(node.keys, key)]
+        return node
+
+    def lookup(self, value):
+        """Byte offsets of the rows whose attribute equals value, in file order"""
+        leaf = self.find_leaf(value)
+        inx = bisect.bisect_left(leaf.keys, value)
+        if inx < len(leaf.keys) and leaf.keys[inx] == value:
+            return leaf.values[inx]
+        return []
+
+    def range(self, low=None, high=None, include_low=True, include_high=True):
+        """Yield (key, offsets) for keys between low and high in key order.
+
+        A bound of None leaves that end of the range open.
+        """
+        if low is None:
+            leaf, inx = (self.leaves[0] if self.leaves else None), 0
+        else:
+            leaf = self.find_leaf(low)
+            search = bisect.bisect_left if include_low else bisect.bisect_right
+            inx = search(leaf.keys, low)
+
+        while leaf is not None:
+            for key, values in zip(leaf.keys[inx:], leaf.values[inx:]):
+                if high is not None and (key > high or (key == high and not include_high)):
+                    return
+                yield key, values
+
+            leaf, inx = leaf.next, 0
+
+    def __iter__(self):
+        return self.range()
+
+    def __len__(self):
+        return sum(len(leaf.keys) for leaf in self.leaves)
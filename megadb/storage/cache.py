@@ -0,0 +1,149 @@
+import os
+import sys
+import tempfile
+import collections
+import threading
+
+def file_fingerprint(path):
+    """(mtime, size) of a file, used to notice that it has changed."""
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size)
+
+def replace_file(path, write):
+    """Replace the file at path with what write(f) writes to a binary file.
+
+    The file is written aside and renamed into place, so readers never see
+    it half written, and gets the mode the umask gives to new files.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+
+        # mkstemp creates the file readable by its owner only
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def estimate_size(tuples, sample_size=100):
+    """Estimate the bytes taken by a list of tuples from a sample of them."""
+    if not tuples:
+        return sys.getsizeof(tuples)
+
+    step = max(1, len(tuples) // sample_size)
+    sample = tuples[::step]
+    sample_bytes = sum(sys.getsizeof(t) + sum(sys.getsizeof(v) for v in t) for t in sample)
+
+    return sys.getsizeof(tuples) + sample_bytes * len(tuples) // len(sample)
+
+class RelationCache(object):
+    """LRU cache of parsed relations shared by every query of a Schema.
+
+    Entries are keyed by relation name and remember the fingerprint of the
+    file they were parsed from, so a relation whose file changed is parsed
+    again. budget is the estimated number of bytes all cached tuples may
+    take; least recently used relations are evicted to stay under it.
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+
+        # name -> (fingerprint, tuples, size)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, name, fingerprint):
+        """Cached tuples of relation name when they were parsed from a file
+        with fingerprint, None otherwise"""
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry is not None:
+                if entry[0] == fingerprint:
+                    # re-insert to mark it as the most recently used
+                    self._entries[name] = entry
+                    self.hits += 1
+                    return entry[1]
+
+                self.used -= entry[2]
+            self.misses += 1
+
+        return None
+
+    def put(self, name, fingerprint, tuples, size):
+        if size > self.budget:
+            return
+
+        with self._lock:
+            old_entry = self._entries.pop(name, None)
+            if old_entry is not None:
+                self.used -= old_entry[2]
+
+            self._entries[name] = (fingerprint, tuples, size)
+            self.used += size
+            self.evict()
+
+    def get(self, name, path, load):
+        """Tuples of relation name, calling load() to parse path on a miss."""
+        fingerprint = file_fingerprint(path)
+
+        tuples = self.lookup(name, fingerprint)
+        if tuples is None:
+            tuples = list(load())
+            self.put(name, fingerprint, tuples, estimate_size(tuples))
+
+        return tuples
+
+    def batches(self, name, path, load_batches, batch_size):
+        """Batches of the tuples of relation name. On a miss they are
+        yielded as load_batches() parses path, and buffered to be cached
+        until their estimated size passes the budget."""
+        fingerprint = file_fingerprint(path)
+
+        tuples = self.lookup(name, fingerprint)
+        if tuples is not None:
+            for start in xrange(0, len(tuples), batch_size):
+                yield tuples[start:start + batch_size]
+            return
+
+        buffered = []
+        size = 0
+        for batch in load_batches():
+            if buffered is not None:
+                size += estimate_size(batch)
+                if size > self.budget:
+                    # too large to be cached, don't hold on to it
+                    buffered = None
+                else:
+                    buffered.extend(batch)
+            yield batch
+
+        if buffered is not None:
+            self.put(name, fingerprint, buffered, estimate_size(buffered))
+
+    def evict(self):
+        while self.used > self.budget and self._entries:
+            _, (_, _, size) = self._entries.popitem(last=False)
+            self.used -= size
+
+    def invalidate(self, name=None):
+        """Drop relation name, or every relation when name is None."""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+                self.used = 0
+            else:
+                entry = self._entries.pop(name, None)
+                if entry is not None:
+                    self.used -= entry[2]
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __len__(self):
+        return len(self._entries)
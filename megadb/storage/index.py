@@ -0,0 +1,108 @@
+"""Persistent indexes on relation columns.
+
+An index on attribute a of relation file R maps values of a to the byte
+offsets of the lines holding them, so a lookup seeks straight to the
+matching rows instead of scanning R. Hash indexes live in R.a.idx; ordered
+ones (megadb.storage.btree) in R.a.btree. Like binary twins, an index
+records the (mtime, size) of R and one that doesn't match any more is
+rebuilt before it is used.
+
+    $ python -m megadb.storage.index [--btree] relation attribute [attribute ...]
+
+builds indexes on the given attributes of a relation.
+"""
+import os
+import sys
+import collections
+import cPickle as pickle
+
+from megadb.storage.cache import file_fingerprint
+
+def index_path(path, attr, extension='idx'):
+    return '%s.%s.%s' % (path, attr, extension)
+
+def read_offsets(path, fields, attr):
+    """{value: [byte offset]} of attr over the lines of the relation at path"""
+    inx = [fname for (fname, _) in fields].index(attr)
+    field_type = fields[inx][1]
+
+    entries = collections.defaultdict(list)
+    with open(path, 'rb') as relation_file:
+        offset = 0
+        for line in iter(relation_file.readline, ''):
+            entries[field_type(line.rstrip().split('#')[inx])].append(offset)
+            offset += len(line)
+
+    return dict(entries)
+
+class HashIndex(object):
+    """Maps values of an attribute to byte offsets of rows in a relation file"""
+    extension = 'idx'
+    ordered = False
+
+    def __init__(self, attr, fingerprint, entries):
+        self.attr = attr
+        self.fingerprint = fingerprint
+        self.entries = entries
+
+    @classmethod
+    def build(cls, path, fields, attr):
+        """Index attr of the text relation at path with fields ([name, type])"""
+        fingerprint = file_fingerprint(path)
+        return cls(attr, fingerprint, read_offsets(path, fields, attr))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            attr, fingerprint, entries = pickle.load(f)
+        return cls(attr, fingerprint, entries)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump((self.attr, self.fingerprint, self.entries), f, pickle.HIGHEST_PROTOCOL)
+
+    def is_fresh(self, source_path):
+        return file_fingerprint(source_path) == self.fingerprint
+
+    def lookup(self, value):
+        """Byte offsets of the rows whose attribute equals value, in file order"""
+        return self.entries.get(value, [])
+
+    def __len__(self):
+        return len(self.entries)
+
+def create_index(path, fields, attr, index_type=HashIndex):
+    """Build the index of attr for the relation at path and write it out."""
+    index = index_type.build(path, fields, attr)
+    index.save(index_path(path, attr, index_type.extension))
+    return index
+
+def open_index(path, fields, attr, index_type=HashIndex):
+    """Index of attr for the relation at path, rebuilt if the relation has
+    changed since it was written, or None if there is no such index."""
+    if not os.path.exists(index_path(path, attr, index_type.extension)):
+        return None
+
+    index = index_type.load(index_path(path, attr, index_type.extension))
+    if not index.is_fresh(path):
+        index = create_index(path, fields, attr, index_type)
+
+    return index
+
+if __name__ == '__main__':
+    from megadb.storage.btree import BTreeIndex
+    from megadb.execution.executor import Schema
+
+    schema = Schema()
+    schema.load()
+
+    args = sys.argv[1:]
+    index_type = HashIndex
+    if args[0] == '--btree':
+        index_type = BTreeIndex
+        args = args[1:]
+
+    rname = args[0]
+    for attr in args[1:]:
+        schema.create_index(rname, attr, index_type)
+        print "Indexed %s.%s" % (rname, attr)
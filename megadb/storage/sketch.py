@@ -0,0 +1,88 @@
+"""Fixed size summaries of a stream of values.
+
+HyperLogLog estimates the number of distinct values with 2 ** precision
+one-byte registers, whatever the number of values. ReservoirSample keeps
+a uniform random sample of a given size.
+"""
+import math
+import random
+
+MASK64 = (1 << 64) - 1
+GOLDEN_GAMMA = 0x9e3779b97f4a7c15
+
+def mix64(x):
+    """Scramble the bits of a 64 bit integer (SplitMix64), as hash() of
+    small integers is the integer itself"""
+    x = (x + GOLDEN_GAMMA) & MASK64
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9 & MASK64
+    x = (x ^ (x >> 27)) * 0x94d049bb133111eb & MASK64
+    return x ^ (x >> 31)
+
+class HyperLogLog(object):
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 18:
+            raise ValueError("HyperLogLog precision must be between 4 and 18")
+
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+        if self.m >= 128:
+            self.alpha = 0.7213 / (1 + 1.079 / self.m)
+        else:
+            self.alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.m]
+
+    def add(self, value):
+        x = mix64(hash(value) & MASK64)
+        inx = x >> (64 - self.precision)
+        rest_bits = 64 - self.precision
+        rest = x & ((1 << rest_bits) - 1)
+        # position of the leftmost 1 bit of the rest
+        rank = rest_bits - rest.bit_length() + 1
+        if rank > self.registers[inx]:
+            self.registers[inx] = rank
+
+    def update(self, other):
+        """Merge the values counted by another HyperLogLog of the same
+        precision into this one"""
+        if other.precision != self.precision:
+            raise ValueError("Can't merge HyperLogLogs of different precisions")
+        for inx, rank in enumerate(other.registers):
+            if rank > self.registers[inx]:
+                self.registers[inx] = rank
+
+    def estimate(self):
+        estimate = self.alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+
+        zeros = self.registers.count('\x00')
+        if estimate <= 2.5 * self.m and zeros:
+            # few values: linear counting is more accurate
+            estimate = self.m * math.log(float(self.m) / zeros)
+
+        return estimate
+
+    def __len__(self):
+        return int(round(self.estimate()))
+
+class ReservoirSample(object):
+    """Uniform sample of at most size of the items added (algorithm R)"""
+    def __init__(self, size, seed=0):
+        self.size = size
+        self.items = []
+        self.count = 0
+        self.random = random.Random(seed)
+
+    def add(self, item):
+        self.count += 1
+        if len(self.items) < self.size:
+            self.items.append(item)
+        else:
+            inx = self.random.randrange(self.count)
+            if inx < self.size:
+                self.items[inx] = item
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
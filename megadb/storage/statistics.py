@@ -0,0 +1,322 @@
+"""Persistent catalog of relation statistics.
+
+Computing the statistics of a relation takes a pass over all its values,
+so they are kept in a catalog file next to the relations
+(Schema.stats) instead of being recomputed on every start. Like indexes,
+every entry records the (mtime, size) of the relation file, and the
+fields it was computed for; an entry that doesn't match any more is
+stale and the relation is analyzed again.
+
+An entry holds the number of tuples of the relation and, for every
+column, its number of distinct values, smallest and largest value, most
+common values and an equi-depth histogram of the others. selectivity()
+estimates the share of tuples a condition keeps from them.
+
+Statistics are computed in one of two modes. 'exact' counts the
+occurrences of every value of every column, which takes as much memory
+as the distinct values themselves. 'approximate' streams over the
+relation once with bounded memory: distinct values are estimated by a
+HyperLogLog per column, the entry also holds a reservoir sample of the
+rows and the most common values and histograms are those of the sample.
+
+    $ python -m megadb.storage.statistics [relation ...]
+
+analyzes the given relations (all of them by default) and updates the
+catalog.
+"""
+import os
+import sys
+import bisect
+import collections
+import cPickle as pickle
+
+from megadb.algebra.plan import Field
+from megadb.storage.cache import file_fingerprint, replace_file
+from megadb.storage.sketch import HyperLogLog, ReservoirSample
+
+CATALOG_NAME = 'Schema.stats'
+
+def catalog_path(directory):
+    return os.path.join(directory, CATALOG_NAME)
+
+def field_signature(fields):
+    """[(name, type name)] of fields, comparable after a reload"""
+    return [(fname, ftype.__name__) for (fname, ftype) in fields]
+
+MODES = ('exact', 'approximate')
+
+# bumped when entries change shape, older ones are then stale
+VERSION = 2
+
+def compute_statistics(fields, tuples, mode='exact', sample_size=10000, precision=12,
+                       mcv_size=10, buckets=20):
+    """{'total': number of tuples, 'mode': mode, 'columns': {attr:
+    {'distinct', 'min', 'max', 'mcv', 'histogram'}}} of tuples with fields
+    ([name, type]). See column_distribution for 'mcv' and 'histogram'.
+
+    In 'approximate' mode distinct counts are HyperLogLog estimates (with
+    2 ** precision registers), 'sample' holds up to sample_size of the
+    tuples and the distributions are those of the sample.
+    """
+    if mode == 'exact':
+        stats = exact_statistics(fields, tuples, mcv_size, buckets)
+    elif mode == 'approximate':
+        stats = approximate_statistics(fields, tuples, sample_size, precision, mcv_size, buckets)
+    else:
+        raise ValueError("Unknown statistics mode %s" % mode)
+
+    stats['version'] = VERSION
+    return stats
+
+def column_distribution(counts, mcv_size, buckets):
+    """(mcv, histogram) of a column whose value v occurs counts[v] times.
+
+    mcv lists the (value, frequency) of up to mcv_size most common values,
+    those more common than the average value (all of them when there are
+    no more than mcv_size). histogram holds the bounds of up to buckets
+    equi-depth buckets of the other values: each bucket, from one bound to
+    the next, holds about as many of them.
+    """
+    total = sum(counts.itervalues())
+    if not total:
+        return [], []
+
+    if len(counts) <= mcv_size:
+        common = counts.items()
+    else:
+        common = sorted(counts.items(), key=lambda (v, c): c, reverse=True)[:mcv_size]
+        common = [(v, c) for v, c in common if c * len(counts) > total]
+    mcv = sorted([(v, float(c) / total) for v, c in common], key=lambda (v, f): f, reverse=True)
+
+    common_values = set(v for v, _ in common)
+    rest = sorted((v, c) for v, c in counts.iteritems() if v not in common_values)
+    rest_total = sum(c for _, c in rest)
+    if not rest:
+        return mcv, []
+
+    # n values make n - 1 buckets between them
+    buckets = min(buckets, max(len(rest) - 1, 1))
+    # positions of the bounds among the sorted values, duplicates included
+    positions = [(rest_total - 1) * k // buckets for k in range(buckets + 1)]
+
+    histogram = []
+    seen = 0
+    it = iter(rest)
+    value, count = next(it)
+    for position in positions:
+        while seen + count <= position:
+            seen += count
+            value, count = next(it)
+        histogram.append(value)
+
+    return mcv, histogram
+
+def exact_statistics(fields, tuples, mcv_size, buckets):
+    total = 0
+    values = [collections.defaultdict(int) for _ in fields]
+
+    for t in tuples:
+        total += 1
+        for value, counts in zip(t, values):
+            counts[value] += 1
+
+    columns = {}
+    for (fname, _), counts in zip(fields, values):
+        mcv, histogram = column_distribution(counts, mcv_size, buckets)
+        columns[fname] = {
+            'distinct': len(counts),
+            'min': min(counts) if counts else None,
+            'max': max(counts) if counts else None,
+            'mcv': mcv,
+            'histogram': histogram
+        }
+
+    return {'total': total, 'mode': 'exact', 'columns': columns}
+
+def approximate_statistics(fields, tuples, sample_size, precision, mcv_size, buckets):
+    total = 0
+    sketches = [HyperLogLog(precision) for _ in fields]
+    lows = [None] * len(fields)
+    highs = [None] * len(fields)
+    sample = ReservoirSample(sample_size)
+
+    for t in tuples:
+        total += 1
+        sample.add(t)
+        for inx, value in enumerate(t):
+            sketches[inx].add(value)
+            if lows[inx] is None or value < lows[inx]:
+                lows[inx] = value
+            if highs[inx] is None or value > highs[inx]:
+                highs[inx] = value
+
+    columns = {}
+    for inx, (fname, _) in enumerate(fields):
+        counts = collections.defaultdict(int)
+        for t in sample:
+            counts[t[inx]] += 1
+        mcv, histogram = column_distribution(counts, mcv_size, buckets)
+
+        columns[fname] = {
+            # an estimate can't be over the number of tuples, nor 0 for a non-empty column
+            'distinct': min(max(len(sketches[inx]), 1), total),
+            'min': lows[inx],
+            'max': highs[inx],
+            'mcv': mcv,
+            'histogram': histogram
+        }
+
+    return {'total': total, 'mode': 'approximate', 'columns': columns, 'sample': sample.items}
+
+class Statistics(dict):
+    """{rname: [T, {attr: V}]}, the statistics the optimizators read, with
+    the column statistics of every relation ({attr: {'distinct', 'min',
+    'max', 'mcv', 'histogram'}}) in columns"""
+    def __init__(self, *args, **kwargs):
+        super(Statistics, self).__init__(*args, **kwargs)
+        self.columns = {}
+
+# the operator of x OP y rewritten as y OP x
+FLIPPED_OPERATORS = {'=': '=', '!=': '!=', '<>': '<>', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+# share of the tuples a range condition is assumed to keep without a histogram
+DEFAULT_RANGE_SELECTIVITY = 1.0 / 3
+
+def histogram_fraction(histogram, value):
+    """Estimated share of the values of an equi-depth histogram below value"""
+    if not histogram or value < histogram[0]:
+        return 0.0
+    if value >= histogram[-1]:
+        return 1.0
+
+    buckets = len(histogram) - 1
+    inx = bisect.bisect_right(histogram, value) - 1
+    low, high = histogram[inx], histogram[inx + 1]
+    if isinstance(value, (int, long, float)) and high > low:
+        within = float(value - low) / (high - low)
+    else:
+        within = 0.5
+
+    return (inx + within) / buckets
+
+def selectivity(stats, relation, cond):
+    """Estimated share of the tuples of relation satisfying cond.
+
+    stats are {rname: [T, {attr: V}]}; when they are Statistics with
+    column statistics for the attribute cond compares with a literal, the
+    estimate follows its most common values and histogram. Otherwise
+    equality keeps 1 / V(R, a) of the tuples and a range
+    DEFAULT_RANGE_SELECTIVITY. The estimate is never below one tuple.
+    """
+    total, distinct = stats[relation][0], stats[relation][1]
+    floor = 1.0 / max(total, 1)
+
+    for field, value, comp in [(cond.x, cond.y, cond.comp),
+                               (cond.y, cond.x, FLIPPED_OPERATORS.get(cond.comp))]:
+        if isinstance(field, Field) and not isinstance(value, Field) and comp is not None:
+            break
+    else:
+        # two fields: as an equality on the one with most values
+        names = [f.name for f in (cond.x, cond.y) if isinstance(f, Field)]
+        return max(1.0 / max([distinct.get(n, 1) for n in names] or [1]), floor)
+
+    v = max(distinct.get(field.name, 1), 1)
+    column = getattr(stats, 'columns', {}).get(relation, {}).get(field.name)
+
+    if column is None or column.get('min') is None:
+        if comp == '=':
+            estimate = 1.0 / v
+        elif comp in ('!=', '<>'):
+            estimate = 1.0 - 1.0 / v
+        else:
+            estimate = DEFAULT_RANGE_SELECTIVITY
+        return min(max(estimate, floor), 1.0)
+
+    try:
+        value = type(column['min'])(value)
+    except ValueError:
+        # can't be equal to any value of the column
+        return floor if comp == '=' else 1.0
+
+    mcv = column['mcv']
+    rest = max(1.0 - sum(f for _, f in mcv), 0.0)
+
+    frequencies = dict(mcv)
+    if value in frequencies:
+        equal = frequencies[value]
+    elif value < column['min'] or value > column['max']:
+        equal = 0.0
+    else:
+        equal = rest / max(v - len(mcv), 1)
+
+    # the histogram counts a value on a bound as below it, equal ones aren't
+    below = min(sum(f for x, f in mcv if x < value) +
+                rest * histogram_fraction(column['histogram'], value), 1.0 - equal)
+
+    estimate = {
+        '=': equal,
+        '!=': 1.0 - equal,
+        '<>': 1.0 - equal,
+        '<': below,
+        '<=': below + equal,
+        '>': 1.0 - below - equal,
+        '>=': 1.0 - below
+    }.get(comp, DEFAULT_RANGE_SELECTIVITY)
+
+    return min(max(estimate, floor), 1.0)
+
+class StatisticsCatalog(object):
+    """Statistics of relations, keyed by relation name, saved at path"""
+    def __init__(self, path):
+        self.path = path
+
+        # name -> (fingerprint, field signature, statistics)
+        self.entries = {}
+
+    def load(self):
+        """Read the catalog file, if there is one (a damaged one is ignored)"""
+        try:
+            with open(self.path, 'rb') as f:
+                self.entries = pickle.load(f)
+        except Exception:
+            self.entries = {}
+
+    def save(self):
+        """Write the catalog file; False when its directory isn't writable"""
+        try:
+            replace_file(self.path,
+                         lambda f: pickle.dump(self.entries, f, pickle.HIGHEST_PROTOCOL))
+            return True
+        except (IOError, OSError):
+            return False
+
+    def get(self, name, path, fields):
+        """Statistics of relation name, or None if there are none or the
+        relation file at path (or its fields) changed since"""
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+
+        fingerprint, signature, stats = entry
+        if fingerprint != file_fingerprint(path) or signature != field_signature(fields):
+            return None
+        if stats.get('version') != VERSION:
+            return None
+        return stats
+
+    def put(self, name, path, fields, stats):
+        self.entries[name] = (file_fingerprint(path), field_signature(fields), stats)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+if __name__ == '__main__':
+    from megadb.execution.executor import Schema
+
+    schema = Schema()
+    schema.load()
+
+    rnames = sys.argv[1:] or sorted(schema.relations)
+    schema.analyze(rnames)
+    for rname in rnames:
+        print "Analyzed %s: %d tuples" % (rname, schema.stats[rname][0])
@@ -0,0 +1,51 @@
+import unittest
+
+import megadb.algebra as algebra
+from megadb.algebra.parser import parse_sql
+from megadb.algebra.frozen import *
+
+class FrozenNodeTestCase(unittest.TestCase):
+    SQL = "SELECT R.a FROM R, S WHERE R.a = S.a AND R.b = 8"
+
+    def test_freeze_thaw(self):
+        tree = parse_sql(self.SQL)
+        plan = freeze(tree)
+
+        self.assertTrue(plan.is_a(algebra.Projection))
+        self.assertEqual(plan.children[0].args[0].comp, '=')
+        self.assertEqual(repr(plan.get((0, 0, 0))), 'Relation: R')
+
+        thawed = thaw(plan)
+        self.assertIsNot(thawed, tree)
+        self.assertEqual(freeze(thawed), plan)
+        self.assertEqual(thawed.fields, tree.fields)
+        self.assertIs(thawed.children[0].children[0].parent, thawed.children[0])
+
+    def test_value_equality(self):
+        first, second = freeze(parse_sql(self.SQL)), freeze(parse_sql(self.SQL))
+
+        self.assertIsNot(first, second)
+        self.assertEqual(first, second)
+        self.assertEqual(hash(first), hash(second))
+        self.assertEqual(len(distinct_plans([first, second, first])), 1)
+
+        other = freeze(parse_sql("SELECT R.a FROM R, S WHERE R.a = S.a AND R.b = 9"))
+        self.assertNotEqual(first, other)
+
+    def test_immutable(self):
+        plan = freeze(parse_sql(self.SQL))
+        self.assertRaises(AttributeError, setattr, plan, 'children', ())
+
+    def test_replace_shares_subtrees(self):
+        plan = freeze(parse_sql(self.SQL))
+        path = plan.find(algebra.CartesianProduct)
+        product = plan.get(path)
+
+        swapped = plan.replace(path, product.with_children(reversed(product.children)))
+
+        self.assertNotEqual(swapped, plan)
+        self.assertIs(swapped.get(path + (0,)), product.children[1])
+        self.assertIs(swapped.get(path + (1,)), product.children[0])
+        # the original is left as it was
+        self.assertIs(plan.get(path), product)
+        self.assertIsNone(plan.find(algebra.NaturalJoin))
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import megadb.settings as settings
+from megadb.benchmark.generator import generate, relation_sizes
+from megadb.benchmark.runner import run_benchmark, QUERIES
+from megadb.execution.executor import Schema
+
+class BenchmarkTestCase(unittest.TestCase):
+    def setUp(self):
+        self.relations_path = settings.RELATIONS_PATH
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        settings.RELATIONS_PATH = self.relations_path
+        shutil.rmtree(self.directory)
+
+    def read(self, name, directory=None):
+        with open(os.path.join(directory or self.directory, name)) as f:
+            return [line.rstrip('\n').split('#') for line in f]
+
+    def test_generate(self):
+        sizes = generate(self.directory, scale=2, seed=1)
+        self.assertEqual(sizes, relation_sizes(2))
+        self.assertEqual(sizes['Students'], 1800)
+
+        for name, size in sizes.items():
+            self.assertEqual(len(self.read(name)), size)
+
+        students = set(row[0] for row in self.read('Students'))
+        sessions = set(row[0] for row in self.read('Sessions'))
+        professors = set(row[0] for row in self.read('Professors'))
+        courses = set(row[0] for row in self.read('Courses'))
+        programs = set(row[0] for row in self.read('Programs'))
+
+        for student_id, session_id, _ in self.read('Grades'):
+            self.assertIn(student_id, students)
+            self.assertIn(session_id, sessions)
+        for _, _, _, professor_id, course_id in self.read('Sessions'):
+            self.assertIn(professor_id, professors)
+            self.assertIn(course_id, courses)
+        for row in self.read('Students'):
+            self.assertIn(row[4], programs)
+
+    def test_generate_is_deterministic(self):
+        other = tempfile.mkdtemp()
+        try:
+            generate(self.directory, seed=7)
+            generate(other, seed=7)
+            for name in relation_sizes(1):
+                self.assertEqual(self.read(name), self.read(name, other))
+        finally:
+            shutil.rmtree(other)
+
+    def test_run_benchmark(self):
+        generate(self.directory, scale=0.5)
+        settings.RELATIONS_PATH = self.directory
+        schema = Schema()
+        schema.load()
+        schema.load_statistics()
+
+        queries = dict(QUERIES)
+        optimizations = ['PushSelectionDownOptimizator', 'CartesianProductToThetaJoinOptimizator']
+        results = run_benchmark(schema, [('student_lookup', queries['student_lookup']),
+                                         ('grades_students', queries['grades_students'])],
+                                [optimizations], timeout=30)
+
+        self.assertEqual([r['query'] for r in results], ['student_lookup', 'grades_students'])
+        for result in results:
+            self.assertNotIn('error', result)
+            self.assertEqual(result['optimizations'], optimizations)
+            for key in ['parse_time', 'optimize_time', 'translate_time', 'execute_time',
+                        'peak_memory', 'max_rss_growth_kb']:
+                self.assertTrue(result[key] >= 0)
+
+        self.assertTrue(results[0]['rows'] >= 1)
+        # every grade references an existing student
+        self.assertEqual(results[1]['rows'], 906)
+        self.assertTrue(results[1]['peak_memory'] > 0)
+
+    def test_run_benchmark_reports_errors(self):
+        generate(self.directory, scale=0.5)
+        settings.RELATIONS_PATH = self.directory
+        schema = Schema()
+        schema.load()
+        schema.load_statistics()
+
+        results = run_benchmark(schema, [('bad', "SELECT * FROM Nowhere")], [[]])
+        self.assertEqual(len(results), 1)
+        self.assertIn('error', results[0])
@@ -0,0 +1,43 @@
+import unittest
+
+from megadb.benchmark.optimizers import *
+
+class OptimizatorBenchmarkTestCase(unittest.TestCase):
+    def test_join_graph(self):
+        self.assertEqual(join_graph('chain', 4), [(0, 1), (1, 2), (2, 3)])
+        self.assertEqual(join_graph('star', 4), [(0, 1), (0, 2), (0, 3)])
+        self.assertEqual(join_graph('cycle', 4), [(0, 1), (1, 2), (2, 3), (0, 3)])
+        self.assertEqual(len(join_graph('clique', 5)), 10)
+        self.assertRaises(ValueError, join_graph, 'tree', 3)
+
+    def test_synthetic_query(self):
+        edges = join_graph('star', 3)
+        stats = synthetic_stats(3, edges, random.Random(0))
+
+        self.assertEqual(sorted(stats['R0'][1]), ['a0', 'k0_1', 'k0_2'])
+        self.assertEqual(sorted(stats['R1'][1]), ['a1', 'k0_1'])
+
+        # the selections are pushed down and the products become natural joins
+        tree = prepare_tree(stats, synthetic_query(3, edges))
+        join = tree.children[0]
+        self.assertTrue(isinstance(join, optimizator.algebra.NaturalJoin))
+
+    def test_run_benchmark(self):
+        results = run_benchmark(['chain', 'clique'], [2, 4], timeout=30)
+        self.assertEqual(len(results), 2 * 2 * len(OPTIMIZATORS))
+
+        for result in results:
+            self.assertNotIn('error', result)
+            self.assertTrue(result['plans_considered'] > 0)
+            self.assertTrue(result['optimize_time'] >= 0)
+            self.assertTrue(result['relative_cost'] >= 1)
+
+        enumeration = [r for r in results if r['optimization'] == 'EnumerationBasedOptimizator']
+        for result in enumeration:
+            self.assertEqual(result['relative_cost'], 1)
+
+    def test_timeout(self):
+        results = run_benchmark(['clique'], [7, 8], ['EnumerationBasedOptimizator'], timeout=0.1)
+
+        self.assertIn('timed out', results[0]['error'])
+        self.assertIn('skipped', results[1]['error'])
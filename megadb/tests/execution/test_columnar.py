@@ -0,0 +1,76 @@
+import unittest
+import megadb.settings as settings
+from megadb.execution.executor import Schema, Executor
+from megadb.algebra.parser import parse_sql
+from megadb.optimization.optimizator import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+@unittest.skipIf(numpy is None, "the columnar engine requires NumPy")
+class ColumnarExecutorTestCase(unittest.TestCase):
+    def setUp(self):
+        schema = Schema()
+        schema.load()
+        schema.load_statistics()
+
+        self.row_executor = Executor(schema)
+        self.columnar_executor = Executor(schema, 'columnar')
+
+    def execute(self, executor, stmt, optimize=True):
+        tree = parse_sql(stmt)
+        if optimize:
+            tree = PushSelectionDownOptimizator().run(tree)
+            tree = CartesianProductToThetaJoinOptimizator(executor.schema.stats).run(tree)
+        return executor.execute_plan(executor.translate_tree(tree))
+
+    def assertSameResult(self, stmt, optimize=True):
+        expected = self.execute(self.row_executor, stmt, optimize)
+        result = self.execute(self.columnar_executor, stmt, optimize)
+
+        self.assertEqual(sorted(result), sorted(expected))
+        self.assertTrue(all(type(v) in (int, str) for row in result for (_, v) in row))
+        return result
+
+    def test_selection(self):
+        result = self.assertSameResult("SELECT * FROM Alpha WHERE a1 = 3")
+        self.assertEqual(len(result), 2)
+
+    def test_projection(self):
+        self.assertSameResult("SELECT Alpha.a2 FROM Alpha WHERE a1 > 3")
+
+    def test_cartesian_product(self):
+        self.assertSameResult("SELECT * FROM Alpha, Beta WHERE a1 = b1", False)
+
+    def test_equi_join(self):
+        self.assertSameResult("SELECT * FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1")
+
+    def test_natural_join(self):
+        self.assertSameResult("SELECT * FROM Alpha, Beta WHERE Alpha.c = Beta.c")
+
+    def test_projection_push_down(self):
+        stmt = "SELECT Alpha.a2, Beta.b2 FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1"
+        expected = self.execute(self.row_executor, stmt)
+
+        executor = self.columnar_executor
+        tree = parse_sql(stmt)
+        tree = PushSelectionDownOptimizator().run(tree)
+        tree = CartesianProductToThetaJoinOptimizator(executor.schema.stats).run(tree)
+        tree = ProjectionPushDownOptimizator(executor.schema.stats).run(tree)
+
+        self.assertEqual(sorted(executor.execute_plan(executor.translate_tree(tree))),
+                         sorted(expected))
+
+    def test_small_batches(self):
+        batch_size = settings.COLUMNAR_BATCH_SIZE
+        settings.COLUMNAR_BATCH_SIZE = 4
+        try:
+            self.assertSameResult("SELECT * FROM Alpha, Beta WHERE Alpha.c = Beta.c")
+            self.assertSameResult("SELECT * FROM Alpha, Beta WHERE a1 = b1", False)
+        finally:
+            settings.COLUMNAR_BATCH_SIZE = batch_size
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, Executor, self.row_executor.schema, 'gpu')
@@ -1,9 +1,12 @@
 import unittest
+import megadb.settings as settings
 from megadb.execution.executor import Schema, Executor
 from megadb.algebra.parser import parse_sql, print_parse_tree
 from megadb.execution.plan import *
 from megadb.algebra.plan import Comparison, Field, NaturalJoin
 from megadb.optimization.optimizator import *
+from megadb.tree import insert_above
+import megadb.algebra.plan as algebra
 
 class SchemaTestCase(unittest.TestCase):
     def test_load(self):
@@ -71,4 +74,171 @@ class ExecutorTestCase(unittest.TestCase):
         translated = self.executor.translate_tree(tree)
         print_parse_tree(translated)
 
-        self.assertTrue(isinstance(translated.children[0], NLJoin))
+        self.assertTrue(isinstance(translated.children[0], HashJoin))
+
+    def test_translate_equi_join_to_hash_join(self):
+        stmt = "SELECT * FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1"
+
+        tree = parse_sql(stmt)
+        push_opt = PushSelectionDownOptimizator()
+        join_opt = CartesianProductToThetaJoinOptimizator(self.executor.schema.stats)
+        tree = join_opt.run(push_opt.run(tree))
+
+        translated = self.executor.translate_tree(tree)
+        join = translated.children[0]
+
+        self.assertTrue(isinstance(join, HashJoin))
+        # Alpha is smaller than Beta
+        self.assertEqual(join.build_side, 0)
+
+        # same tuples as the nested loop join, in the same column order
+        projection = Projection(None, [])
+        theta = NLJoin(projection, [Comparison(Field('a1'), Field('b1'), '=')])
+        alpha = Relation(theta, 'Alpha', self.executor.schema.relations['Alpha'])
+        beta = Relation(theta, 'Beta', self.executor.schema.relations['Beta'])
+
+        hash_result = self.executor.execute_plan(translated)
+        nl_result = self.executor.execute_plan(projection)
+
+        self.assertEqual(sorted(hash_result), sorted(nl_result))
+
+    def test_translate_join_over_memory_to_grace_hash_join(self):
+        tree = parse_sql("SELECT * FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1")
+        tree = PushSelectionDownOptimizator().run(tree)
+        tree = CartesianProductToThetaJoinOptimizator(self.executor.schema.stats).run(tree)
+
+        work_memory = settings.WORK_MEMORY
+        settings.WORK_MEMORY = 4
+        try:
+            translated = self.executor.translate_tree(tree)
+            join = translated.children[0]
+            self.assertTrue(isinstance(join, GraceHashJoin))
+            self.assertEqual(len(self.executor.execute_plan(translated)), 9)
+            self.assertEqual(join.spilled_partitions, 2 * GraceHashJoin.FANOUT)
+        finally:
+            settings.WORK_MEMORY = work_memory
+
+    def test_parallelize(self):
+        tree = parse_sql("SELECT Alpha.a2, Beta.b2 FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1")
+        tree = PushSelectionDownOptimizator().run(tree)
+        tree = CartesianProductToThetaJoinOptimizator(self.executor.schema.stats).run(tree)
+        expected = self.executor.execute_plan(self.executor.translate_tree(tree))
+
+        work_memory = settings.WORK_MEMORY
+        settings.WORK_MEMORY = 4
+        try:
+            translated = self.executor.parallelize(self.executor.translate_tree(tree), 3)
+            print_parse_tree(translated)
+
+            join = translated.children[0].children[0]
+            self.assertTrue(isinstance(translated, Gather))
+            self.assertTrue(all(isinstance(c, Exchange) for c in join.children))
+            self.assertEqual(sorted(self.executor.execute_plan(translated)), sorted(expected))
+        finally:
+            settings.WORK_MEMORY = work_memory
+
+    def test_projection_push_down(self):
+        stmt = "SELECT Alpha.a2 FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1 AND Beta.b2 = 'C'"
+        stats = self.executor.schema.stats
+
+        tree = parse_sql(stmt)
+        tree = PushSelectionDownOptimizator().run(tree)
+        tree = CartesianProductToThetaJoinOptimizator(stats).run(tree)
+        expected = self.executor.execute_plan(self.executor.translate_tree(tree))
+
+        tree = ProjectionPushDownOptimizator(stats).run(tree)
+        translated = self.executor.translate_tree(tree)
+        print_parse_tree(translated)
+        result = self.executor.execute_plan(translated)
+
+        self.assertEqual(result, expected)
+
+        join = translated.children[0]
+        alpha = join.children[0].children[0]
+        self.assertTrue(isinstance(alpha, Relation))
+        self.assertEqual(alpha.columns, ['a1', 'a2'])
+        self.assertEqual(len(join.schema), 3)
+
+        # the selection on Beta stays on its scan, which reads the selected column too
+        beta = join.children[1].children[0]
+        self.assertTrue(isinstance(beta, Selection))
+        self.assertTrue(isinstance(beta.children[0], Relation))
+        self.assertEqual(beta.children[0].columns, ['b1', 'b2'])
+
+    def test_translate_non_equi_join(self):
+        tree = parse_sql("SELECT * FROM Alpha, Beta WHERE Alpha.a1 = 3")
+        tree = PushSelectionDownOptimizator().run(tree)
+        tree = CartesianProductToThetaJoinOptimizator(self.executor.schema.stats).run(tree)
+
+        translated = self.executor.translate_tree(tree)
+        self.assertFalse(any(isinstance(c, HashJoin) for c in translated.children))
+
+class ParallelScanTestCase(unittest.TestCase):
+    def setUp(self):
+        self.parallelism = settings.SCAN_PARALLELISM
+        self.min_size = settings.PARALLEL_SCAN_MIN_SIZE
+        settings.SCAN_PARALLELISM = 2
+        settings.PARALLEL_SCAN_MIN_SIZE = 0
+
+        # nothing is cached, so every scan reads its file
+        schema = Schema(cache_size=0)
+        schema.load()
+        schema.load_statistics()
+
+        self.executor = Executor(schema)
+
+    def tearDown(self):
+        settings.SCAN_PARALLELISM = self.parallelism
+        settings.PARALLEL_SCAN_MIN_SIZE = self.min_size
+
+    def test_selection_is_pushed_into_scan(self):
+        stmt = "SELECT * FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1 AND Beta.c = 'QQ' AND Alpha.a1 > 1"
+        tree = parse_sql(stmt)
+        tree = PushSelectionDownOptimizator().run(tree)
+        tree = CartesianProductToThetaJoinOptimizator(self.executor.schema.stats).run(tree)
+
+        translated = self.executor.translate_tree(tree)
+        print_parse_tree(translated)
+
+        join = translated.children[0]
+        self.assertTrue(all(isinstance(c, ParallelScan) for c in join.children))
+        self.assertEqual(sum(len(c.conds) for c in join.children), 2)
+
+        result = self.executor.execute_plan(translated)
+        self.assertEqual(len(result), 1)
+
+        settings.SCAN_PARALLELISM = 1
+        self.assertEqual(result, self.executor.execute_plan(self.executor.translate_tree(tree)))
+
+    def test_selection_is_pushed_into_scan_with_projection_push_down(self):
+        stmt = "SELECT Alpha.a2 FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1 AND Beta.c = 'QQ'"
+        stats = self.executor.schema.stats
+        tree = parse_sql(stmt)
+        tree = PushSelectionDownOptimizator().run(tree)
+        tree = CartesianProductToThetaJoinOptimizator(stats).run(tree)
+        tree = ProjectionPushDownOptimizator(stats).run(tree)
+
+        translated = self.executor.translate_tree(tree)
+        print_parse_tree(translated)
+
+        beta = translated.children[0].children[1].children[0]
+        self.assertTrue(isinstance(beta, ParallelScan))
+        self.assertEqual(len(beta.conds), 1)
+        self.assertEqual(beta.columns, ['b1', 'c'])
+
+        result = self.executor.execute_plan(translated)
+        settings.SCAN_PARALLELISM = 1
+        self.assertEqual(result, self.executor.execute_plan(self.executor.translate_tree(tree)))
+
+    def test_selection_is_pushed_into_scan_below_projection(self):
+        tree = PushSelectionDownOptimizator().run(parse_sql("SELECT * FROM Beta WHERE Beta.c = 'QQ'"))
+        relation = tree.children[0].children[0]
+        insert_above(relation, algebra.Projection(None, [Field('Beta.b2'), Field('Beta.c')]))
+
+        translated = self.executor.translate_tree(tree)
+
+        scan = translated.children[0]
+        self.assertTrue(isinstance(scan, ParallelScan))
+        self.assertEqual(scan.columns, ['b2', 'c'])
+        self.assertEqual([[v for _, v in t] for t in self.executor.execute_plan(translated)],
+                         [['A', 'QQ'], ['B', 'QQ'], ['H', 'QQ']])
@@ -1,4 +1,6 @@
+import os
 import unittest
+import megadb.settings as settings
 from megadb.execution.plan import *
 from megadb.execution.executor import Schema
 from megadb.algebra.plan import Comparison, Field
@@ -135,3 +137,252 @@ class OptimizationPlanTestCase(PlanTestCase):
         #     costs.append(sum(cost))
 
         # print costs
+
+class IteratorPlanTestCase(PlanTestCase):
+    def setUp(self):
+        super(IteratorPlanTestCase, self).setUp()
+        self.batch_size = settings.BATCH_SIZE
+        settings.BATCH_SIZE = 4
+
+    def tearDown(self):
+        settings.BATCH_SIZE = self.batch_size
+
+    def test_next_returns_batches(self):
+        alpha = Relation(None, 'Alpha', self.schema.relations['Alpha'])
+
+        with alpha:
+            sizes = [len(batch) for batch in iter(alpha.next, None)]
+            self.assertEqual(sizes, [4, 4, 1])
+            self.assertEqual(alpha.table_size, 9)
+            self.assertIsNone(alpha.next())
+
+    def test_join_streams_outer_input(self):
+        theta = NLJoin(None, [Comparison(Field('a1'), Field('b1'), '=')])
+        alpha = Relation(theta, 'Alpha', self.schema.relations['Alpha'])
+        beta = Relation(theta, 'Beta', self.schema.relations['Beta'])
+
+        with theta:
+            first = theta.next()
+            self.assertEqual(len(first), 4)
+            # only the batches needed for the first output were read
+            self.assertTrue(alpha.table_size < 9)
+
+            rest = theta.run()
+            self.assertEqual(len(first) + len(rest), 9)
+            self.assertEqual(theta.table_size, 9)
+
+class SortMergeJoinPlanTestCase(PlanTestCase):
+    def build_nl_join(self):
+        theta = NLJoin(None, [Comparison(Field('a1'), Field('b1'), '=')])
+        Relation(theta, 'Alpha', self.schema.relations['Alpha'])
+        Relation(theta, 'Beta', self.schema.relations['Beta'])
+        return theta
+
+    def build_sort_merge_join(self, parent=None):
+        join = SortMergeJoin(parent, [Comparison(Field('Alpha.a1'), Field('Beta.b1'), '=')])
+        Relation(join, 'Alpha', self.schema.relations['Alpha'])
+        Relation(join, 'Beta', self.schema.relations['Beta'])
+        return join
+
+    def test_same_tuples_as_nl_join(self):
+        with self.build_nl_join() as nl_join:
+            expected = nl_join.run()
+
+        with self.build_sort_merge_join() as join:
+            tuples = join.run()
+
+        self.assertEqual(sorted(tuples), sorted(expected))
+        self.assertEqual([t[0] for t in tuples], sorted(t[0] for t in tuples))
+
+    def test_external_sort(self):
+        values = [5, 3, 9, 1, 7, 3, 8, 2, 6]
+        self.assertEqual(list(external_sort(values, lambda x: x, 2)), sorted(values))
+        self.assertEqual(list(external_sort(values, lambda x: x, 20)), sorted(values))
+
+    def test_reuse_sorted_input(self):
+        selection = Selection(None, [Comparison(Field('a2'), 'c', '=')])
+        join = self.build_sort_merge_join(selection)
+
+        self.assertTrue(selection.sorted_on([Field('Alpha.a1')]))
+        self.assertTrue(selection.sorted_on([Field('Beta.b1')]))
+        self.assertFalse(selection.sorted_on([Field('Alpha.a2')]))
+
+        parent = SortMergeJoin(None, [Comparison(Field('Beta.b1'), Field('Beta.b1'), '=')])
+        selection.parent = parent
+        Relation(parent, 'Beta', self.schema.relations['Beta'])
+
+        with parent:
+            tuples = parent.run()
+
+        self.assertEqual(len(tuples), 1)
+
+class GraceHashJoinPlanTestCase(PlanTestCase):
+    def join(self, join, left='Alpha', right='Beta'):
+        Relation(join, left, self.schema.relations[left])
+        Relation(join, right, self.schema.relations[right])
+        with join:
+            return join.run()
+
+    def test_same_tuples_as_nl_join(self):
+        conds = [Comparison(Field('Alpha.a1'), Field('Beta.b1'), '=')]
+        expected = self.join(NLJoin(None, conds))
+
+        for build_side in [0, 1]:
+            # fits in memory
+            join = GraceHashJoin(None, conds, build_side)
+            self.assertEqual(sorted(self.join(join)), sorted(expected))
+            self.assertEqual(join.spilled_partitions, 0)
+
+            join = GraceHashJoin(None, conds, build_side, limit=2)
+            self.assertEqual(sorted(self.join(join)), sorted(expected))
+            self.assertTrue(join.spilled_partitions >= 2 * GraceHashJoin.FANOUT)
+
+    def test_skewed_partitions(self):
+        # three tuples of each input have c = 'XD', three more c = 'QQ'
+        conds = [Comparison(Field('Alpha.c'), Field('Beta.c'), '=')]
+        expected = self.join(NLJoin(None, conds), 'Alpha', 'Beta')
+
+        join = GraceHashJoin(None, conds, 0, limit=1)
+        self.assertEqual(sorted(self.join(join, 'Alpha', 'Beta')), sorted(expected))
+        self.assertEqual(len(expected), 19)
+
+class GatherPlanTestCase(PlanTestCase):
+    def run_plan(self, plan):
+        with plan:
+            return plan.run()
+
+    def build_join(self, parent, exchange):
+        join = HashJoin(parent, [Comparison(Field('Alpha.a1'), Field('Beta.b1'), '=')], 0)
+        inputs = [Exchange(join, [Field('Alpha.a1')]), Exchange(join, [Field('Beta.b1')])] if exchange else [join, join]
+        Relation(inputs[0], 'Alpha', self.schema.relations['Alpha'])
+        Relation(inputs[1], 'Beta', self.schema.relations['Beta'])
+        return join
+
+    def test_filtered_scan(self):
+        conds = [Comparison(Field('b1'), '3', '>')]
+
+        selection = Selection(None, conds)
+        Relation(selection, 'Beta', self.schema.relations['Beta'])
+        expected = self.run_plan(selection)
+
+        gather = Gather(None, 3)
+        selection = Selection(gather, conds)
+        Relation(selection, 'Beta', self.schema.relations['Beta'])
+        self.assertEqual(sorted(self.run_plan(gather)), sorted(expected))
+
+    def test_partitioned_join(self):
+        expected = self.run_plan(self.build_join(None, False))
+
+        for exchange in [False, True]:
+            gather = Gather(None, 2)
+            self.build_join(gather, exchange)
+            self.assertEqual(sorted(self.run_plan(gather)), sorted(expected))
+
+    def test_exchange_partitions(self):
+        shares = []
+        for inx in range(3):
+            exchange = Exchange(None, [Field('c')])
+            Relation(exchange, 'Beta', self.schema.relations['Beta'])
+            exchange.partition(inx, 3)
+            shares.append(self.run_plan(exchange))
+
+        self.assertEqual(sum(len(share) for share in shares), 14)
+        for share in shares:
+            # equal keys end up in the same share
+            keys = set(t[2] for t in share)
+            self.assertFalse(any(keys & set(t[2] for t in other) for other in shares if other is not share))
+
+    def test_worker_error(self):
+        gather = Gather(None, 2)
+        Relation(gather, 'Missing', self.schema.relations['Beta'])
+        self.assertRaises(RuntimeError, self.run_plan, gather)
+
+class SchemaPlanTestCase(PlanTestCase):
+    def test_positional_tuples(self):
+        projection = Projection(None, [Field('a2'), Field('b1')])
+        theta = NLJoin(projection, [Comparison(Field('a1'), Field('b1'), '=')])
+        alpha = Relation(theta, 'Alpha', self.schema.relations['Alpha'])
+        beta = Relation(theta, 'Beta', self.schema.relations['Beta'])
+
+        with projection:
+            self.assertEqual([str(f) for f, _ in theta.schema],
+                             ['Alpha.a1', 'Alpha.a2', 'Alpha.c', 'Beta.b1', 'Beta.b2', 'Beta.c'])
+            self.assertEqual([(str(f), t) for f, t in projection.schema],
+                             [('Alpha.a2', str), ('Beta.b1', int)])
+
+            tuples = projection.run()
+            self.assertTrue(all(type(t) is tuple for t in tuples))
+            self.assertIn(('cc', 3), tuples)
+
+    def test_resolve_field(self):
+        schema = [(Field('Alpha.c'), str), (Field('Beta.c'), str)]
+
+        self.assertEqual(resolve_field(schema, Field('Beta.c')), 1)
+        self.assertEqual(resolve_field(schema, Field('c')), 0)
+        self.assertRaises(KeyError, resolve_field, schema, Field('d'))
+
+class CompiledConditionTestCase(PlanTestCase):
+    def setUp(self):
+        super(CompiledConditionTestCase, self).setUp()
+        self.alpha_schema = [(Field('Alpha.a1'), int), (Field('Alpha.a2'), str)]
+        self.beta_schema = [(Field('Beta.b1'), int), (Field('Beta.b2'), str)]
+
+    def test_filter_casts_literals(self):
+        select = compile_filter([Comparison(Field('a1'), '3', '=')], self.alpha_schema)
+        self.assertEqual(select([(3, 'c'), (4, 'd'), (3, 'cc')]), [(3, 'c'), (3, 'cc')])
+
+        select = compile_filter([Comparison('4', Field('Alpha.a1'), '<=')], self.alpha_schema)
+        self.assertEqual(select([(3, 'c'), (4, 'd'), (5, 'e')]), [(4, 'd'), (5, 'e')])
+
+    def test_filter_operators(self):
+        conds = [Comparison(Field('a1'), '1', '>'), Comparison(Field('a2'), 'e', '<>')]
+        select = compile_filter(conds, self.alpha_schema)
+        self.assertEqual(select([(1, 'a'), (4, 'd'), (5, 'e')]), [(4, 'd')])
+
+        self.assertRaises(NotImplementedError, compile_filter,
+                          [Comparison(Field('a1'), '1', 'LIKE')], self.alpha_schema)
+
+    def test_join_filter(self):
+        join = compile_join_filter([Comparison(Field('b1'), Field('a1'), '=')],
+                                   self.alpha_schema, self.beta_schema)
+        self.assertEqual(join((3, 'c'), [(1, 'A'), (3, 'C')]), [(3, 'c', 3, 'C')])
+
+        cross = compile_join_filter([], self.alpha_schema, self.beta_schema)
+        self.assertEqual(len(cross((3, 'c'), [(1, 'A'), (3, 'C')])), 2)
+
+class ParallelScanPlanTestCase(PlanTestCase):
+    def test_split_ranges(self):
+        path = os.path.join(settings.RELATIONS_PATH, 'Beta')
+        with open(path, 'rb') as f:
+            lines = f.read().splitlines(True)
+
+        for parts in [1, 2, 3, 5, 100]:
+            ranges = split_ranges(path, parts)
+            self.assertTrue(len(ranges) <= parts)
+
+            chunks = []
+            with open(path, 'rb') as f:
+                for start, stop in ranges:
+                    f.seek(start)
+                    chunks.append(f.read(stop - start))
+
+            # ranges hold whole lines and cover the file
+            self.assertTrue(all(chunk.endswith('\n') for chunk in chunks))
+            self.assertEqual(''.join(chunks).splitlines(True), lines)
+
+    def test_same_tuples_as_selection(self):
+        conds = [Comparison(Field('Beta.b1'), '3', '>'), Comparison(Field('c'), 'A', '<>')]
+
+        selection = Selection(None, conds)
+        Relation(selection, 'Beta', self.schema.relations['Beta'])
+        with selection:
+            expected = selection.run()
+
+        scan = ParallelScan(None, 'Beta', self.schema.relations['Beta'], conds, parallelism=2)
+        with scan:
+            self.assertEqual(scan.run(), expected)
+
+        scan = ParallelScan(None, 'Beta', self.schema.relations['Beta'], columns=['b2'], parallelism=3)
+        with scan:
+            self.assertEqual(len(scan.run()), 14)
+            self.assertEqual(len(scan.schema), 1)
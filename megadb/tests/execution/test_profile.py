@@ -0,0 +1,101 @@
+import json
+import unittest
+
+from megadb.execution.executor import Schema, Executor
+from megadb.execution.plan import *
+from megadb.execution.profile import *
+from megadb.algebra.plan import Comparison, Field
+from megadb.algebra.parser import parse_sql
+from megadb.optimization.optimizator import (PushSelectionDownOptimizator,
+                                             CartesianProductToThetaJoinOptimizator,
+                                             EnumerationBasedOptimizator)
+
+class ProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.schema = Schema()
+        self.schema.load()
+        self.schema.load_statistics()
+
+    def test_nested_loop_join(self):
+        projection = Projection(None, [Field('Alpha.a2'), Field('Beta.b2')])
+        join = NLJoin(projection, [Comparison(Field('Alpha.a1'), Field('Beta.b1'), '=')])
+        selection = Selection(join, [Comparison(Field('Alpha.c'), 'XD', '=')])
+        Relation(selection, 'Alpha', self.schema.relations['Alpha'])
+        Relation(join, 'Beta', self.schema.relations['Beta'])
+
+        tuples, profile = explain_analyze(projection)
+        print format_profile(profile)
+
+        self.assertEqual(sorted(tuples), [('a', 'A'), ('b', 'B'), ('c', 'C')])
+        self.assertEqual(profile['type'], 'Projection')
+        self.assertEqual(profile['rows_out'], 3)
+
+        join_profile = profile['children'][0]
+        self.assertEqual(join_profile['rows_in'], 3 + 14)
+        self.assertEqual(join_profile['loops'], 3)
+        self.assertEqual(join_profile['predicate_evaluations'], 3 * 14)
+        self.assertTrue(join_profile['memory'] > 0)
+
+        selection_profile, beta_profile = join_profile['children']
+        self.assertEqual(selection_profile['rows_in'], 9)
+        self.assertEqual(selection_profile['rows_out'], 3)
+        self.assertEqual(selection_profile['predicate_evaluations'], 9)
+        self.assertEqual(beta_profile['rows_in'], 0)
+        self.assertEqual(beta_profile['rows_out'], 14)
+
+        for p in [profile, join_profile, selection_profile, beta_profile]:
+            self.assertTrue(0 <= p['exclusive_time'] <= p['time'])
+
+    def test_structured_output(self):
+        tree = parse_sql("SELECT * FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1")
+        translated = Executor(self.schema).translate_tree(
+            CartesianProductToThetaJoinOptimizator(self.schema.stats).run(
+                PushSelectionDownOptimizator().run(tree)))
+
+        tuples, profile = explain_analyze(translated)
+        decoded = json.loads(json.dumps(profile))
+
+        self.assertEqual(decoded['rows_out'], len(tuples))
+        lines = format_profile(profile).splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].startswith('->  '))
+        self.assertTrue(lines[2].startswith('  ->  '))
+
+    def test_estimated_cardinalities(self):
+        tree = parse_sql("SELECT * FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1 AND Beta.c = 'XD'")
+        for opt in [PushSelectionDownOptimizator(),
+                    CartesianProductToThetaJoinOptimizator(self.schema.stats),
+                    EnumerationBasedOptimizator(self.schema.stats)]:
+            tree = opt.run(tree)
+
+        # the optimizator left its estimates on the logical nodes
+        join = tree.children[0]
+        self.assertTrue(join.estimated_size > 0)
+
+        translated = Executor(self.schema).translate_tree(tree)
+        self.assertEqual(translated.children[0].estimated_size, join.estimated_size)
+
+        _, profile = explain_analyze(translated)
+        print format_profile(profile)
+
+        def scans(p):
+            if not p['children']:
+                return [p]
+            return sum([scans(c) for c in p['children']], [])
+
+        for scan in scans(profile):
+            self.assertEqual(scan['estimated_rows'], scan['rows_out'])
+            self.assertEqual(scan['q_error'], 1.0)
+
+        errors = estimation_errors(profile)
+        self.assertEqual(len(errors), 5)
+        self.assertEqual([e[3] for e in errors], sorted([e[3] for e in errors], reverse=True))
+        for operator, estimated, actual, error in errors:
+            self.assertTrue(error >= 1.0)
+
+    def test_q_error(self):
+        self.assertEqual(q_error(10, 10), 1.0)
+        self.assertEqual(q_error(5, 20), 4.0)
+        self.assertEqual(q_error(20, 5), 4.0)
+        self.assertEqual(q_error(0.2, 0), 1.0)
+        self.assertEqual(q_error(None, 3), None)
@@ -0,0 +1,105 @@
+import time
+import threading
+import unittest
+
+import megadb.settings as settings
+from megadb.execution.workload import *
+from megadb.execution.executor import Schema, Executor
+from megadb.execution.plan import Relation, NLJoin
+from megadb.algebra.parser import parse_sql
+from megadb.algebra.plan import Comparison, Field
+from megadb.optimization.optimizator import (PushSelectionDownOptimizator,
+                                             CartesianProductToThetaJoinOptimizator)
+
+class WorkloadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.schema = Schema()
+        self.schema.load()
+        self.schema.load_statistics()
+        self.executor = Executor(self.schema)
+
+    def tree(self, stmt="SELECT * FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1"):
+        tree = PushSelectionDownOptimizator().run(parse_sql(stmt))
+        return CartesianProductToThetaJoinOptimizator(self.schema.stats).run(tree)
+
+    def test_estimate_memory(self):
+        join = estimate_memory(self.executor, self.tree())
+        product = estimate_memory(self.executor, parse_sql("SELECT * FROM Alpha, Beta"))
+
+        self.assertEqual(estimate_memory(self.executor, parse_sql("SELECT * FROM Alpha")), 0)
+        self.assertTrue(0 < join < product)
+
+    def test_execute(self):
+        scheduler = Scheduler(self.schema)
+        fields, tuples = scheduler.execute(self.tree())
+
+        expected = self.executor.execute_plan(self.executor.translate_tree(self.tree()))
+        self.assertEqual([zip(fields, t) for t in tuples], expected)
+        self.assertEqual((scheduler.running, scheduler.reserved, scheduler.queries), (0, 0, {}))
+
+    def test_memory_limit(self):
+        scheduler = Scheduler(self.schema, memory_limit=100)
+        self.assertRaises(MemoryLimitExceeded, scheduler.execute, self.tree())
+        self.assertEqual(scheduler.running, 0)
+
+    def test_rejected_over_budget(self):
+        scheduler = Scheduler(self.schema, memory_budget=1)
+        self.assertRaises(AdmissionRejected, scheduler.execute, self.tree())
+
+    def test_concurrency_limit(self):
+        scheduler = Scheduler(self.schema, max_concurrent=1)
+        running = QueryContext()
+        scheduler.admit(running)
+
+        self.assertRaises(AdmissionRejected, scheduler.execute, self.tree(), timeout=0.2)
+
+        scheduler.finish(running)
+        self.assertEqual(len(scheduler.execute(self.tree())[1]), 9)
+
+    def test_cancel_waiting_query(self):
+        scheduler = Scheduler(self.schema, max_concurrent=1)
+        running = QueryContext()
+        scheduler.admit(running)
+
+        waiting = QueryContext()
+        errors = []
+        def run():
+            try:
+                scheduler.execute(self.tree(), context=waiting)
+            except QueryCancelled as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        while waiting.query_id not in scheduler.queries:
+            time.sleep(0.01)
+
+        self.assertTrue(scheduler.cancel(waiting.query_id))
+        thread.join()
+        scheduler.finish(running)
+
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(scheduler.cancel(waiting.query_id))
+
+    def test_cancel_between_batches(self):
+        batch_size = settings.BATCH_SIZE
+        settings.BATCH_SIZE = 2
+        try:
+            join = NLJoin(None, [Comparison(Field('a1'), Field('b1'), '=')])
+            Relation(join, 'Alpha', self.schema.relations['Alpha'])
+            Relation(join, 'Beta', self.schema.relations['Beta'])
+
+            context = QueryContext()
+            join.set_context(context)
+            with join:
+                self.assertEqual(len(join.next()), 2)
+                self.assertTrue(context.memory > 0)
+
+                context.cancel()
+                self.assertRaises(QueryCancelled, join.next)
+
+            # operators give their memory back when closed
+            self.assertEqual(context.memory, 0)
+            self.assertTrue(context.peak_memory > 0)
+        finally:
+            settings.BATCH_SIZE = batch_size
@@ -1,7 +1,11 @@
 import unittest
+import itertools
 
 from megadb.algebra.parser import parse_sql, print_parse_tree
+import megadb.algebra as algebra
 from megadb.optimization.optimizator import *
+from megadb.algebra.frozen import freeze
+from megadb.storage.statistics import Statistics
 
 class PushSelectionDownOptimizatorTestCase(unittest.TestCase):
     def test_basic(self):
@@ -131,6 +135,35 @@ class JoinOrderTestCase(unittest.TestCase):
             print_parse_tree(t)
 
 
+    def test_join_orders_share_participants(self):
+        tree = parse_sql("SELECT * FROM R, S, T, U WHERE \
+            R.b = S.b AND S.c = T.c AND T.d = U.d AND R.a = 1")
+
+        test_stats = {
+            'R': [1000, {'a': 100, 'b': 100}],
+            'S': [ 100, {'b': 100, 'c':  10}],
+            'T': [ 100, {'c':  10, 'd': 100}],
+            'U': [1000, {'d': 100}]
+        }
+
+        tree = PushSelectionDownOptimizator().run(tree)
+        tree = CartesianProductToThetaJoinOptimizator(test_stats).run(tree)
+        plan = freeze(tree)
+        plans = join_orders(plan)
+
+        # 6 first pairs * 2 orders of the rest left-deep, 3 bushy pairings
+        self.assertEqual(len(plans), 15)
+        self.assertEqual(len(set(plans)), 15)
+
+        participants = join_participants(plan.get(plan.find(algebra.NaturalJoin)))
+        for p in plans:
+            joined = join_participants(p.get(p.find(algebra.NaturalJoin)))
+            if len(joined) == 4: # left-deep
+                self.assertTrue(all(any(j is q for q in participants) for j in joined))
+
+        self.assertEqual(len(enumerate_join_orders(tree)), 15)
+        self.assertEqual(freeze(tree), plan)
+
 class SelectivityTestCase(unittest.TestCase):
     def test_enumerate_selections(self):
         tree = parse_sql("SELECT * FROM Student, Professor WHERE \
@@ -146,6 +179,11 @@ class SelectivityTestCase(unittest.TestCase):
             print "%d: " % (idx+1)
             print_parse_tree(t)
 
+        # two cascades of two selections (the missing AND leaves Professor.Name
+        # above the product), each in both orders
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(set(map(freeze, results))), 4)
+
 
 class GreedyJoinOrderOptimizatorTestCase(unittest.TestCase):
     def test_easy(self):
@@ -173,6 +211,152 @@ class GreedyJoinOrderOptimizatorTestCase(unittest.TestCase):
         greedy_opt = GreedyJoinOrderOptimizator(test_stats)
         print_parse_tree(greedy_opt.run(tree))
 
+        # pairs costed: 6 + 3 + 1
+        self.assertEqual(greedy_opt.plans_considered, 10)
+
+    def test_keeps_stats(self):
+        tree = parse_sql("SELECT * FROM R, S WHERE R.b = S.b AND R.a = 3")
+
+        test_stats = {
+            'R': [1000, {'a': 100, 'b': 100}],
+            'S': [ 100, {'b': 100, 'c':  10}]
+        }
+
+        tree = PushSelectionDownOptimizator().run(tree)
+        tree = CartesianProductToThetaJoinOptimizator(test_stats).run(tree)
+        GreedyJoinOrderOptimizator(test_stats).run(tree)
+
+        self.assertEqual(test_stats['R'], [1000, {'a': 100, 'b': 100}])
+
+    def test_skewed_selection(self):
+        tree = parse_sql("SELECT * FROM R, S, T WHERE R.b = S.b AND S.c = T.c AND R.a = 3 AND T.d = 5")
+
+        test_stats = Statistics({
+            'R': [1000, {'a': 100, 'b': 100}],
+            'S': [1000, {'b': 100, 'c': 100}],
+            'T': [1000, {'c': 100, 'd': 100}]
+        })
+        # T.d = 5 keeps most of T, R.a = 3 as much as any other value
+        test_stats.columns['T'] = {'d': {'distinct': 100, 'min': 1, 'max': 100,
+                                         'mcv': [(5, 0.9)], 'histogram': [1, 50, 100]}}
+
+        tree = PushSelectionDownOptimizator().run(tree)
+        tree = CartesianProductToThetaJoinOptimizator(test_stats).run(tree)
+        tree = GreedyJoinOrderOptimizator(test_stats).run(tree)
+
+        sizes = {}
+        def visit(selection):
+            sizes[str(selection.conds[0].x)] = selection.estimated_size
+        tree_traverse(tree, algebra.Selection, visit)
+        self.assertAlmostEqual(sizes['R.a'], 10)
+        self.assertAlmostEqual(sizes['T.d'], 900)
+
+        # R and S are joined first, T only shrinks a little (without
+        # the most common values S and T would be)
+        join = find_root(tree).children[0]
+        while not isinstance(join, algebra.NaturalJoin):
+            join = join.children[0]
+        self.assertEqual(collect_namespaces(join.children[1]), set(['R', 'S']))
+
+class DPccpJoinOrderOptimizatorTestCase(unittest.TestCase):
+    def join_sizes(self, root):
+        sizes = []
+        tree_traverse(root, algebra.NaturalJoin, lambda join: sizes.append(join.estimated_size))
+        return sizes
+
+    def test_easy(self):
+        sql = "SELECT * FROM R, S, T, U WHERE R.b = S.b AND S.c = T.c AND T.d = U.d AND U.a = R.a"
+
+        test_stats = {
+            'R': [1000, {'a': 100, 'b': 100}],
+            'U': [1000, {'a': 100, 'd': 100}],
+            'S': [ 100, {'b': 100, 'c':  10}],
+            'T': [ 100, {'c':  10, 'd': 100}]
+        }
+
+        def prepare():
+            tree = PushSelectionDownOptimizator().run(parse_sql(sql))
+            return CartesianProductToThetaJoinOptimizator(test_stats).run(tree)
+
+        dp_opt = DPccpJoinOrderOptimizator(test_stats)
+        optimized = dp_opt.run(prepare())
+        print_parse_tree(optimized)
+
+        self.assertEqual(collect_namespaces(optimized), set(['R', 'S', 'T', 'U']))
+        # pairs of connected subgraphs of a 4-cycle
+        self.assertEqual(dp_opt.plans_considered, 18)
+
+        # no worse than greedy under the same estimates
+        greedy = GreedyJoinOrderOptimizator(test_stats).run(prepare())
+        self.assertEqual(len(self.join_sizes(optimized)), 3)
+        self.assertTrue(sum(self.join_sizes(optimized)) <= sum(self.join_sizes(greedy)))
+
+    def test_cartesian_product(self):
+        test_stats = {
+            'R': [1000, {'a': 10}],
+            'S': [10, {'a': 10}],
+            'T': [5, {'b': 5}]
+        }
+
+        root = algebra.Projection(None, [])
+        outer = algebra.NaturalJoin(root)
+        inner = algebra.NaturalJoin(outer)
+        algebra.Relation(inner, 'T')
+        algebra.Relation(inner, 'R')
+        algebra.Relation(outer, 'S')
+
+        optimized = DPccpJoinOrderOptimizator(test_stats).run(root)
+        print_parse_tree(optimized)
+
+        # R and S are joined, then crossed with T
+        join = optimized.children[0]
+        self.assertEqual(sorted(sorted(collect_namespaces(c)) for c in join.children),
+                         [['R', 'S'], ['T']])
+        self.assertEqual(self.join_sizes(optimized), [5000.0, 1000.0])
+
+    def test_join_at_root(self):
+        test_stats = {
+            'R': [1000, {'a': 10}],
+            'S': [10, {'a': 10, 'b': 5}],
+            'T': [5, {'b': 5}]
+        }
+
+        root = algebra.NaturalJoin(None)
+        inner = algebra.NaturalJoin(root)
+        algebra.Relation(inner, 'R')
+        algebra.Relation(inner, 'T')
+        algebra.Relation(root, 'S')
+
+        optimized = DPccpJoinOrderOptimizator(test_stats).run(root)
+        print_parse_tree(optimized)
+
+        self.assertTrue(isinstance(optimized, algebra.NaturalJoin))
+        self.assertIsNone(optimized.parent)
+        self.assertEqual(collect_namespaces(optimized), set(['R', 'S', 'T']))
+        self.assertEqual(len(self.join_sizes(optimized)), 2)
+
+    def test_csg_cmp_pairs(self):
+        def graph(n, edges):
+            neighbours = [0] * n
+            for i, j in edges:
+                neighbours[i] |= 1 << j
+                neighbours[j] |= 1 << i
+            return neighbours
+
+        chain = list(csg_cmp_pairs(graph(5, [(i, i + 1) for i in range(4)])))
+        self.assertEqual(len(chain), (5 ** 3 - 5) / 6)
+
+        clique = list(csg_cmp_pairs(graph(4, itertools.combinations(range(4), 2))))
+        self.assertEqual(len(clique), (3 ** 4 - 2 ** 5 + 1) / 2)
+
+        # both sides of every pair are planned before
+        planned = set(1 << i for i in range(4))
+        for s1, s2 in clique:
+            self.assertFalse(s1 & s2)
+            self.assertIn(s1, planned)
+            self.assertIn(s2, planned)
+            planned.add(s1 | s2)
+
 class EnumerationBasedOptimizatorTestCase(unittest.TestCase):
     def test_single(self):
         tree = parse_sql("SELECT * FROM A WHERE A.a = 3 AND A.b = 2 AND A.c = 3")
@@ -216,7 +400,11 @@ class EnumerationBasedOptimizatorTestCase(unittest.TestCase):
 
         print "JoinOrderEnumeration: "
         greedy_opt = EnumerationBasedOptimizator(test_stats)
-        print_parse_tree(greedy_opt.run(tree))
+        optimized = greedy_opt.run(tree)
+        print_parse_tree(optimized)
+
+        self.assertTrue(greedy_opt.plans_considered > 1)
+        self.assertTrue(plan_cost(test_stats, optimized) <= plan_cost(test_stats, tree))
 
     def test_easy_with_selectivity(self):
         tree = parse_sql("SELECT * FROM R, S, T, U WHERE \
@@ -300,6 +488,51 @@ class GreedyOptimizatorTestCase(unittest.TestCase):
         print_parse_tree(greedy_opt.run(tree))
 
 
+class ProjectionPushDownOptimizatorTestCase(unittest.TestCase):
+    def test_natural_join(self):
+        tree = parse_sql("SELECT R.a FROM R, S WHERE R.b = S.b AND S.c = 3")
+
+        test_stats = {
+            'R': [100, {'a': 10, 'b': 10, 'd': 10}],
+            'S': [100, {'b': 10, 'c': 10, 'e': 10}]
+        }
+
+        tree = PushSelectionDownOptimizator().run(tree)
+        tree = CartesianProductToThetaJoinOptimizator(test_stats).run(tree)
+        tree = ProjectionPushDownOptimizator(test_stats).run(tree)
+        print_parse_tree(tree)
+
+        join = tree.children[0]
+        self.assertTrue(isinstance(join, algebra.NaturalJoin))
+
+        # R only keeps the projected and join attributes
+        left, right = join.children
+        self.assertTrue(isinstance(left, algebra.Projection))
+        self.assertEqual(set(str(f) for f in left.fields), set(['R.a', 'R.b']))
+        self.assertTrue(isinstance(left.children[0], algebra.Relation))
+
+        # S drops the selected attribute once the selection is done, the
+        # selection stays right above the relation
+        self.assertTrue(isinstance(right, algebra.Projection))
+        self.assertEqual([str(f) for f in right.fields], ['S.b'])
+        selection = right.children[0]
+        self.assertTrue(isinstance(selection, algebra.Selection))
+        self.assertTrue(isinstance(selection.children[0], algebra.Relation))
+
+    def test_select_star(self):
+        tree = parse_sql("SELECT * FROM R, S WHERE R.b = S.b")
+
+        test_stats = {
+            'R': [100, {'a': 10, 'b': 10}],
+            'S': [100, {'b': 10, 'c': 10}]
+        }
+
+        tree = PushSelectionDownOptimizator().run(tree)
+        tree = CartesianProductToThetaJoinOptimizator(test_stats).run(tree)
+        tree = ProjectionPushDownOptimizator(test_stats).run(tree)
+
+        self.assertTrue(all(isinstance(c, algebra.Relation) for c in tree.children[0].children))
+
 class HelperTestCase(unittest.TestCase):
     def test_clone_tree(self):
         tree = parse_sql("SELECT * FROM R, S, T WHERE R.a = S.a AND S.t = T.t AND R.a = 8")
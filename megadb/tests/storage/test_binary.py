@@ -0,0 +1,75 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import megadb.settings as settings
+from megadb.storage.binary import *
+from megadb.execution.executor import Schema
+from megadb.execution.plan import Relation
+
+class BinaryRelationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.relations_path = settings.RELATIONS_PATH
+        self.schema = Schema()
+        self.schema.load()
+
+        # work on a copy so that the binary twins don't end up next to the test relations
+        self.directory = tempfile.mkdtemp()
+        for name in ['Schema', 'Alpha', 'Beta']:
+            shutil.copy(os.path.join(self.relations_path, name), self.directory)
+        settings.RELATIONS_PATH = self.directory
+
+    def tearDown(self):
+        settings.RELATIONS_PATH = self.relations_path
+        shutil.rmtree(self.directory)
+
+    def scan(self, name):
+        relation = Relation(None, name, self.schema.relations[name])
+        with relation:
+            return relation.run()
+
+    def test_round_trip(self):
+        text_tuples = self.scan('Beta')
+
+        path = os.path.join(self.directory, 'Beta')
+        convert_relation(path, self.schema.relations['Beta'])
+
+        with open_fresh(path) as store:
+            self.assertEqual(store.row_count, 14)
+            self.assertEqual(store.read_column(1, 2, 5), ['C', 'D', 'E'])
+            self.assertEqual(store.read_column(0, 13, 14), [14])
+
+        self.assertEqual(self.scan('Beta'), text_tuples)
+
+    def test_stale_binary_is_ignored(self):
+        path = os.path.join(self.directory, 'Alpha')
+        convert_relation(path, self.schema.relations['Alpha'])
+        self.assertIsNotNone(open_fresh(path))
+
+        with open(path, 'a') as f:
+            f.write('15#o#XD\n')
+
+        self.assertIsNone(open_fresh(path))
+        self.assertEqual(self.scan('Alpha')[-1], (15, 'o', 'XD'))
+
+    def test_empty_relation(self):
+        path = os.path.join(self.directory, 'Empty')
+        open(path, 'w').close()
+        convert_relation(path, [['a', int], ['b', str]])
+
+        with open_fresh(path) as store:
+            self.assertEqual(store.row_count, 0)
+            self.assertEqual(list(store.batches([0, 1], 10)), [])
+
+    def test_written_aside(self):
+        path = os.path.join(self.directory, 'Beta')
+        convert_relation(path, self.schema.relations['Beta'])
+
+        # no temporary file is left behind, and the twin gets the usual mode
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['Alpha', 'Beta', 'Beta.col', 'Schema'])
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(binary_path(path)).st_mode & 0o777, 0o666 & ~umask)
@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import megadb.settings as settings
+from megadb.storage.btree import *
+from megadb.storage.index import create_index, index_path
+from megadb.algebra.parser import parse_sql, print_parse_tree
+from megadb.optimization.optimizator import (PushSelectionDownOptimizator,
+                                             CartesianProductToThetaJoinOptimizator,
+                                             ProjectionPushDownOptimizator)
+from megadb.execution.executor import Schema, Executor
+from megadb.execution.plan import IndexScan, IndexNestedLoopJoin
+
+class BTreeIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.relations_path = settings.RELATIONS_PATH
+
+        # work on a copy so that the index files don't end up next to the test relations
+        self.directory = tempfile.mkdtemp()
+        for name in ['Schema', 'Alpha', 'Beta']:
+            shutil.copy(os.path.join(self.relations_path, name), self.directory)
+        settings.RELATIONS_PATH = self.directory
+
+        self.schema = Schema()
+        self.schema.load()
+        self.schema.load_statistics()
+        self.executor = Executor(self.schema)
+
+    def tearDown(self):
+        settings.RELATIONS_PATH = self.relations_path
+        shutil.rmtree(self.directory)
+
+    def execute(self, stmt, *optimizators):
+        tree = parse_sql(stmt)
+        for opt in optimizators:
+            tree = opt.run(tree)
+        translated = self.executor.translate_tree(tree)
+        print_parse_tree(translated)
+        return translated, self.executor.execute_plan(translated)
+
+    def test_structure(self):
+        path = os.path.join(self.directory, 'Beta')
+        index = BTreeIndex.build(path, self.schema.relations['Beta'], 'b1', order=3)
+
+        self.assertEqual(len(index), 14)
+        self.assertEqual(index.height, 3)
+        self.assertEqual([key for key, _ in index], range(1, 15))
+
+        for key in range(1, 15):
+            self.assertEqual(len(index.lookup(key)), 1)
+        self.assertEqual(index.lookup(0), [])
+        self.assertEqual(index.lookup(15), [])
+
+    def test_range(self):
+        path = os.path.join(self.directory, 'Beta')
+        index = BTreeIndex.build(path, self.schema.relations['Beta'], 'b1', order=4)
+
+        def keys(*args):
+            return [key for key, _ in index.range(*args)]
+
+        self.assertEqual(keys(3, 6), [3, 4, 5, 6])
+        self.assertEqual(keys(3, 6, False, False), [4, 5])
+        self.assertEqual(keys(None, 2), [1, 2])
+        self.assertEqual(keys(13), [13, 14])
+        self.assertEqual(keys(20), [])
+
+    def test_persistence(self):
+        path = os.path.join(self.directory, 'Alpha')
+        index = create_index(path, self.schema.relations['Alpha'], 'a2', BTreeIndex)
+        loaded = BTreeIndex.load(index_path(path, 'a2', 'btree'))
+
+        self.assertEqual(list(loaded), list(index))
+        self.assertEqual(loaded.lookup('c'), index.lookup('c'))
+        self.assertEqual(loaded.height, index.height)
+
+    def test_range_scan(self):
+        stmt = "SELECT * FROM Beta WHERE Beta.b1 > 3 AND Beta.b1 <= 9"
+        _, expected = self.execute(stmt, PushSelectionDownOptimizator())
+
+        self.schema.create_index('Beta', 'b1', BTreeIndex)
+        translated, result = self.execute(stmt, PushSelectionDownOptimizator())
+
+        self.assertTrue(isinstance(translated.children[0], IndexScan))
+        self.assertEqual(result, expected)
+
+    def test_index_nested_loop_join(self):
+        stmt = "SELECT Alpha.a2, Beta.b2 FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1 AND Alpha.c = 'XD'"
+        optimizators = [PushSelectionDownOptimizator(),
+                        CartesianProductToThetaJoinOptimizator(self.schema.stats),
+                        ProjectionPushDownOptimizator(self.schema.stats)]
+        _, expected = self.execute(stmt, *optimizators)
+
+        self.schema.create_index('Beta', 'b1', BTreeIndex)
+        translated, result = self.execute(stmt, *optimizators)
+
+        join = translated.children[0]
+        self.assertTrue(isinstance(join, IndexNestedLoopJoin))
+        self.assertEqual(join.children[join.inner_side].name, 'Beta')
+        self.assertEqual(sorted(result), sorted(expected))
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import megadb.settings as settings
+from megadb.storage.cache import RelationCache, estimate_size
+from megadb.execution.executor import Schema, Executor
+from megadb.execution.plan import Relation
+
+class RelationCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.loads = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def loader(self, name, tuples):
+        def load():
+            self.loads.append(name)
+            return tuples
+        return load
+
+    def test_hit_and_miss(self):
+        cache = RelationCache(1024 * 1024)
+        path = self.write('R', '1\n')
+
+        first = cache.get('R', path, self.loader('R', [(1,)]))
+        second = cache.get('R', path, self.loader('R', [(1,)]))
+
+        self.assertIs(first, second)
+        self.assertEqual(self.loads, ['R'])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_invalidate_on_change(self):
+        cache = RelationCache(1024 * 1024)
+        path = self.write('R', '1\n')
+        cache.get('R', path, self.loader('R', [(1,)]))
+
+        self.write('R', '1\n2\n')
+        tuples = cache.get('R', path, self.loader('R', [(1,), (2,)]))
+
+        self.assertEqual(tuples, [(1,), (2,)])
+        self.assertEqual(self.loads, ['R', 'R'])
+        self.assertEqual(cache.used, estimate_size(tuples))
+
+    def test_lru_eviction(self):
+        tuples = [(i, 'value') for i in range(100)]
+        cache = RelationCache(estimate_size(list(tuples)) * 2)
+        paths = dict((name, self.write(name, name)) for name in 'RST')
+
+        cache.get('R', paths['R'], self.loader('R', tuples))
+        cache.get('S', paths['S'], self.loader('S', tuples))
+        cache.get('R', paths['R'], self.loader('R', tuples))
+        cache.get('T', paths['T'], self.loader('T', tuples))
+
+        self.assertIn('R', cache)
+        self.assertNotIn('S', cache)
+        self.assertIn('T', cache)
+        self.assertTrue(cache.used <= cache.budget)
+
+    def test_too_large_for_budget(self):
+        cache = RelationCache(1)
+        path = self.write('R', '1\n')
+
+        self.assertEqual(cache.get('R', path, self.loader('R', [(1,)])), [(1,)])
+        self.assertEqual(len(cache), 0)
+
+    def test_batches_stream_on_miss(self):
+        cache = RelationCache(1024 * 1024)
+        path = self.write('R', '1\n2\n')
+
+        def load_batches():
+            self.loads.append('R')
+            yield [(1,)]
+            # the first batch reached the consumer before the rest is parsed
+            self.assertEqual(self.loads, ['R', 'consumed'])
+            yield [(2,)]
+
+        for batch in cache.batches('R', path, load_batches, 10):
+            self.loads.append('consumed')
+
+        self.assertIn('R', cache)
+        self.assertEqual(list(cache.batches('R', path, load_batches, 1)), [[(1,)], [(2,)]])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_batches_too_large_for_budget(self):
+        batch = [(i, 'value') for i in range(100)]
+        cache = RelationCache(estimate_size(batch) * 2)
+        path = self.write('R', 'R')
+
+        batches = list(cache.batches('R', path, lambda: iter([batch] * 3), 100))
+
+        self.assertEqual(batches, [batch] * 3)
+        self.assertNotIn('R', cache)
+        self.assertEqual(cache.used, 0)
+
+class SchemaCacheTestCase(unittest.TestCase):
+    def test_statistics_bypass_cache(self):
+        schema = Schema()
+        schema.load()
+        # analyzed even when the catalog of an earlier run is still fresh
+        schema.analyze()
+
+        self.assertEqual(len(schema.cache), 0)
+
+        for _ in range(2):
+            relation = Relation(None, 'Alpha', schema.relations['Alpha'], schema.cache)
+            with relation:
+                tuples = relation.run()
+
+        self.assertEqual(len(tuples), 9)
+        self.assertIn('Alpha', schema.cache)
+        self.assertEqual((schema.cache.hits, schema.cache.misses), (1, 1))
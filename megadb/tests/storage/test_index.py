@@ -0,0 +1,128 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+import megadb.settings as settings
+from megadb.storage.index import *
+from megadb.algebra.parser import parse_sql, print_parse_tree
+from megadb.optimization.optimizator import (PushSelectionDownOptimizator,
+                                             CartesianProductToThetaJoinOptimizator,
+                                             ProjectionPushDownOptimizator)
+from megadb.algebra.plan import Projection
+from megadb.tree import insert_above
+from megadb.execution.executor import Schema, Executor
+from megadb.execution.plan import IndexScan, Selection
+
+class HashIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.relations_path = settings.RELATIONS_PATH
+
+        # work on a copy so that the index files don't end up next to the test relations
+        self.directory = tempfile.mkdtemp()
+        for name in ['Schema', 'Alpha', 'Beta']:
+            shutil.copy(os.path.join(self.relations_path, name), self.directory)
+        settings.RELATIONS_PATH = self.directory
+
+        self.schema = Schema()
+        self.schema.load()
+        self.schema.load_statistics()
+        self.executor = Executor(self.schema)
+
+    def tearDown(self):
+        settings.RELATIONS_PATH = self.relations_path
+        shutil.rmtree(self.directory)
+
+    def execute(self, stmt, *optimizators):
+        tree = PushSelectionDownOptimizator().run(parse_sql(stmt))
+        for optimizator in optimizators:
+            tree = optimizator.run(tree)
+        return self.execute_tree(tree)
+
+    def execute_tree(self, tree):
+        translated = self.executor.translate_tree(tree)
+        print_parse_tree(translated)
+        return translated, self.executor.execute_plan(translated)
+
+    def test_lookup(self):
+        path = os.path.join(self.directory, 'Beta')
+        index = create_index(path, self.schema.relations['Beta'], 'b1')
+
+        with open(path, 'rb') as relation_file:
+            for offset in index.lookup(3):
+                relation_file.seek(offset)
+                self.assertEqual(relation_file.readline().split('#')[0], '3')
+
+        self.assertEqual(index.lookup(100), [])
+        self.assertEqual(len(HashIndex.load(index_path(path, 'b1'))), len(index))
+
+    def test_index_scan(self):
+        stmt = "SELECT * FROM Beta WHERE Beta.c = 'A' AND Beta.b1 > 2"
+        _, expected = self.execute(stmt)
+
+        self.schema.create_index('Beta', 'c')
+        translated, result = self.execute(stmt)
+
+        self.assertEqual(result, expected)
+        self.assertTrue(isinstance(translated.children[0], Selection))
+        self.assertTrue(isinstance(translated.children[0].children[0], IndexScan))
+
+        # the scan is estimated on its own, below the residual selection
+        selection = translated.children[0]
+        scan = selection.children[0]
+        self.assertIsNotNone(scan.estimated_size)
+        self.assertTrue(scan.estimated_size >= selection.estimated_size)
+
+    def test_index_scan_with_projection_push_down(self):
+        stmt = "SELECT Alpha.a2 FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1 AND Beta.c = 'A'"
+        optimizators = [CartesianProductToThetaJoinOptimizator(self.schema.stats),
+                        ProjectionPushDownOptimizator(self.schema.stats)]
+        _, expected = self.execute(stmt, *optimizators)
+
+        self.schema.create_index('Beta', 'c')
+        translated, result = self.execute(stmt, *optimizators)
+
+        self.assertEqual(sorted(result), sorted(expected))
+        beta = translated.children[0].children[1].children[0]
+        self.assertTrue(isinstance(beta, IndexScan))
+        self.assertEqual(beta.columns, ['b1', 'c'])
+
+    def test_index_scan_below_projection(self):
+        stmt = "SELECT Beta.b2 FROM Beta WHERE Beta.c = 'A'"
+        _, expected = self.execute(stmt)
+
+        # a projection between the selection and the relation
+        tree = PushSelectionDownOptimizator().run(parse_sql(stmt))
+        relation = tree.children[0].children[0]
+        insert_above(relation, Projection(None, [f for f in self.executor.extract_fields(relation)
+                                                 if f.name != 'b1']))
+
+        self.schema.create_index('Beta', 'c')
+        translated, result = self.execute_tree(tree)
+
+        self.assertEqual(result, expected)
+        self.assertTrue(isinstance(translated.children[0], IndexScan))
+        self.assertEqual(translated.children[0].columns, ['b2', 'c'])
+
+    def test_indexes_are_loaded(self):
+        self.schema.create_index('Alpha', 'a2')
+
+        schema = Schema()
+        schema.load()
+        self.assertEqual(schema.indexes.keys(), [('Alpha', 'a2')])
+
+    def test_stale_index_is_rebuilt(self):
+        stmt = "SELECT * FROM Alpha WHERE Alpha.a1 = 10"
+        self.schema.create_index('Alpha', 'a1')
+        _, result = self.execute(stmt)
+        self.assertEqual(result, [])
+
+        # make sure the fingerprint changes even on coarse mtime resolution
+        time.sleep(0.01)
+        with open(os.path.join(self.directory, 'Alpha'), 'a') as f:
+            f.write('10#J#Z\n')
+
+        translated, result = self.execute(stmt)
+        self.assertTrue(isinstance(translated.children[0], IndexScan))
+        self.assertEqual([[v for _, v in t] for t in result], [[10, 'J', 'Z']])
@@ -0,0 +1,57 @@
+import unittest
+
+from megadb.storage.sketch import *
+
+class HyperLogLogTestCase(unittest.TestCase):
+    def assertClose(self, estimate, expected, error=0.05):
+        self.assertTrue(abs(estimate - expected) <= expected * error,
+                        "%d is not within %d%% of %d" % (estimate, error * 100, expected))
+
+    def test_estimate(self):
+        for n in [10, 1000, 20000]:
+            ints, strs = HyperLogLog(), HyperLogLog()
+            for i in xrange(n):
+                # every value twice, duplicates don't count
+                for _ in range(2):
+                    ints.add(i)
+                    strs.add('value %d' % i)
+
+            self.assertClose(len(ints), n)
+            self.assertClose(len(strs), n)
+
+    def test_empty(self):
+        self.assertEqual(len(HyperLogLog()), 0)
+
+    def test_update(self):
+        left, right = HyperLogLog(10), HyperLogLog(10)
+        for i in xrange(3000):
+            left.add(i)
+            right.add(i + 1000)
+
+        left.update(right)
+        self.assertClose(len(left), 4000, 0.1)
+        self.assertRaises(ValueError, left.update, HyperLogLog(12))
+
+    def test_precision(self):
+        self.assertRaises(ValueError, HyperLogLog, 2)
+        self.assertEqual(len(HyperLogLog(4).registers), 16)
+
+class ReservoirSampleTestCase(unittest.TestCase):
+    def test_small_stream(self):
+        sample = ReservoirSample(10)
+        for i in range(5):
+            sample.add(i)
+
+        self.assertEqual(list(sample), range(5))
+
+    def test_bounded(self):
+        sample = ReservoirSample(100, seed=1)
+        for i in xrange(10000):
+            sample.add(i)
+
+        self.assertEqual(len(sample), 100)
+        self.assertEqual(sample.count, 10000)
+        self.assertEqual(len(set(sample)), 100)
+        # roughly uniform: about half of the sample comes from each half of the stream
+        low = len([i for i in sample if i < 5000])
+        self.assertTrue(30 < low < 70)
@@ -0,0 +1,191 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import megadb.settings as settings
+from megadb.algebra.plan import Field, Comparison
+from megadb.storage.statistics import *
+from megadb.execution.executor import Schema
+
+class StatisticsCatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.relations_path = settings.RELATIONS_PATH
+
+        # work on a copy so that the catalog doesn't end up next to the test relations
+        self.directory = tempfile.mkdtemp()
+        for name in ['Schema', 'Alpha', 'Beta']:
+            shutil.copy(os.path.join(self.relations_path, name), self.directory)
+        settings.RELATIONS_PATH = self.directory
+
+    def tearDown(self):
+        settings.RELATIONS_PATH = self.relations_path
+        shutil.rmtree(self.directory)
+
+    def load_schema(self):
+        schema = Schema()
+        schema.load()
+        schema.load_statistics()
+        return schema
+
+    def tamper(self, rname, total):
+        """Replace the total of rname in the catalog, to see whether it is
+        read back or recomputed"""
+        catalog = StatisticsCatalog(catalog_path(self.directory))
+        catalog.load()
+        fingerprint, signature, stats = catalog.entries[rname]
+        stats['total'] = total
+        catalog.entries[rname] = (fingerprint, signature, stats)
+        catalog.save()
+
+    def test_statistics(self):
+        schema = self.load_schema()
+
+        self.assertEqual(schema.stats['Alpha'][0], 9)
+        self.assertEqual(schema.stats['Alpha'][1], {'a1': 8, 'a2': 9, 'c': 4})
+        b1 = schema.column_stats['Beta']['b1']
+        self.assertEqual((b1['distinct'], b1['min'], b1['max']), (14, 1, 14))
+        self.assertTrue(os.path.exists(catalog_path(self.directory)))
+
+        # the catalog gets the mode of the other files, not mkstemp's
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(catalog_path(self.directory)).st_mode & 0o777, 0o666 & ~umask)
+
+    def test_reuse_fresh_entries(self):
+        self.load_schema()
+        self.tamper('Alpha', 1000)
+        self.tamper('Beta', 2000)
+
+        schema = self.load_schema()
+        self.assertEqual(schema.stats['Alpha'][0], 1000)
+        self.assertEqual(schema.stats['Beta'][0], 2000)
+
+    def test_refresh_changed_relations(self):
+        self.load_schema()
+        self.tamper('Alpha', 1000)
+        self.tamper('Beta', 2000)
+
+        with open(os.path.join(self.directory, 'Alpha'), 'a') as f:
+            f.write('20#t#XD\n')
+
+        schema = self.load_schema()
+        self.assertEqual(schema.stats['Alpha'][0], 10)
+        self.assertEqual(schema.column_stats['Alpha']['a1']['max'], 20)
+        # only the changed relation was analyzed again
+        self.assertEqual(schema.stats['Beta'][0], 2000)
+
+    def test_analyze(self):
+        schema = self.load_schema()
+        self.tamper('Beta', 2000)
+
+        schema.analyze(['Beta'])
+        self.assertEqual(schema.stats['Beta'][0], 14)
+        self.assertEqual(self.load_schema().stats['Beta'][0], 14)
+
+    def test_approximate(self):
+        settings.STATISTICS_MODE = 'approximate'
+        settings.STATISTICS_SAMPLE_SIZE = 5
+        try:
+            schema = self.load_schema()
+        finally:
+            settings.STATISTICS_MODE = 'exact'
+            settings.STATISTICS_SAMPLE_SIZE = 10000
+
+        # few values are counted exactly
+        self.assertEqual(schema.stats['Alpha'], [9, {'a1': 8, 'a2': 9, 'c': 4}])
+        self.assertEqual(schema.column_stats['Beta']['b1']['max'], 14)
+
+        catalog = StatisticsCatalog(catalog_path(self.directory))
+        catalog.load()
+        _, _, stats = catalog.entries['Beta']
+        self.assertEqual(stats['mode'], 'approximate')
+        self.assertEqual(len(stats['sample']), 5)
+
+        # going back to exact statistics analyzes the relations again
+        self.tamper('Beta', 2000)
+        self.assertEqual(self.load_schema().stats['Beta'][0], 14)
+
+    def test_compute_statistics(self):
+        fields = [['a', int], ['b', str]]
+        tuples = [(i, str(i % 7)) for i in range(5000)]
+
+        exact = compute_statistics(fields, tuples)
+        self.assertEqual(exact['columns']['a']['distinct'], 5000)
+        self.assertEqual(exact['columns']['b']['distinct'], 7)
+
+        approximate = compute_statistics(fields, tuples, 'approximate', 100)
+        self.assertTrue(abs(approximate['columns']['a']['distinct'] - 5000) < 250)
+        self.assertEqual(approximate['columns']['b']['distinct'], 7)
+        self.assertEqual(approximate['columns']['a']['min'], 0)
+        self.assertEqual(approximate['columns']['a']['max'], 4999)
+        self.assertEqual(len(approximate['sample']), 100)
+
+        self.assertRaises(ValueError, compute_statistics, fields, tuples, 'guess')
+
+    def test_unreadable_catalog(self):
+        with open(catalog_path(self.directory), 'w') as f:
+            f.write('garbage')
+
+        self.assertEqual(self.load_schema().stats['Beta'][0], 14)
+
+    def test_failed_save(self):
+        # a directory in the way of the catalog makes the rename fail
+        os.mkdir(catalog_path(self.directory))
+        catalog = StatisticsCatalog(catalog_path(self.directory))
+
+        self.assertFalse(catalog.save())
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['Alpha', 'Beta', 'Schema', CATALOG_NAME])
+
+class SelectivityTestCase(unittest.TestCase):
+    def setUp(self):
+        # grades skewed towards 'A', years spread evenly over 2000 - 2019
+        fields = [['grade', str], ['year', int]]
+        self.tuples = [('A' if i % 10 < 6 else 'BCDFX'[i % 5], 2000 + i % 20) for i in range(1000)]
+        stats = compute_statistics(fields, self.tuples, mcv_size=3, buckets=10)
+
+        self.stats = Statistics({'G': [stats['total'], dict(
+            (fname, c['distinct']) for fname, c in stats['columns'].items())]})
+        self.stats.columns['G'] = stats['columns']
+
+    def selectivity(self, x, y, comp):
+        return selectivity(self.stats, 'G', Comparison(x, y, comp))
+
+    def test_distribution(self):
+        mcv, histogram = column_distribution({'a': 6, 'b': 1, 'c': 1, 'd': 2}, 1, 2)
+        self.assertEqual(mcv, [('a', 0.6)])
+        self.assertEqual(histogram, ['b', 'c', 'd'])
+
+        # as many values as the list holds are all listed
+        mcv, histogram = column_distribution({1: 1, 2: 3}, 2, 10)
+        self.assertEqual(mcv, [(2, 0.75), (1, 0.25)])
+        self.assertEqual(histogram, [])
+
+        column = self.stats.columns['G']['year']
+        self.assertEqual(len(column['histogram']), 11)
+        self.assertEqual((column['histogram'][0], column['histogram'][-1]), (2000, 2019))
+
+    def test_equality(self):
+        grade = Field('G.grade')
+        self.assertAlmostEqual(self.selectivity(grade, 'A', '='), 0.6)
+        self.assertAlmostEqual(self.selectivity(grade, 'A', '!='), 0.4)
+        # a value out of the most common ones shares the rest with the others
+        self.assertAlmostEqual(self.selectivity('F', grade, '='), 0.1)
+        self.assertAlmostEqual(self.selectivity(grade, 'Z', '='), 0.001)
+
+    def test_ranges(self):
+        year = Field('G.year')
+        for comp, value in [('<', 2005), ('<=', 2010), ('>', 2014), ('>=', 2000), ('<', 2000)]:
+            actual = len([t for t in self.tuples if eval('t[1] %s %d' % (comp, value))]) / 1000.0
+            estimate = self.selectivity(year, str(value), comp)
+            self.assertTrue(abs(estimate - actual) <= 0.1, (comp, value, estimate, actual))
+
+        # the literal on the left flips the comparison
+        self.assertAlmostEqual(self.selectivity('2010', year, '>'), self.selectivity(year, '2010', '<'))
+
+    def test_without_columns(self):
+        stats = {'G': [1000, {'grade': 6, 'year': 20}]}
+        self.assertAlmostEqual(selectivity(stats, 'G', Comparison(Field('G.year'), '3', '=')), 0.05)
+        self.assertAlmostEqual(selectivity(stats, 'G', Comparison(Field('G.year'), '3', '<')),
+                               DEFAULT_RANGE_SELECTIVITY)
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from megadb.server import *
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.schema = load_schema()
+
+        self.server = QueryServer(('127.0.0.1', 0), self.schema)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_run_query(self):
+        fields, rows, _, _ = run_query(self.schema, "SELECT Alpha.a2 FROM Alpha WHERE Alpha.a1 = 3")
+        self.assertEqual(fields, ['Alpha.a2'])
+        self.assertEqual(sorted(rows), [['c'], ['cc']])
+
+        self.assertRaises(ValueError, run_query, self.schema, "SELECT * FROM Alpha", ['Missing'])
+
+    def test_concurrent_clients(self):
+        stmt = "SELECT * FROM Alpha, Beta WHERE Alpha.a1 = Beta.b1"
+        _, expected, _, _ = run_query(self.schema, stmt)
+
+        results = []
+        def client():
+            with QueryClient(self.server.server_address) as c:
+                for _ in range(3):
+                    results.append(c.execute(stmt))
+
+        threads = [threading.Thread(target=client) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(results), 12)
+        for response in results:
+            self.assertEqual(len(response['fields']), 6)
+            self.assertEqual(sorted(response['rows']), sorted(expected))
+
+    def test_error(self):
+        with QueryClient(self.server.server_address) as c:
+            self.assertIn('error', c.execute("SELECT * FROM Missing"))
+
+            # the connection is still usable
+            response = c.execute("SELECT * FROM Beta", [], 'row')
+            self.assertEqual(len(response['rows']), 14)
+
+    def test_analyze(self):
+        with QueryClient(self.server.server_address) as c:
+            response = c.execute("SELECT Beta.b2 FROM Beta WHERE Beta.c = 'XD'", analyze=True)
+
+        profile = response['profile']
+        self.assertEqual(profile['rows_out'], len(response['rows']))
+        self.assertEqual(profile['children'][0]['predicate_evaluations'], 14)
+
+    def test_unix_socket(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'megadb.sock')
+        server = UnixQueryServer(path, self.schema)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            with QueryClient(path) as c:
+                self.assertEqual(len(c.execute("SELECT * FROM Alpha")['rows']), 9)
+        finally:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(directory)
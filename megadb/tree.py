@@ -22,3 +22,26 @@ class TreeNode(HasParent):
     def __init__(self, parent):
         super(TreeNode, self).__init__(parent)
         self.children = []
+
+def insert_above(node, new_node):
+    """Put new_node between node and its parent, at node's position."""
+    parent = node.parent
+    if parent is None:
+        node.parent = new_node
+        return
+
+    inx = parent.children.index(node)
+    node.parent = new_node
+    new_node.parent = parent
+    parent.children.insert(inx, parent.children.pop())
+
+def replace(node, new_node):
+    """Put new_node at node's position under node's parent, detaching node."""
+    parent = node.parent
+    if parent is None:
+        return
+
+    inx = parent.children.index(node)
+    node.parent = None
+    new_node.parent = parent
+    parent.children.insert(inx, parent.children.pop())